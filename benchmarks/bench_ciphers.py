@@ -0,0 +1,42 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pypass import records, ciphers
+from pypass.crypto import MasterKey
+
+
+def main():
+	parser = argparse.ArgumentParser(description = "Compare the cipher suites' record encode/decode throughput and size on disk.")
+	parser.add_argument("-n", "--records", type = int, default = 20000)
+	parser.add_argument("-s", "--suites", nargs = "*", default = list(ciphers.SUITES), choices = list(ciphers.SUITES))
+	args = parser.parse_args()
+
+	old_cwd = os.getcwd()
+	tmp = tempfile.mkdtemp()
+	try:
+		os.chdir(tmp)
+		key = MasterKey("benchmark")
+		items = [(f"folder{os.sep}account{i}", [f"password{i}", f"user{i}@example.com", "notes " * (i % 20)]) for i in range(args.records)]
+		print(f"{'suite':>18} {'encode/s':>9} {'decode/s':>9} {'bytes/record':>13}")
+		for name in args.suites:
+			key.suite = name
+			start = time.perf_counter()
+			encoded = records.encode_many(key, items)
+			encode = len(items) / (time.perf_counter() - start)
+			start = time.perf_counter()
+			records.decode_many(key, encoded)
+			decode = len(items) / (time.perf_counter() - start)
+			size = sum(len(data) for name, data in encoded) / len(encoded)
+			print(f"{name:>18} {encode:>9.0f} {decode:>9.0f} {size:>13.1f}")
+	finally:
+		os.chdir(old_cwd)
+		shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,40 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pypass.database import Database
+from vault import synthetic_names
+
+
+def main():
+	parser = argparse.ArgumentParser(description = "Time decrypting a whole synthetic vault with export.")
+	parser.add_argument("-n", "--accounts", type = int, default = 10000)
+	parser.add_argument("-w", "--workers", type = int, nargs = "*",
+		default = sorted({1, 2, os.cpu_count() or 1}))
+	args = parser.parse_args()
+
+	old_cwd = os.getcwd()
+	tmp = tempfile.mkdtemp()
+	try:
+		db = Database(tmp, "benchmark")
+		os.chdir(tmp)
+		blocks = ([name, f"pw{i}", f"user{i}@example.com", "notes " * 10] for i, name in enumerate(synthetic_names(args.accounts)))
+		db.load_blocks(blocks)
+
+		print(f"{'accounts':>9} {'workers':>8} {'seconds':>8} {'accounts/s':>11}")
+		for workers in args.workers:
+			start = time.perf_counter()
+			count = sum(1 for account in db.export(workers = workers))
+			elapsed = time.perf_counter() - start
+			print(f"{count:>9} {workers:>8} {elapsed:>8.2f} {count / elapsed:>11.0f}")
+	finally:
+		os.chdir(old_cwd)
+		shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+	main()
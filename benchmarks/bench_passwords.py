@@ -0,0 +1,48 @@
+import sys
+import os
+import time
+import secrets
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pypass.crypto import generate_passwords
+
+
+def rejection(n, length, symbols):
+	"""
+	The previous generator: draw every character with secrets.choice() and start over unless each charset shows up.
+	"""
+	charsets = ["abcdefghijkmnpqrstuvwxyz", "ABCDEFGHJKLMNPQRSTUVWXYZ", "23456789"]
+	if symbols is None:
+		charsets.append("!@#$%^&*()-+=.,?<>_:{}|*/")
+	elif symbols != "":
+		charsets.append(symbols)
+	alphabet = "".join(charsets)
+	passwords = []
+	while len(passwords) < n:
+		password = "".join(secrets.choice(alphabet) for i in range(length))
+		if all(any(d in password for d in group) for group in charsets):
+			passwords.append(password)
+	return passwords
+
+def main():
+	parser = argparse.ArgumentParser(description = "Compare password generation throughput with the previous rejection sampling generator.")
+	parser.add_argument("-n", "--passwords", type = int, default = 20000)
+	parser.add_argument("-l", "--lengths", type = int, nargs = "*", default = [8, 16, 32, 64])
+	args = parser.parse_args()
+
+	print(f"{'length':>6} {'symbols':>8} {'rejection/s':>12} {'batch/s':>10} {'single/s':>10}")
+	for length in args.lengths:
+		for symbols in [None, "", "!"]:
+			runs = []
+			for func in [lambda: rejection(args.passwords, length, symbols),
+					lambda: generate_passwords(args.passwords, length, symbols),
+					lambda: [generate_passwords(1, length, symbols) for i in range(args.passwords)]]:
+				start = time.perf_counter()
+				func()
+				runs.append(args.passwords / (time.perf_counter() - start))
+			print(f"{length:>6} {repr(symbols):>8} {runs[0]:>12.0f} {runs[1]:>10.0f} {runs[2]:>10.0f}")
+
+if __name__ == "__main__":
+	main()
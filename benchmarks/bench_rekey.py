@@ -0,0 +1,43 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pypass.database import Database
+from vault import synthetic_names
+
+
+def main():
+	parser = argparse.ArgumentParser(description = "Time re-encrypting a whole synthetic vault, with and without its backups, under a new data key.")
+	parser.add_argument("-n", "--accounts", type = int, default = 10000)
+	parser.add_argument("-w", "--workers", type = int, nargs = "*",
+		default = sorted({1, 2, os.cpu_count() or 1}))
+	parser.add_argument("-k", "--kind", default = "dir", choices = ["dir", "packed"])
+	args = parser.parse_args()
+
+	old_cwd = os.getcwd()
+	tmp = tempfile.mkdtemp()
+	try:
+		db = Database(tmp, "benchmark")
+		os.chdir(tmp)
+		db.migrate(args.kind)
+		blocks = ([name, f"pw{i}", f"user{i}@example.com", "notes " * 10] for i, name in enumerate(synthetic_names(args.accounts)))
+		db.load_blocks(blocks)
+
+		print(f"{'accounts':>9} {'backups':>8} {'workers':>8} {'files':>8} {'seconds':>8} {'files/s':>8}")
+		for backups in [False, True]:
+			for workers in args.workers:
+				start = time.perf_counter()
+				count = db.rekey("benchmark", backups, workers)
+				elapsed = time.perf_counter() - start
+				print(f"{args.accounts:>9} {str(backups):>8} {workers:>8} {count:>8} {elapsed:>8.2f} {count / elapsed:>8.0f}")
+	finally:
+		os.chdir(old_cwd)
+		shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,46 @@
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pypass.index import AccountIndex
+from pypass.match import Matcher
+from vault import synthetic_names
+
+
+def select(index, matcher, filter):
+	"""
+	Database.select() without the prompt.
+	"""
+	if filter in index:
+		matched = [filter]
+	else:
+		matched = index.search(filter)
+		if len(matched) == 0:
+			matched = index.fuzzy(filter)
+	return matcher.rank(filter, matched)
+
+def main():
+	parser = argparse.ArgumentParser(description = "Time account selection against synthetic vaults.")
+	parser.add_argument("sizes", nargs = "*", type = int, default = [10000, 100000])
+	parser.add_argument("-r", "--repeat", type = int, default = 20)
+	args = parser.parse_args()
+
+	matcher = Matcher()
+	print(f"{'accounts':>9} {'query':>14} {'matches':>8} {'ms/query':>9}")
+	for n in args.sizes:
+		names = synthetic_names(n)
+		index = AccountIndex(names)
+		queries = [names[n // 2], "netflix-1", "gml", "shpamz", "xyzzy"]
+		for query in queries:
+			select(index, matcher, query) # builds the lazy structures
+			start = time.perf_counter()
+			for i in range(args.repeat):
+				ranked = select(index, matcher, query)
+			ms = (time.perf_counter() - start) / args.repeat * 1000
+			print(f"{n:>9} {query[-14:]:>14} {len(ranked):>8} {ms:>9.3f}")
+
+if __name__ == "__main__":
+	main()
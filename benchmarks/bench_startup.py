@@ -0,0 +1,111 @@
+import sys
+import os
+import time
+import shutil
+import socket
+import tempfile
+import argparse
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from vault import MASTER, synthetic_names
+
+HEAVY = ["cryptography", "pyperclip", "asyncio", "multiprocessing"]
+
+
+def pypass(tree, env, args, importtime = False):
+	"""
+	Run 'python -m pypass ARGS' from a source tree. Return the wall time and stderr.
+	"""
+	cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-m", "pypass"] + args
+	start = time.perf_counter()
+	proc = subprocess.run(cmd, input = MASTER + "\n", capture_output = True, text = True, env = env, cwd = tree)
+	elapsed = time.perf_counter() - start
+	if proc.returncode != 0:
+		raise RuntimeError(f"{' '.join(args)} failed: {proc.stdout}{proc.stderr}")
+	return elapsed, proc.stderr
+
+def imports(stderr):
+	"""
+	Return the total import time in seconds and the names of all imported modules, from -X importtime output.
+	"""
+	total   = 0
+	modules = []
+	for line in stderr.splitlines():
+		if not line.startswith("import time:") or "cumulative" in line:
+			continue
+		self_us, cumulative_us, name = line[len("import time:"):].split("|")
+		if not name.startswith("  "):
+			total += int(cumulative_us) # top level
+		modules.append(name.strip())
+	return total / 1e6, modules
+
+def start_agent(tree, env):
+	proc = subprocess.Popen([sys.executable, "-m", "pypass", "agent"], stdin = subprocess.PIPE,
+		stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, text = True, env = env, cwd = tree)
+	proc.stdin.write(MASTER + "\n")
+	proc.stdin.flush()
+	for i in range(500):
+		try:
+			with socket.socket(socket.AF_UNIX) as s:
+				s.connect(env["PYPASS_SOCKET"])
+			return proc
+		except OSError:
+			time.sleep(0.02)
+	proc.kill()
+	raise RuntimeError("Agent did not start.")
+
+def main():
+	parser = argparse.ArgumentParser(description = "Time starting pypass for one-shot commands, directly and through an agent, and break down import costs.")
+	parser.add_argument("-n", "--accounts", type = int, default = 1000)
+	parser.add_argument("-r", "--repeat", type = int, default = 5)
+	parser.add_argument("--tree", default = os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+		help = "source tree to run, e.g. a 'git worktree' of an older revision")
+	parser.add_argument("--baseline", default = None,
+		help = "another source tree to time direct commands from as well, e.g. 'git worktree add /tmp/base <revision>'; trees that only have interactive mode log in and run 'ls' instead, keeping their database in the tree")
+	parser.add_argument("--no-agent", dest = "agent", action = "store_false")
+	args = parser.parse_args()
+
+	tmp = tempfile.mkdtemp()
+	env = dict(os.environ, PYTHONPATH = args.tree, PYPASS_DB = os.path.join(tmp, "db"), PYPASS_SOCKET = os.path.join(tmp, "agent.sock"))
+	env.pop("PYTHONDONTWRITEBYTECODE", None) # time starting from cached bytecode, as installed
+	try:
+		from pypass.database import Database
+		os.mkdir(env["PYPASS_DB"])
+		db = Database(env["PYPASS_DB"], MASTER)
+		names = synthetic_names(args.accounts)
+		db.load_blocks([name, f"pw{i}"] for i, name in enumerate(names))
+		target = names[len(names) // 2]
+		commands = [["ls"], ["copy", target, "--no-clip"]]
+
+		runs = [("baseline", args.baseline, "direct")] if args.baseline else []
+		runs.append(("tree", args.tree, "direct"))
+		if args.agent and hasattr(socket, "AF_UNIX"):
+			runs.append(("tree", args.tree, "agent"))
+		print(f"{'tree':>8} {'command':>8} {'mode':>7} {'wall ms':>8} {'import ms':>10} {'modules':>8}  heavy imports")
+		for label, tree, mode in runs:
+			tree_env = dict(env, PYTHONPATH = tree)
+			agent = start_agent(tree, tree_env) if mode == "agent" else None
+			try:
+				for command in commands:
+					try:
+						pypass(tree, tree_env, command) # warm up, e.g. write bytecode
+						wall = statistics.median(pypass(tree, tree_env, command)[0] for i in range(args.repeat))
+						total, modules = imports(pypass(tree, tree_env, command, importtime = True)[1])
+					except RuntimeError:
+						# e.g. an older tree without this mode
+						print(f"{label:>8} {command[0]:>8} {mode:>7} {'n/a':>8}")
+						continue
+					heavy = ", ".join(h for h in HEAVY if h in modules) or "-"
+					print(f"{label:>8} {command[0]:>8} {mode:>7} {wall * 1000:>8.0f} {total * 1000:>10.0f} {len(modules):>8}  {heavy}")
+			finally:
+				if agent is not None:
+					agent.terminate()
+					agent.wait()
+	finally:
+		shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+	main()
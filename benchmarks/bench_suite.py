@@ -0,0 +1,162 @@
+import sys
+import os
+import io
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import argparse
+import statistics
+import contextlib
+import subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from vault import MASTER, make_vault, synthetic_blocks, synthetic_names
+
+
+def measure(func, repeat):
+	"""
+	Call func(i) for i in range(repeat). Return the seconds each call took.
+	"""
+	times = []
+	for i in range(repeat):
+		start = time.perf_counter()
+		func(i)
+		times.append(time.perf_counter() - start)
+	return times
+
+def run(size, args, tmp):
+	"""
+	Build a synthetic vault of size accounts in tmp and time the operations on it. Yield a result for each operation.
+	"""
+	from pypass.crypto import MasterKey
+	from pypass.database import Database
+	from pypass.parser import Parser
+
+	dir = os.path.join(tmp, str(size))
+	start = time.perf_counter()
+	db, names = make_vault(dir, size, args.depth, args.notes, args.history, args.kind)
+	yield {"size": size, "op": "generate", "items": size, "runs": [time.perf_counter() - start]}
+
+	rand  = random.Random(size)
+	picks = rand.sample(names, args.repeat)
+	new   = [f"bench{os.sep}new-{i}" for i in range(args.repeat)]
+	files = []
+	for i in range(args.repeat):
+		path = os.path.join(tmp, f"load-{size}-{i}.txt")
+		with open(path, "w") as f:
+			for block in synthetic_blocks([f"loaded{os.sep}{i}-{name}" for name in synthetic_names(args.load, seed = i)], args.notes):
+				f.write("\n".join(block).replace(os.sep, "/") + "\n\n")
+		files.append(path)
+	quiet  = io.StringIO()
+	parser = Parser(db)
+	ops = [
+		("login", 1, lambda i: MasterKey(MASTER)),
+		("init", 1, lambda i: Database(".", MASTER)),
+		("accounts", 1, lambda i: db.accounts()),
+		("accounts:filter", 1, lambda i: db.accounts("mail")),
+		("select", 1, lambda i: db.select(picks[i])),
+		("select:fuzzy", 1, lambda i: db.candidates("gml")),
+		("content", 1, lambda i: db.content(picks[i])),
+		("add_block", 1, lambda i: db.add_block(new[i], [f"pw{i}", "note"])),
+		("mv", 1, lambda i: db.mv(picks[i], picks[i] + "-moved")),
+		("load", args.load, lambda i: parser.parse(["load", files[i]])),
+	]
+	old_cwd = os.getcwd()
+	os.chdir(dir)
+	try:
+		for op, items, func in ops:
+			if args.ops and op.split(":")[0] not in args.ops:
+				continue
+			with contextlib.redirect_stdout(quiet), contextlib.redirect_stderr(quiet):
+				runs = measure(func, args.repeat)
+			quiet.seek(0)
+			quiet.truncate()
+			yield {"size": size, "op": op, "items": items, "runs": runs}
+	finally:
+		os.chdir(old_cwd)
+
+def summarize(result):
+	result["median"] = statistics.median(result["runs"])
+	result["min"]    = min(result["runs"])
+	return result
+
+def metadata(args):
+	tree = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+	try:
+		revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = tree, capture_output = True, text = True).stdout.strip() or None
+	except OSError:
+		revision = None
+	return {
+		"date":     time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"revision": revision,
+		"python":   platform.python_version(),
+		"platform": platform.platform(),
+		"cpus":     os.cpu_count(),
+		"args":     vars(args),
+	}
+
+def compare(old, new, threshold):
+	"""
+	Print the median times of two result files side by side. Return the (size, op) pairs that got slower by more than the threshold fraction.
+	"""
+	before = {(r["size"], r["op"]): r for r in old["results"]}
+	slower = []
+	print(f"{'accounts':>9} {'operation':>16} {'old ms':>9} {'new ms':>9} {'change':>7}")
+	for r in new["results"]:
+		o = before.get((r["size"], r["op"]))
+		if o is None:
+			continue
+		change = r["median"] / o["median"] - 1 if o["median"] > 0 else 0
+		flag = ""
+		if change > threshold:
+			slower.append((r["size"], r["op"]))
+			flag = "  slower"
+		print(f"{r['size']:>9} {r['op']:>16} {o['median'] * 1000:>9.3f} {r['median'] * 1000:>9.3f} {change:>+7.0%}{flag}")
+	return slower
+
+def main():
+	parser = argparse.ArgumentParser(description = "Time the main database operations end to end on synthetic vaults of several sizes, and save the results as JSON to compare runs for regressions.")
+	parser.add_argument("sizes", nargs = "*", type = int, default = [1000, 10000, 100000])
+	parser.add_argument("-r", "--repeat", type = int, default = 5)
+	parser.add_argument("-o", "--output", default = "bench.json", help = "where to write the results (default: bench.json)")
+	parser.add_argument("--ops", nargs = "*", default = None, help = "operations to time (default: all)")
+	parser.add_argument("-d", "--depth", type = int, default = 2, help = "deepest folder nesting")
+	parser.add_argument("--notes", type = int, default = 60, help = "bytes of notes per account")
+	parser.add_argument("--history", type = int, default = 1, help = "earlier versions per account in the backups")
+	parser.add_argument("--load", type = int, default = 1000, help = "accounts per file timed with load")
+	parser.add_argument("-k", "--kind", default = "dir", choices = ["dir", "packed"])
+	parser.add_argument("--baseline", default = None, help = "results of an earlier run to compare with")
+	parser.add_argument("--threshold", type = float, default = 0.25, help = "slowdown that counts as a regression (default: 0.25)")
+	parser.add_argument("--compare", nargs = 2, metavar = ("OLD", "NEW"), default = None, help = "only compare two result files")
+	args = parser.parse_args()
+
+	if args.compare:
+		old, new = [json.load(open(path)) for path in args.compare]
+		sys.exit(1 if compare(old, new, args.threshold) else 0)
+
+	results = []
+	tmp = tempfile.mkdtemp()
+	try:
+		print(f"{'accounts':>9} {'operation':>16} {'median ms':>10} {'min ms':>9} {'items/s':>9}")
+		for size in args.sizes:
+			for result in run(size, args, tmp):
+				results.append(summarize(result))
+				rate = result["items"] / result["median"] if result["median"] > 0 else 0
+				print(f"{size:>9} {result['op']:>16} {result['median'] * 1000:>10.3f} {result['min'] * 1000:>9.3f} {rate:>9.0f}", flush = True)
+	finally:
+		shutil.rmtree(tmp)
+
+	report = {"meta": metadata(args), "results": results}
+	with open(args.output, "w") as f:
+		json.dump(report, f, indent = 1)
+	print(f"Wrote {args.output}.")
+	if args.baseline:
+		with open(args.baseline) as f:
+			sys.exit(1 if compare(json.load(f), report, args.threshold) else 0)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,96 @@
+import sys
+import os
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+MASTER = "benchmark"
+WORDS  = ["mail", "bank", "shop", "work", "home", "cloud", "games", "social", "news", "travel",
+	"amazon", "github", "gmail", "netflix", "paypal", "steam", "twitter", "chase", "geico", "spotify"]
+
+
+def synthetic_names(n, seed = 0, depth = 2):
+	"""
+	Generate n distinct account names, up to depth folders deep, shallow ones more often.
+	"""
+	rand   = random.Random(seed)
+	depths = [d for d in range(depth + 1) for i in range(1 if d == depth else 2)]
+	names  = set()
+	while len(names) < n:
+		d = rand.choice(depths)
+		parts = [rand.choice(WORDS) for i in range(d)]
+		parts.append(rand.choice(WORDS) + "-" + str(rand.randint(0, n)))
+		names.add(os.sep.join(parts))
+	return sorted(names)
+
+def synthetic_blocks(names, notes = 60, version = 0, seed = 0):
+	"""
+	Yield a load block for each name: the account name, a password that depends on version, and about notes bytes of notes in lines of up to 60 characters.
+	"""
+	rand = random.Random(seed)
+	for i, name in enumerate(names):
+		text  = " ".join(rand.choice(WORDS) for j in range(max(notes, 0) // 6 + 1))[:notes]
+		lines = [text[j:j + 60] for j in range(0, len(text), 60)]
+		yield [name, f"pw{i}v{version}", f"user{i}@example.com"] + lines
+
+def make_vault(dir, n, depth = 2, notes = 60, history = 0, kind = "dir", master = MASTER, workers = None, seed = 0):
+	"""
+	Create a database in dir with n synthetic accounts, and history earlier versions of each in the backups. Return it, along with the account names.
+	"""
+	from pypass.database import Database
+	os.makedirs(dir, exist_ok = True)
+	db = Database(dir, master)
+	old_cwd = os.getcwd()
+	os.chdir(dir)
+	try:
+		if kind != "dir":
+			db.migrate(kind)
+		names = synthetic_names(n, seed, depth)
+		db.load_blocks(synthetic_blocks(names, notes, 0, seed), workers)
+		for version in range(1, history + 1):
+			update(db, synthetic_blocks(names, notes, version, seed), workers)
+	finally:
+		os.chdir(old_cwd)
+	return db, names
+
+def update(db, blocks, workers = None, batch = 256):
+	"""
+	Overwrite existing accounts in bulk, as load_blocks() adds new ones, saving a new version of each.
+	"""
+	from pypass import records
+	from pypass.workers import chunks, map_with_key
+	digests = {}
+	def items():
+		for block in blocks:
+			digests[block[0]] = db.backups.digest(block[1:])
+			yield block[0], block[1:]
+	saved = []
+	for encoded in map_with_key(records.encode_many, chunks(items(), batch), db.key, workers):
+		failed = db.storage.write_many(encoded)
+		if failed:
+			raise failed[0][1]
+		saved.extend((account, digests.pop(account)) for account, data in encoded)
+	db.backups.save_many(saved, workers, batch)
+	db.storage.flush()
+
+def main():
+	parser = argparse.ArgumentParser(description = "Create a synthetic database to benchmark or experiment with. The master password is 'benchmark'.")
+	parser.add_argument("dir")
+	parser.add_argument("-n", "--accounts", type = int, default = 10000)
+	parser.add_argument("-d", "--depth", type = int, default = 2, help = "deepest folder nesting")
+	parser.add_argument("--notes", type = int, default = 60, help = "bytes of notes per account")
+	parser.add_argument("--history", type = int, default = 0, help = "earlier versions per account in the backups")
+	parser.add_argument("-k", "--kind", default = "dir", choices = ["dir", "packed"])
+	parser.add_argument("-w", "--workers", type = int, default = None)
+	args = parser.parse_args()
+
+	if os.path.exists(args.dir) and os.listdir(args.dir):
+		parser.error(f"{args.dir} is not empty")
+	start = time.perf_counter()
+	make_vault(args.dir, args.accounts, args.depth, args.notes, args.history, args.kind, workers = args.workers)
+	print(f"Created {args.accounts} accounts with {args.history} earlier versions each in {time.perf_counter() - start:.1f} s.")
+
+if __name__ == "__main__":
+	main()
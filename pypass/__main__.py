@@ -1,54 +1,248 @@
 import sys
 import os
-import traceback
-from contextlib import ContextDecorator
 
-from .parser import Parser
-from .database import Database
 from .log import configure_logging
+from . import timing
+from .timing import span
+
+# everything else is imported only by the code paths that need it, so one-shot commands start quickly
 
 
 def main():
+	trace = None
 	try:
 	
-		os.chdir(os.path.dirname(__file__))
-		try:
-			os.mkdir("db")
-		except OSError:
-			pass
-		configure_logging("db/.log")
+		args = sys.argv[1:]
+		if args and args[0] not in ("agent", "--serve"):
+			sys.exit(one_shot(args))
+
+		# only the environment can turn timing on for a whole session
+		profile, trace = timing.requested([])
+		if profile:
+			timing.enable()
+
+		import asyncio
+		from .database import Database
+		from .agent import Agent
+
+		dir = database_dir()
+		start_logging(dir)
 		
 		print("==== pypass ====")
 		
+		# lock the key after this many idle seconds, if set
+		timeout = os.environ.get("PYPASS_TIMEOUT")
+		timeout = float(timeout) if timeout else None
+		if args and timeout is None:
+			timeout = Agent.TIMEOUT
+		
 		# log in
 		while True:		
 			try:
-				db = Database("db")
-				parser = Parser(db)
+				db = Database(dir, timeout = timeout)
 				break
 			except ValueError as e:
 				print(e)
+
+		if args and args[0] == "agent":
+			agent = Agent(db)
+			print(f"Agent listening on {agent.path}. Press Ctrl-C to stop.")
+			try:
+				asyncio.run(agent.run())
+			except ValueError as e:
+				print(e)
+			return
+
+		asyncio.run(interactive(db, serve = bool(args)))
+		
+	except (KeyboardInterrupt, EOFError):
+		pass
+	finally:
+		if trace is not None:
+			timing.write_trace(trace)
+	#except:
+	#	import traceback
+	#	track = traceback.format_exc()
+	#	print(track)
+
+def database_dir():
+	"""
+	Return where the database is kept: $PYPASS_DB, or the 'db' folder inside the package.
+	"""
+	return os.path.abspath(os.environ.get("PYPASS_DB") or os.path.join(os.path.dirname(__file__), "db"))
+
+def start_logging(dir):
+	"""
+	Log to the database folder, creating it if need be, and keep audit records there too if $PYPASS_AUDIT is set (and not '0').
+	"""
+	os.makedirs(dir, exist_ok = True)
+	audit = os.path.join(dir, ".audit") if os.environ.get("PYPASS_AUDIT", "0") not in ("", "0") else None
+	configure_logging(os.path.join(dir, ".log"), audit = audit)
+
+async def interactive(db, serve = False):
+	"""
+	Run commands typed by the user, each in its own thread, while clipboard restores wait on the event loop. If serve, as with --serve, the session also serves agent clients on the same loop, unless another agent is running.
+	"""
+	import asyncio
+	from .agent import Agent
+	from .client import Client
+	from .clipboard import Clipboard
+	from .parser import Parser, in_thread
+
+	clipboard = Clipboard(asyncio.get_running_loop())
+	parser = Parser(db, clipboard)
+	agent  = None
+	if serve and Client.running():
+		print("Error: An agent is already running, so this session won't serve its clients.")
+	elif serve:
+		agent = Agent(db, lock = parser.lock, clipboard = clipboard)
+		serving = asyncio.create_task(agent.run())
+		print(f"Serving agent clients on {agent.path}.")
+	try:
 		print("Entering interactive mode. Enter a blank line to exit.")
-		parser.parse("ls")
+		await parser.run("ls")
 		
 		# parse input
 		while True:
-			line = input("pypass> ")
+			line = await in_thread(input, "pypass> ")
 			if line:
 				try:
-					parser.parse(line)
+					await parser.run(line)
 				except (KeyboardInterrupt, EOFError):
 					print() # do nothing else
 				except ValueError as e:
 					print(e)
-			elif input("Quit? [Y/n]").lower() not in ["n", "no"]:
+			elif (await in_thread(input, "Quit? [Y/n]")).lower() not in ["n", "no"]:
 				break
-		
+	finally:
+		if agent is not None:
+			agent.shutdown()
+			try:
+				await serving
+			except (ValueError, OSError):
+				pass # e.g. no Unix sockets here
+		db.close()
+		clipboard.restore()
+
+def one_shot(args):
+	"""
+	Run one command and return the exit status. The command goes to the agent if one is running and can serve it. Otherwise the database is opened just for this command, but while an agent runs only for commands that don't change it.
+	"""
+	from .parser import Parser
+	from .client import Client
+	command = Parser.command(args)
+	batched = args[0] == "--batch" or args[0].startswith("--batch=")
+	try:
+		if not batched and (command == "help" or "-h" in args or "--help" in args):
+			try:
+				Parser(None).parse(args)
+			except EOFError:
+				pass # argparse is done printing help
+			return 0
+
+		if Client.running():
+			if batched:
+				raise ValueError("Error: Stop the agent before running commands in batch mode.")
+			if command in Client.COMMANDS:
+				start_logging(database_dir())
+				db = Client()
+				try:
+					Parser(db, db).parse(args)
+				finally:
+					db.close()
+				return 0
+			if command not in Client.READ_ONLY:
+				# changing the database beside the agent would leave it working from what it has in memory, and rekey would leave it encrypting with the old key
+				raise ValueError(f"Error: Stop the agent before running '{command}'.")
+		if batched:
+			return batch(args)
+
+		# time opening the database too
+		profile, trace = timing.requested(args)
+		if profile:
+			timing.enable()
+		try:
+			with span("import"):
+				from .database import Database
+			dir = database_dir()
+			start_logging(dir)
+			with span("open"):
+				db = Database(dir)
+			parser = Parser(db)
+			try:
+				parser.parse(args)
+			finally:
+				db.close()
+		finally:
+			if trace is not None:
+				timing.write_trace(trace)
+		# this process is about to exit, so the clipboard can't be restored in the background
+		parser.wait_for_clipboard()
+		return 0
 	except (KeyboardInterrupt, EOFError):
-		pass
-	#except:
-	#	track = traceback.format_exc()
-	#	print(track)
+		print()
+		return 1
+	except ValueError as e:
+		print(e)
+		return 1
+
+def batch(args):
+	"""
+	Run the commands in a file, one per line, after a single login, and write the result of each as a line of JSON. Return 1 if any of them failed.
+	"""
+	import json
+	import argparse
+	p = argparse.ArgumentParser(prog = "pypass --batch",
+		description = "Run many commands with a single login, answering yes to any [y/n] prompts, and report the result of each as a line of JSON.")
+	p.add_argument("--batch", dest = "infile", metavar = "FILE", required = True,
+		help = "commands to run, one per line (or '-' to read them from the console); blank lines and lines starting with '#' are skipped")
+	p.add_argument("--report", dest = "report", metavar = "FILE", default = "-",
+		help = "where to write the results (default: print to the console); it is only readable by you, since it holds what the commands printed, passwords included")
+	options = p.parse_args(args)
+
+	if options.infile == "-":
+		lines = sys.stdin.read().splitlines()
+		try:
+			sys.stdin = open("/dev/tty") # for the master password
+		except OSError:
+			pass
+	else:
+		try:
+			with open(options.infile) as f:
+				lines = f.read().splitlines()
+		except OSError as e:
+			raise ValueError(f"Error: Could not read {options.infile}: {e.strerror}")
+
+	report = sys.stdout
+	if options.report != "-":
+		try:
+			fd = os.open(options.report, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+			os.fchmod(fd, 0o600) # if it was there already
+			report = os.fdopen(fd, "w")
+		except OSError as e:
+			raise ValueError(f"Error: Could not write {options.report}: {e.strerror}")
+
+	from .parser import Parser
+	from .database import Database
+	count, failed = 0, 0
+	try:
+		dir = database_dir()
+		start_logging(dir)
+		db = Database(dir)
+		parser = Parser(db)
+		try:
+			for result in parser.batch(lines):
+				print(json.dumps(result), file = report, flush = True)
+				count  += 1
+				failed += result["outcome"] != "ok"
+		finally:
+			db.close()
+	finally:
+		if report is not sys.stdout:
+			report.close()
+	print(f"Ran {count} commands, {failed} failed.", file = sys.stderr)
+	parser.wait_for_clipboard()
+	return 1 if failed else 0
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
@@ -0,0 +1,220 @@
+"""
+A long-running process that keeps one unlocked Database, with its indexes, in memory and serves thin clients over a Unix socket, so a lookup costs a round trip instead of a key derivation and a tree walk.
+
+Requests and responses are JSON objects, one per line. Each request names an operation ("op") and its arguments. A response holds either the result, an "error" message, or "locked": true when the key has timed out and the client must resend its request after logging in.
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import asyncio
+import threading
+
+from . import log
+from .client import Client, default_socket, check_private, peer_uid
+from .clipboard import Clipboard
+
+
+class Agent:
+	"""
+	Serve copy, print, ls and add requests from an unlocked Database. Clients are served concurrently on an asyncio event loop; each request runs in a worker thread, one at a time, holding lock, which can be shared with a Parser working on the same Database. Passwords copied for clients go through clipboard, whose restores are scheduled on the same loop. The key locks itself after the Database's idle timeout, and the next client has to log in again.
+
+	Other processes may change the database while the agent runs, so each request first picks up their changes (see Database.refresh()). Requests are audited like commands, when audit records are kept.
+	"""
+
+	TIMEOUT = 15 * 60 # seconds
+	AUDITED = ("account", "filter") # request fields that name accounts; the others may hold secrets
+
+	def __init__(self, db, path = None, lock = None, clipboard = None):
+		self.logger = logging.getLogger()
+		self.db   = db
+		self.path = path or default_socket()
+		self.clipboard = clipboard
+		self._lock = lock if lock is not None else threading.Lock()
+		self._loop = None
+		self._stop = None
+		self.ops = {
+			"login":    self.login,
+			"lock":     self.lock,
+			"ls":       self.ls,
+			"select":   self.select,
+			"password": self.password,
+			"content":  self.content,
+			"exists":   self.exists,
+			"isdir":    self.isdir,
+			"add":      self.add,
+			"clip":     self.clip,
+		}
+
+	def serve(self):
+		"""
+		Listen on the socket until shutdown() is called.
+		"""
+		asyncio.run(self.run())
+
+	async def run(self):
+		"""
+		Listen on the socket until shutdown() is called or the task is cancelled.
+		"""
+		if not hasattr(socket, "AF_UNIX"):
+			raise ValueError("Error: The agent needs Unix domain sockets, which this platform does not support.")
+		self._loop = asyncio.get_running_loop()
+		self._stop = asyncio.Event()
+		if self.clipboard is None:
+			self.clipboard = Clipboard(self._loop)
+		server = await self._bind()
+		try:
+			self.logger.info(f"Agent listening on {self.path}.")
+			await self._stop.wait()
+		finally:
+			server.close()
+			os.remove(self.path)
+			with self._lock:
+				self.db.close()
+			self.clipboard.restore()
+			self.logger.info("Agent stopped.")
+
+	def shutdown(self):
+		"""
+		Stop serving. Safe to call from any thread.
+		"""
+		if self._loop is not None:
+			self._loop.call_soon_threadsafe(self._stop.set)
+
+	def handle(self, request):
+		"""
+		Run one request and return the response.
+		"""
+		start = time.perf_counter()
+		response = self._handle(request)
+		if log.auditing():
+			self._audit(request, response, time.perf_counter() - start)
+		return response
+
+	def _handle(self, request):
+		try:
+			op = self.ops[request["op"]]
+		except KeyError:
+			return {"error": f"Error: Unknown agent request: {request.get('op')}"}
+		with self._lock:
+			key = self.db.key
+			if key.expired():
+				self.db.close()
+				key.lock()
+			if key.locked() and op not in (self.login, self.lock):
+				# never prompt here: the client asks for the master password and logs in
+				return {"locked": True}
+			try:
+				if op not in (self.login, self.lock):
+					self.db.refresh()
+				return op(**{k: v for k, v in request.items() if k != "op"})
+			except (ValueError, TypeError) as e:
+				return {"error": str(e)}
+			except Exception as e:
+				self.logger.exception(f"Agent request {request['op']} failed.")
+				return {"error": f"Error: {e!r}"}
+
+	def _audit(self, request, response, elapsed):
+		"""
+		Write the audit record of a request: the accounts or filter it names, never the secrets it may carry, how long it took, and how it ended.
+		"""
+		args = {k: v for k, v in request.items() if k in Agent.AUDITED}
+		outcome = "error" if "error" in response else "locked" if response.get("locked") else "ok"
+		fields = {"command": f"agent {request.get('op')}", "args": args, "ms": round(elapsed * 1000, 3), "outcome": outcome}
+		if "error" in response:
+			fields["error"] = response["error"]
+		log.audit(**fields)
+
+	async def _bind(self):
+		dir = os.path.dirname(self.path)
+		os.makedirs(dir, mode = 0o700, exist_ok = True)
+		check_private(dir) # it may have been there already
+		if os.path.exists(self.path):
+			if Client.running(self.path):
+				raise ValueError(f"Error: An agent is already listening on {self.path}.")
+			os.remove(self.path) # left behind by an agent that crashed
+		old_umask = os.umask(0o177)
+		try:
+			return await asyncio.start_unix_server(self._serve_client, self.path)
+		finally:
+			os.umask(old_umask)
+
+	async def _serve_client(self, reader, writer):
+		if not self._allowed(writer.get_extra_info("socket")):
+			self.logger.warning("Agent refused a connection from another user.")
+			writer.close()
+			return
+		try:
+			while line := await reader.readline():
+				try:
+					request = json.loads(line)
+				except json.JSONDecodeError:
+					response = {"error": "Error: Malformed agent request."}
+				else:
+					# may derive a key or write files, so keep it off the event loop
+					response = await asyncio.to_thread(self.handle, request)
+				writer.write(json.dumps(response).encode() + b"\n")
+				await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	def _allowed(self, sock):
+		"""
+		Only talk to processes run by the same user, where the platform can tell.
+		"""
+		uid = peer_uid(sock)
+		return uid is None or uid == os.getuid() # otherwise, the socket's permissions still apply
+
+
+	### Requests ##########################################################
+
+
+	def login(self, master = None):
+		if self.db.key.locked():
+			if master is None:
+				return {"locked": True}
+			self.db.key.login(master)
+		return {}
+
+	def lock(self):
+		self.db.close()
+		self.db.key.lock()
+		return {}
+
+	def ls(self, filter = "", list_all = True):
+		return {"accounts": self.db.accounts(filter, list_all)}
+
+	def select(self, filter = ""):
+		matched = self.db.candidates(filter)
+		if len(matched) == 1:
+			self.db.usage.hit(matched[0])
+		return {"accounts": matched}
+
+	def password(self, account):
+		return {"password": self.db.password(account)}
+
+	def content(self, account):
+		return {"lines": self.db.content(account)}
+
+	def exists(self, account):
+		return {"result": self.db.exists(account)}
+
+	def isdir(self, account):
+		return {"result": self.db.isdir(account)}
+
+	def add(self, account, lines):
+		# the storage has the last word, should a change by another process have been missed
+		if self.db.exists(account) or self.db.storage.exists(account):
+			raise ValueError(f"Error: Account {account} already exists.")
+		if self.db.isdir(account):
+			raise ValueError(f"Error: {account} is an existing directory.")
+		self.db.add_block(account, lines)
+		return {}
+
+	def clip(self, text, seconds):
+		self.clipboard.copy(text, seconds)
+		return {}
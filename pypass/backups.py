@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import bisect
+import itertools
+import logging
+
+from . import records
+
+
+class BackupStore:
+	"""
+	Content-addressed backups, kept in the storage under .backup.
+
+	Each distinct version of an account is stored once, as an object named after a keyed hash of its decrypted contents, so saving the same contents again, for this or any other account, costs no space. Every account has a manifest listing its versions oldest first as (time, hash) pairs. Manifests are encrypted and named after a keyed hash of the account name, so the history of one account is a single small read, and names don't show on disk. Objects no manifest refers to any more are deleted by gc().
+
+	Older databases kept one full copy per backup, named .backup/ACCOUNT.YYMMDDHHMMSS; upgrade() moves those into the store.
+	"""
+
+	OBJECTS   = os.path.join(".backup", "objects")
+	MANIFESTS = os.path.join(".backup", "manifests")
+	FORMAT    = os.path.join(".backup", "format")
+	VERSION   = 2
+
+	def __init__(self, storage, key):
+		self.logger = logging.getLogger()
+		self.storage = storage
+		self.key = key
+		self._manifests = {} # account: versions, for the manifests read so far
+
+	def digest(self, lines):
+		"""
+		Return the hash identifying the given account contents.
+		"""
+		return self.key.digest("\n".join(lines))
+
+	def versions(self, account):
+		"""
+		Return the (time, hash) pairs of the saved versions of an account, oldest first.
+		"""
+		if account not in self._manifests:
+			try:
+				manifest = json.loads(self.key.decrypt(self.storage.read(self._manifest_name(account)).decode()))
+				self._manifests[account] = [tuple(v) for v in manifest["versions"]]
+			except FileNotFoundError:
+				self._manifests[account] = []
+		return self._manifests[account]
+
+	def at(self, account, when):
+		"""
+		Return the (time, hash) of the version of an account that was the latest at the given time, or None if there was none yet.
+		"""
+		versions = self.versions(account)
+		i = bisect.bisect_right(versions, (when, "~")) # '~' sorts after any hex hash saved at that very time
+		return versions[i - 1] if i > 0 else None
+
+	def read(self, digest):
+		"""
+		Return the encoded contents of a version.
+		"""
+		return self.storage.read(BackupStore._object_name(digest))
+
+	def lines(self, digest):
+		"""
+		Return the decrypted lines of a version.
+		"""
+		obj = BackupStore._object_name(digest)
+		return records.decode(self.key, self.storage.read(obj), obj)
+
+	def record(self, digest, account):
+		"""
+		Return the encoded contents of a version, ready to be written back as account.
+		"""
+		obj = BackupStore._object_name(digest)
+		return records.rebind(self.key, self.storage.read(obj), obj, account)
+
+	def save(self, account, digest):
+		self.save_many([(account, digest)])
+
+	def save_many(self, items, workers = None, batch = 256):
+		"""
+		Save the current contents of accounts as new versions, given (account, hash) pairs. When there are many, the manifests are encrypted across worker processes.
+		"""
+		now = time.time()
+		copies = []
+		manifests = []
+		new = set()
+		for account, digest in items:
+			obj = BackupStore._object_name(digest)
+			if obj not in new and not self.storage.exists(obj):
+				copies.append((account, obj))
+				new.add(obj)
+			versions = self.versions(account) + [(now, digest)]
+			self._manifests[account] = versions
+			manifests.append((self._manifest_name(account), json.dumps({"account": account, "versions": versions})))
+		if len(manifests) > batch:
+			from .workers import chunks, map_with_key # imports multiprocessing
+			manifests = itertools.chain.from_iterable(map_with_key(_encrypt_many, chunks(manifests, batch), self.key, workers))
+		else:
+			manifests = _encrypt_many(self.key, manifests)
+		failed = self._copy_many(copies) + self.storage.write_many(manifests)
+		if failed:
+			raise failed[0][1]
+
+	def rename(self, account1, account2):
+		"""
+		Give account2 the history of account1 as well as its own. account1 keeps its history, which costs nothing since the versions are shared.
+		"""
+		versions = self.versions(account1)
+		if versions:
+			self._write_manifest(account2, sorted(self.versions(account2) + versions))
+
+	def objects(self):
+		return [name for name in self.storage.backups() if name.startswith(BackupStore.OBJECTS + os.sep)]
+
+	def manifests(self):
+		return [name for name in self.storage.backups() if name.startswith(BackupStore.MANIFESTS + os.sep)]
+
+	def gc(self, last = None, daily = None, monthly = None):
+		"""
+		Apply a retention policy to every account's history, then delete the objects no longer needed. With no policy, only unused objects are deleted. Return the number of versions dropped, the number of objects deleted and the bytes they took.
+		"""
+		names = self.storage.backups()
+		dropped = 0
+		used = set()
+		for name in names:
+			if not name.startswith(BackupStore.MANIFESTS + os.sep):
+				continue
+			manifest = json.loads(self.key.decrypt(self.storage.read(name).decode()))
+			account  = manifest["account"]
+			versions = [tuple(v) for v in manifest["versions"]]
+			self._manifests[account] = versions
+			if (last, daily, monthly) != (None, None, None):
+				keep = retained([t for t, digest in versions], last or 0, daily or 0, monthly or 0)
+				if len(keep) < len(versions):
+					dropped += len(versions) - len(keep)
+					versions = [v for i, v in enumerate(versions) if i in keep]
+					self._write_manifest(account, versions)
+			used.update(digest for t, digest in versions)
+		deleted = 0
+		size = 0
+		for name in names:
+			if name.startswith(BackupStore.OBJECTS + os.sep) and os.path.basename(name) not in used:
+				size += len(self.storage.read(name))
+				self.storage.remove(name)
+				deleted += 1
+		return dropped, deleted, size
+
+	def upgrade(self, workers = None):
+		"""
+		Move backups kept in the older one-copy-per-backup format into the store, once. Return the number moved.
+		"""
+		try:
+			if int(self.storage.read(BackupStore.FORMAT)) >= BackupStore.VERSION:
+				return 0
+		except FileNotFoundError:
+			pass
+		from .workers import chunks, map_with_key # imports multiprocessing
+		legacy = []
+		for name in self.storage.backups():
+			if name == BackupStore.FORMAT or name.startswith((BackupStore.OBJECTS + os.sep, BackupStore.MANIFESTS + os.sep)):
+				continue
+			try:
+				account, stamp = os.path.relpath(name, ".backup").rsplit(".", 1)
+				legacy.append((time.mktime(time.strptime(stamp, "%y%m%d%H%M%S")), account, name))
+			except ValueError:
+				self.logger.warning(f"Ignoring {name}, which is not a backup.")
+		if legacy:
+			self.logger.warning(f"Moving {len(legacy)} backups into the backup store.")
+		legacy.sort()
+		def read():
+			for t, account, name in legacy:
+				yield name, self.storage.read(name)
+		history = {}
+		decoded = (lines for chunk in map_with_key(records.decode_many, chunks(read(), 256), self.key, workers) for name, lines in chunk)
+		for (t, account, name), lines in zip(legacy, decoded):
+			digest = self.digest(lines)
+			self._put_object(name, digest)
+			history.setdefault(account, []).append((t, digest))
+			self.storage.remove(name)
+		for account, versions in history.items():
+			self._write_manifest(account, sorted(self.versions(account) + versions))
+		self.storage.write(BackupStore.FORMAT, str(BackupStore.VERSION).encode())
+		self.storage.flush()
+		return len(legacy)
+
+	def _put_object(self, name, digest):
+		"""
+		Store the current contents of name as the object for digest, unless there already is one.
+		"""
+		obj = BackupStore._object_name(digest)
+		if not self.storage.exists(obj):
+			failed = self._copy_many([(name, obj)])
+			if failed:
+				raise failed[0][1]
+
+	def _copy_many(self, pairs):
+		"""
+		Copy (name, object) pairs. Records bound to their name by their cipher suite are encoded again for the object; the others are copied as they are, which some backends do without copying any data.
+		"""
+		copies = []
+		writes = []
+		for name, obj in pairs:
+			data = self.storage.read(name)
+			rebound = records.rebind(self.key, data, name, obj)
+			if rebound is data:
+				copies.append((name, obj))
+			else:
+				writes.append((obj, rebound))
+		return self.storage.copy_many(copies) + self.storage.write_many(writes)
+
+	def _write_manifest(self, account, versions):
+		self._manifests[account] = versions
+		manifest = {"account": account, "versions": versions}
+		self.storage.write(self._manifest_name(account), self.key.encrypt(json.dumps(manifest)).encode())
+
+	def _manifest_name(self, account):
+		digest = self.key.digest(account)
+		return os.path.join(BackupStore.MANIFESTS, digest[:2], digest)
+
+	@staticmethod
+	def _object_name(digest):
+		return os.path.join(BackupStore.OBJECTS, digest[:2], digest)
+
+
+def _encrypt_many(key, items):
+	"""
+	Encrypt (name, text) pairs into (name, data) pairs.
+	"""
+	return [(name, key.encrypt(text).encode()) for name, text in items]
+
+def retained(times, last = 0, daily = 0, monthly = 0):
+	"""
+	Return the indexes of the versions to keep, given their times oldest first: the newest `last` versions, and the newest version of each of the `daily` most recent days and the `monthly` most recent months that have any. The newest version is always kept.
+	"""
+	newest_first = range(len(times) - 1, -1, -1)
+	keep = set(newest_first[:max(last, 1)])
+	for count, fmt in ((daily, "%Y-%m-%d"), (monthly, "%Y-%m")):
+		periods = set()
+		for i in newest_first:
+			if len(periods) >= count:
+				break
+			period = time.strftime(fmt, time.localtime(times[i]))
+			if period not in periods:
+				periods.add(period)
+				keep.add(i)
+	return keep
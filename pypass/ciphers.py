@@ -0,0 +1,82 @@
+"""
+Cipher suites for account records.
+
+Fernet, the original suite, encrypts with AES-128-CBC and authenticates with a separate HMAC-SHA256 pass. The AEAD suites do both in one pass, with a 256-bit key derived from the data key, and add less to each token. They also authenticate the name a record is stored under as associated data, so a record moved to another name, whether one account swapped for another or a backup object for a different version, fails to decrypt rather than showing the wrong contents. Records written by an AEAD suite must therefore be encrypted again when they move (see records.rebind()).
+
+The suite a record was written with is named in its header, so a database can hold records of several suites at once.
+"""
+
+import os
+
+
+class Suite:
+	"""
+	A way of encrypting the sections of a record, given the key and the name the record is stored under.
+	"""
+
+	name  = None
+	bound = False # whether tokens only decrypt under the name they were written for
+
+	def encrypt(self, key, text, name):
+		raise NotImplementedError()
+
+	def decrypt(self, key, code, name):
+		raise NotImplementedError()
+
+
+class FernetSuite(Suite):
+
+	name = "fernet"
+
+	def encrypt(self, key, text, name):
+		return key.encrypt(text)
+
+	def decrypt(self, key, code, name):
+		return key.decrypt(code)
+
+
+class AEADSuite(Suite):
+	"""
+	An authenticated cipher with associated data from cryptography's aead module, which is only imported once a key is made with cipher(). Tokens are the url-safe base64 of a random 96-bit nonce followed by the ciphertext and tag.
+	"""
+
+	bound = True
+
+	@staticmethod
+	def cipher(key):
+		raise NotImplementedError()
+
+	def encrypt(self, key, text, name):
+		return key.seal(self, text, _associated(name))
+
+	def decrypt(self, key, code, name):
+		return key.unseal(self, code, _associated(name))
+
+
+class AESGCMSuite(AEADSuite):
+
+	name = "aes-256-gcm"
+
+	@staticmethod
+	def cipher(key):
+		from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+		return AESGCM(key)
+
+
+class ChaCha20Poly1305Suite(AEADSuite):
+
+	name = "chacha20-poly1305"
+
+	@staticmethod
+	def cipher(key):
+		from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+		return ChaCha20Poly1305(key)
+
+
+DEFAULT = FernetSuite.name
+SUITES  = {s.name: s() for s in [FernetSuite, AESGCMSuite, ChaCha20Poly1305Suite]}
+
+
+def _associated(name):
+	# the same on every platform, so a database can be moved between them
+	return name.replace(os.sep, "/").encode() if name is not None else b""
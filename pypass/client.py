@@ -0,0 +1,164 @@
+"""
+The thin client side of the agent, kept free of heavy imports so that a command sent to a running agent starts quickly. Even socket is only imported once there is a socket to connect to, since every one-shot command checks for an agent first.
+"""
+
+import os
+import json
+import stat
+import struct
+
+
+def default_socket():
+	"""
+	Return the socket path: $PYPASS_SOCKET, or a file in a private per-user directory in $XDG_RUNTIME_DIR, $TMPDIR or /tmp.
+	"""
+	path = os.environ.get("PYPASS_SOCKET")
+	if path:
+		return path
+	base = os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or "/tmp" # not tempfile, which takes longer to import than the rest of this
+	user = os.getuid() if hasattr(os, "getuid") else os.getlogin()
+	return os.path.join(base, f"pypass-{user}", "agent.sock")
+
+
+def check_private(dir):
+	"""
+	Raise ValueError unless dir is a directory, not a link, that belongs to this user and that no one else can use. Anyone who can create the agent's socket could pose as the agent and collect the master password.
+	"""
+	if not hasattr(os, "getuid"):
+		return # no Unix sockets here either
+	st = os.lstat(dir)
+	if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+		raise ValueError(f"Error: {dir} is not a private directory of yours, so the agent socket can't be trusted in it.")
+
+def peer_uid(sock):
+	"""
+	Return the user id of the process at the other end of a Unix socket, or None if the platform can't tell.
+	"""
+	import socket
+	if not hasattr(socket, "SO_PEERCRED"):
+		return None
+	creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+	pid, uid, gid = struct.unpack("3i", creds)
+	return uid
+
+
+class Client:
+	"""
+	Stands in for a Database inside a Parser, forwarding each call to a running agent. Only the commands in COMMANDS can be served this way. It can stand in for the Parser's Clipboard too, so that the agent, which outlives this process, restores the clipboard.
+	"""
+
+	COMMANDS  = ["ls", "copy", "print", "add", "help"]
+	READ_ONLY = ["history", "export"] # not served, but safe to run on the database next to an agent
+
+	def __init__(self, path = None):
+		self.path = path or default_socket()
+		self.dir  = os.getcwd()
+		self.key  = self # Parser calls db.key.login()
+		check_private(os.path.dirname(self.path))
+		import socket
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			self.sock.connect(self.path)
+			uid = peer_uid(self.sock)
+			if uid is not None and uid != os.getuid():
+				raise ValueError(f"Error: {self.path} is served by another user, not by your agent.")
+		except:
+			self.sock.close()
+			raise
+		self.rfile = self.sock.makefile("rb")
+
+	def close(self):
+		self.rfile.close()
+		self.sock.close()
+
+	@staticmethod
+	def running(path = None):
+		"""
+		Return True if an agent is listening on the socket.
+		"""
+		if not os.path.exists(path or default_socket()):
+			return False
+		import socket
+		if not hasattr(socket, "AF_UNIX"):
+			return False
+		try:
+			Client(path).close()
+			return True
+		except OSError:
+			return False
+
+	def request(self, op, **args):
+		"""
+		Send a request and return the response, logging in first if the agent is locked. Errors are raised as ValueError.
+		"""
+		response = self._send(dict(args, op = op))
+		if response.get("locked"):
+			self.login()
+			response = self._send(dict(args, op = op))
+		if "error" in response:
+			raise ValueError(response["error"])
+		return response
+
+	def login(self, master = None, prompt = "Master Password: "):
+		if self._send({"op": "login"}).get("locked"):
+			if master is None:
+				master = input(prompt)
+			if master == "":
+				raise EOFError()
+			response = self._send({"op": "login", "master": master})
+			if "error" in response:
+				raise ValueError(response["error"])
+
+	def _send(self, request):
+		self.sock.sendall(json.dumps(request).encode() + b"\n")
+		line = self.rfile.readline()
+		if not line:
+			raise ValueError("Error: The agent closed the connection.")
+		return json.loads(line)
+
+
+	### Database methods used by Parser ###################################
+
+
+	def refresh(self):
+		pass # the agent does, before each request
+
+	def accounts(self, filter = "", list_all = True):
+		return self.request("ls", filter = filter, list_all = list_all)["accounts"]
+
+	def select(self, filter = ""):
+		matched = self.request("select", filter = filter)["accounts"]
+		if len(matched) == 1:
+			print(f">>>>>>> {matched[0]}")
+			return matched[0]
+		from .database import Database
+		account = Database.reduce_selection(matched)
+		# an exact name is always selected, and counts as a use
+		self.request("select", filter = account)
+		return account
+
+	def password(self, account):
+		return self.request("password", account = account)["password"]
+
+	def content(self, account):
+		return self.request("content", account = account)["lines"]
+
+	def exists(self, account):
+		return self.request("exists", account = account)["result"]
+
+	def isdir(self, name):
+		return self.request("isdir", account = name)["result"]
+
+	def add_input(self, account, generate, multiline, symbols):
+		from .database import Database
+		Database.add_input(self, account, generate, multiline, symbols)
+
+	def add_block(self, account, lines):
+		self.request("add", account = account, lines = lines)
+
+
+	### Clipboard methods used by Parser ##################################
+
+
+	def copy(self, text, seconds):
+		self.request("clip", text = text, seconds = seconds)
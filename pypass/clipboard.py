@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import pyperclip
+from concurrent.futures import CancelledError
+
+
+class Clipboard:
+	"""
+	Copy text to the clipboard and put the previous contents back after a delay. The restore is a task on an asyncio event loop, so nothing blocks while it waits. Copying again cancels the pending restore, but it is still the contents from before the first copy that get put back, and only if the clipboard hasn't been changed by someone else in the meantime. Without a loop, one is started in a background thread on first use.
+	"""
+
+	def __init__(self, loop = None):
+		self.loop  = loop
+		self._lock = threading.Lock()
+		self._task = None
+		self._gen  = 0
+		self._old  = None
+		self._text = None
+
+	def copy(self, text, seconds):
+		"""
+		Copy text now and schedule the restore. Safe to call from any thread.
+		"""
+		loop = self._ensure_loop()
+		with self._lock:
+			if self._task is not None:
+				self._task.cancel()
+			else:
+				self._old = pyperclip.paste()
+			pyperclip.copy(text)
+			self._text = text
+			self._gen += 1
+			self._task = asyncio.run_coroutine_threadsafe(self._restore_later(seconds, self._gen), loop)
+
+	def pending(self):
+		return self._task is not None
+
+	def wait(self):
+		"""
+		Block until the pending restore, if any, has happened. Interrupting the wait restores the clipboard right away.
+		"""
+		task = self._task
+		if task is None:
+			return
+		try:
+			task.result()
+		except KeyboardInterrupt:
+			self.restore()
+		except CancelledError:
+			self.wait() # replaced by a later copy
+
+	def restore(self):
+		"""
+		Put the old contents back now, if a restore is pending.
+		"""
+		with self._lock:
+			if self._task is not None:
+				self._task.cancel()
+				self._put_back()
+
+	async def _restore_later(self, seconds, gen):
+		await asyncio.sleep(seconds)
+		with self._lock:
+			# a later copy may have replaced this restore after the sleep ended
+			if gen == self._gen and self._task is not None:
+				self._put_back()
+
+	def _put_back(self):
+		if pyperclip.paste() == self._text:
+			pyperclip.copy(self._old)
+		self._task = None
+		self._old  = None
+		self._text = None
+
+	def _ensure_loop(self):
+		with self._lock:
+			if self.loop is None:
+				self.loop = asyncio.new_event_loop()
+				threading.Thread(target = self.loop.run_forever, daemon = True).start()
+			return self.loop
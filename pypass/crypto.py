@@ -1,111 +1,383 @@
 import sys
 import os
+import json
+import time
 import base64
+import binascii
+import hashlib
 import secrets
 import logging
+import threading
 
-from cryptography.fernet import Fernet, InvalidToken
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+
+from . import kdf, ciphers
+from .secret import SecretBuffer
+from .timing import span
 
 
 class MasterKey:
+	"""
+	The data key, wrapped on disk by a key derived from the master password. Once unlocked, the key and the salt stay in memory for the rest of the session, so the expensive derivation runs once. If timeout is given, the key is wiped after that many idle seconds and the next use asks for the master password again.
+
+	The key file starts with a JSON header naming the key derivation function, its parameters and the salt, and the cipher suite new records are written with unless it is the default, followed by the wrapped key. Legacy key files hold only the wrapped key, with the salt in a separate file and fixed PBKDF2 parameters. The header may also hold "next" parameters chosen by calibrate(); the next login re-wraps the key with them, as it does for legacy files.
+
+	After rotate(), the wrapped key is a JSON keyring instead: the data key new data is encrypted with, older ones that are still accepted for decryption until retire(), and the key digest() hashes with, which stays the same so that digests keep matching.
+
+	The unlocked keys are held in SecretBuffers (see secret.py), which lock() zeroes, and the master password is never kept. Unwrapping the keys makes short-lived copies that Python can't wipe, and the Fernet objects that encrypt with them keep theirs until lock() drops them.
+	"""
 
-	LENGTH     = 32
-	SALT_LEN   = 16
-	ITERATIONS = 100000
+	SALT_LEN = 16
+	VERSION  = 2
 	
-	def __init__(self, master = None, keyfile = ".key", saltfile = ".salt"):
+	def __init__(self, master = None, keyfile = ".key", saltfile = ".salt", timeout = None):
 		self.logger = logging.getLogger()
 		
 		self.keyfile  = os.path.abspath(keyfile)
 		self.saltfile = os.path.abspath(saltfile)
-		self.bkey = None
-		self.fkey = None		
+		self.salt = None
+		self.kdf  = None
+		self.next = None
+		self.suite = ciphers.DEFAULT
+		self.wrapped = None
+		self.legacy  = False
+
+		self.timeout   = timeout
+		self.last_used = 0
+		self._lock     = threading.RLock()
+		self._data     = None # DataKey
+		self._hash     = None # SecretBuffer
+		self._watcher  = None
 		
-		exists = os.path.isfile
-		if not (exists(self.keyfile) and exists(self.saltfile)):
-			master = self.save(master)
-		#if master is not None:
-		self.login(master)
+		if not os.path.isfile(self.keyfile):
+			self.save(master)
+		else:
+			self.login(master)
 
 	def save(self, master = None, prompt = "New Master Password: "):
 		"""
-		Encrypt and save the master key.
+		Encrypt and save the master key, using a new salt and the pending parameters, if any.
 		"""
 		if master is None:
 			master = input(prompt)
-		if self.bkey is None:
+		if self._data is None:
 			if os.path.isfile(self.keyfile):
 				raise Exception("Error: Login required.")
-			with open(self.saltfile, "wb") as f:
-				f.write(os.urandom(MasterKey.SALT_LEN))
-			self.bkey = Fernet.generate_key()
-			self.fkey = Fernet(self.bkey)
-		kek = self._kek(master)
-		with open(self.keyfile, "wb") as f:
-			f.write(kek.encrypt(self.bkey))
-		return master
+			self._unlock(Fernet.generate_key())
+		self.kdf  = self.next or self.kdf or kdf.PBKDF2()
+		self.next = None
+		self.salt = os.urandom(MasterKey.SALT_LEN)
+		self.wrapped = self._kek(master).encrypt(self._keyring(self.keys()))
+		self._write()
+		try:
+			os.remove(self.saltfile) # legacy
+		except FileNotFoundError:
+			pass
 	
 	def login(self, master = None, prompt = "Master Password: "):
 		"""
-		Unlock the master key using the master password.
+		Unlock the master key using the master password. Does nothing while the session is still unlocked.
 		"""
-		if self.fkey is None:
+		if self.expired():
+			self.lock()
+		if self._data is None:
 			if master is None:
 				master = input(prompt)
 			if master == "":
 				raise EOFError()
-			kek = self._kek(master)
+			if self.wrapped is None:
+				self._read()
 			try:
-				with open(self.keyfile, "rb") as f:
-					self.bkey = kek.decrypt(f.read())
-					self.fkey = Fernet(self.bkey)
-					self.logger.info("Logged in.")
+				self._unlock(self._unwrap(master))
+				self.logger.info("Logged in.")
 			except InvalidToken:
-				self.logger.error(f"Login failed. Incorrect master password: {master}")
+				self.logger.error("Login failed. Incorrect master password.")
 				raise ValueError("Error: Invalid Master Password.")
+			if self.next is not None or self.legacy:
+				self.save(master)
+				self.logger.info(f"Re-wrapped key using {self.kdf}.")
+		self.last_used = time.monotonic()
+
+	def verify(self, master):
+		"""
+		Raise ValueError unless master is the master password.
+		"""
+		if self.wrapped is None:
+			self._read()
+		try:
+			self._unwrap(master)
+		except InvalidToken:
+			raise ValueError("Error: Invalid Master Password.")
+
+	def rotate(self):
+		"""
+		Encrypt from now on with a new data key. The current one is kept for decryption until retire(). The caller saves the key file.
+		"""
+		self._unlock(self._keyring([Fernet.generate_key()] + self.keys()))
+
+	def retire(self):
+		"""
+		Stop accepting the data keys replaced by rotate(). The caller saves the key file.
+		"""
+		self._unlock(self._keyring(self.keys()[:1]))
+
+	def calibrate(self, target = 0.25, name = kdf.ScryptKDF.name):
+		"""
+		Pick parameters for the named key derivation function that take about target seconds on this machine, and save them to be applied at the next login. Return them.
+		"""
+		if self.wrapped is None:
+			self._read()
+		self.next = kdf.KDFS[name].calibrate(target)
+		self._write()
+		return self.next
+
+	def set_suite(self, name):
+		"""
+		Write new records with the named cipher suite from now on, and save the choice.
+		"""
+		if name not in ciphers.SUITES:
+			raise ValueError(f"Error: Unknown cipher suite {name}.")
+		if self.wrapped is None:
+			self._read()
+		self.suite = name
+		self._write()
+
+	def lock(self):
+		"""
+		Wipe the unlocked keys.
+		"""
+		with self._lock:
+			if self._data is not None:
+				self._data.wipe()
+				self._hash.wipe()
+				self._data = None
+				self._hash = None
+				self.logger.info("Locked.")
+
+	def locked(self):
+		return self._data is None
+
+	def expired(self):
+		return self.timeout is not None and self._data is not None and time.monotonic() - self.last_used >= self.timeout
+
+	def keys(self):
+		"""
+		Return copies of the data keys, the one encrypting first, for the key file and for worker processes.
+		"""
+		with self._lock:
+			return self._datakey().keys()
 	
 	def encrypt(self, message):
 		"""
 		Encrypt a message into a text (i.e., not bytes) code.
 		"""
-		return self.fkey.encrypt(message.encode()).decode()
+		# held so the key can't be wiped halfway through
+		with self._lock:
+			return self._datakey().encrypt(message)
 
 	def decrypt(self, code):
 		"""
 		Decrypt a text code into plaintext.
 		"""
-		return self.fkey.decrypt(code.encode()).decode()
+		with self._lock:
+			return self._datakey().decrypt(code)
+
+	def seal(self, suite, message, associated):
+		"""
+		Encrypt a message with an AEAD suite, binding it to the associated data; see DataKey.seal().
+		"""
+		with self._lock:
+			return self._datakey().seal(suite, message, associated)
+
+	def unseal(self, suite, code, associated):
+		with self._lock:
+			return self._datakey().unseal(suite, code, associated)
+
+	def digest(self, message):
+		"""
+		Return a keyed hash of a message, as hex. Equal messages get equal digests, but nothing about the message can be learned from its digest without the key.
+		"""
+		with self._lock:
+			self._datakey() # unlocks the key if needed
+			return hashlib.blake2b(message.encode(), digest_size = 16, key = self._hash.view, person = b"pypass digest").hexdigest()
+
+	def _datakey(self):
+		if self._data is None or self.expired():
+			self.login()
+		self.last_used = time.monotonic()
+		return self._data
+
+	def _unlock(self, keyring):
+		if keyring.startswith(b"{"):
+			keyring = json.loads(keyring)
+			keys = keyring["keys"]
+			hkey = keyring["hash"].encode()
+		else:
+			keys, hkey = [keyring], keyring
+		data = DataKey(keys)
+		hashkey = SecretBuffer.fill(hkey)
+		with self._lock:
+			if self._data is not None:
+				self._data.wipe()
+				self._hash.wipe()
+			self._data = data
+			self._hash = hashkey
+		self.last_used = time.monotonic()
+		if self.timeout is not None and (self._watcher is None or not self._watcher.is_alive()):
+			self._watcher = threading.Thread(target = self._watch, daemon = True)
+			self._watcher.start()
+
+	def _watch(self):
+		"""
+		Wipe the key once it has been idle for timeout seconds, even if nothing uses it again.
+		"""
+		while self._data is not None:
+			idle = time.monotonic() - self.last_used
+			if idle >= self.timeout:
+				self.lock()
+				break
+			time.sleep(self.timeout - idle)
+
+	def _read(self):
+		"""
+		Read the header and wrapped key, once per session.
+		"""
+		with open(self.keyfile, "rb") as f:
+			data = f.read()
+		self.legacy = not data.startswith(b"{")
+		if self.legacy:
+			with open(self.saltfile, "rb") as f:
+				self.salt = f.read()
+			self.kdf = kdf.PBKDF2()
+			self.next = None
+			self.wrapped = data.strip()
+			return
+		header, self.wrapped = data.split(b"\n", 1)
+		header = json.loads(header)
+		if header["version"] > MasterKey.VERSION:
+			raise ValueError("Error: Key file was written by a newer version of pypass.")
+		self.salt = base64.b64decode(header["salt"])
+		self.kdf  = kdf.from_dict(header["kdf"])
+		self.next = kdf.from_dict(header["next"]) if "next" in header else None
+		self.suite = header.get("suite", ciphers.DEFAULT)
+		self.wrapped = self.wrapped.strip()
+
+	def _write(self):
+		header = {"version": MasterKey.VERSION, "kdf": self.kdf.to_dict(), "salt": base64.b64encode(self.salt).decode()}
+		if self.next is not None:
+			header["next"] = self.next.to_dict()
+		if self.suite != ciphers.DEFAULT:
+			header["suite"] = self.suite
+		tmp = self.keyfile + ".tmp"
+		with open(tmp, "wb") as f:
+			f.write(json.dumps(header).encode() + b"\n" + self.wrapped + b"\n")
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp, self.keyfile)
+		self.legacy = False
 	
+	def _keyring(self, keys):
+		"""
+		Return the data keys to wrap, along with the current hash key: just the data key, unless rotate() has made a keyring necessary.
+		"""
+		hkey = bytes(self._hash.view)
+		if keys == [hkey]:
+			return hkey
+		return json.dumps({"keys": [k.decode() for k in keys], "hash": hkey.decode()}).encode()
+
+	def _unwrap(self, master):
+		return self._kek(master).decrypt(self.wrapped)
+
 	def _kek(self, master):
 		"""
 		Derive the key encrypting key.
 		"""
-		master = master.encode()
-		
-		# TODO move this and kdf to login() or something
-		with open(self.saltfile, "rb") as f:
-			salt = f.read()
-
-		# get key encrypting key (kek)
-		kdf = PBKDF2HMAC(
-			algorithm  = hashes.SHA256(),
-			length     = MasterKey.LENGTH,
-			salt       = salt,
-			iterations = MasterKey.ITERATIONS,
-			backend    = default_backend()
-		)
-		kek = base64.urlsafe_b64encode(kdf.derive(master))
-		kek = Fernet(kek)
-		return kek
+		with span("kdf", kdf = self.kdf):
+			kek = base64.urlsafe_b64encode(self.kdf.derive(master.encode(), self.salt))
+		return Fernet(kek)
+
+
+class DataKey:
+	"""
+	The data keys, for MasterKey and for worker processes that are handed an already unlocked key. Fernet tokens are made and read by MultiFernet: the first key encrypts and any of them decrypts. The raw keys, and the AEAD keys derived from them, are held in SecretBuffers, which wipe() zeroes; MultiFernet keeps copies of its own, which are dropped but can't be zeroed.
+	"""
+
+	def __init__(self, keys, suite = ciphers.DEFAULT):
+		raw = [base64.urlsafe_b64decode(k) for k in keys]
+		if not raw or any(len(k) != 32 for k in raw):
+			raise ValueError("Fernet key must be 32 url-safe base64-encoded bytes.")
+		self.suite   = suite # that records are written with
+		self._secret = SecretBuffer.fill(*raw)
+		self._fernet = MultiFernet([Fernet(k) for k in keys])
+		self._aeads = {} # suite name: (SecretBuffer, ciphers), derived when first used
+
+	def keys(self):
+		view = self._secret.view
+		return [base64.urlsafe_b64encode(view[i:i + 32]) for i in range(0, len(view), 32)]
+
+	def wipe(self):
+		self._fernet = None
+		for secret, aeads in self._aeads.values():
+			secret.wipe()
+		self._aeads = {}
+		self._secret.wipe()
+
+	def seal(self, suite, message, associated):
+		"""
+		Encrypt a message with an AEAD suite (see ciphers.py), under a key derived from the first data key, binding it to the associated data.
+		"""
+		aead = self._derived(suite)[0]
+		nonce = os.urandom(12)
+		return base64.urlsafe_b64encode(nonce + aead.encrypt(nonce, message.encode(), associated)).decode()
+
+	def unseal(self, suite, code, associated):
+		"""
+		Decrypt what seal() encrypted with any of the data keys, given the same associated data.
+		"""
+		try:
+			data = memoryview(base64.urlsafe_b64decode(code))
+		except (TypeError, ValueError, binascii.Error):
+			raise InvalidToken()
+		for aead in self._derived(suite):
+			try:
+				return aead.decrypt(data[:12], data[12:], associated).decode()
+			except InvalidTag:
+				continue
+		raise InvalidToken()
+
+	def _derived(self, suite):
+		if self._fernet is None:
+			raise ValueError("Error: Key has been wiped.")
+		if suite.name not in self._aeads:
+			view = self._secret.view
+			secret = SecretBuffer.fill(*(hashlib.blake2b(suite.name.encode(), digest_size = 32, key = view[i:i + 32], person = b"pypass suite").digest() for i in range(0, len(view), 32)))
+			self._aeads[suite.name] = (secret, [suite.cipher(secret.view[i:i + 32]) for i in range(0, len(secret), 32)])
+		return self._aeads[suite.name][1]
+
+	def encrypt(self, message):
+		if self._fernet is None:
+			raise ValueError("Error: Key has been wiped.")
+		return self._fernet.encrypt(message.encode()).decode()
+
+	def decrypt(self, code):
+		if self._fernet is None:
+			raise ValueError("Error: Key has been wiped.")
+		return self._fernet.decrypt(code.encode()).decode()
 
 
 def generate_password(length = 16, symbols = None):
 	"""
 	Generate a password of the given length, with or without symbol characters.
 	"""
+	return generate_passwords(1, length, symbols)[0]
+
+def generate_passwords(n, length = 16, symbols = None):
+	"""
+	Generate n passwords of the given length, each with at least one lower case letter, upper case letter and digit, and one symbol unless symbols is "". symbols replaces the default symbol characters.
+
+	Each password takes one character from every charset and the rest from all of them together, then shuffles their order. These choices are the digits, in mixed radix, of a single random number with 64 bits more than they need, so every outcome is equally likely to within 2^-64, and there is no retrying however short the password or however many symbols. The random numbers for all n passwords come from one call to secrets.token_bytes().
+	"""
 	if length < 8:
 		raise ValueError("Password must be at least 8 characters long.")
 	charsets = []
@@ -116,9 +388,26 @@ def generate_password(length = 16, symbols = None):
 		charsets.append("!@#$%^&*()-+=.,?<>_:{}|*/")
 	elif symbols != "":
 		charsets.append(symbols)
-	alphabet = "".join(charsets)
-	while True:
-		password = "".join(secrets.choice(alphabet) for i in range(length))
-		if all(any(d in password for d in group) for group in charsets):
-			# at least one character from each group
-			return password
\ No newline at end of file
+	# repeated characters would be picked more often
+	charsets = ["".join(dict.fromkeys(c)) for c in charsets]
+	alphabet = "".join(dict.fromkeys("".join(charsets)))
+	picks    = charsets + [alphabet] * (length - len(charsets))
+	outcomes = 1
+	for i, chars in enumerate(picks):
+		outcomes *= len(chars) * (i + 1) # with the shuffle
+	size = (outcomes.bit_length() + 64 + 7) // 8
+	data = secrets.token_bytes(n * size)
+
+	passwords = []
+	for start in range(0, n * size, size):
+		x = int.from_bytes(data[start:start + size], "big")
+		password = []
+		for chars in picks:
+			x, i = divmod(x, len(chars))
+			password.append(chars[i])
+		# Fisher-Yates
+		for i in range(length - 1, 0, -1):
+			x, j = divmod(x, i + 1)
+			password[i], password[j] = password[j], password[i]
+		passwords.append("".join(password))
+	return passwords
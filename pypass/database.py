@@ -1,61 +1,110 @@
 import os
-import time
-import shutil
 import logging
 
+from . import records
 from .crypto import MasterKey, generate_password
+from .index import AccountIndex
+from .match import Matcher, Usage
+from .backups import BackupStore
+from .storage import open_storage, migrate
+from .timing import span
 
 
 class Database:
 	
-	def __init__(self, dir = ".", master = None):
+	def __init__(self, dir = ".", master = None, storage = None, timeout = None):
 		self.logger = logging.getLogger()
 		self.dir = dir
 		
 		old_dir = os.getcwd()
 		os.chdir(dir)
 		try:
-			os.mkdir(".backup")
-		except OSError:
-			pass # exists
-		
-		self.key = MasterKey(master)
-		
-		self.all = set()
-		for dirpath, dirnames, filenames in os.walk("."):
-			for name in filenames:
-				if not name.startswith("."):
-					path = os.path.join(dirpath, name)
-					self.all.add(os.path.relpath(path, "."))
-		
-		os.chdir(old_dir)
+			with span("login"):
+				self.key = MasterKey(master, timeout = timeout)
+			with span("open storage"):
+				self.storage = storage if storage is not None else open_storage(".", self.key)
+			with span("index"):
+				self.index = AccountIndex(self.storage.names())
+			with span("usage"):
+				self.usage = Usage(os.path.abspath("."), self.key)
+			self.matcher = Matcher(self.usage)
+			with span("backups"):
+				self.backups = BackupStore(self.storage, self.key)
+				self.backups.upgrade()
+		finally:
+			os.chdir(old_dir)
+
+	def close(self):
+		"""
+		Save what is only kept in memory while the database is open: how often accounts were selected. With the key locked they are dropped, since they only affect ranking.
+		"""
+		if not self.key.locked():
+			self.usage.save()
+
+	def refresh(self):
+		"""
+		Pick up the accounts and backups other processes (e.g., a one-shot command next to an agent) added, removed or changed since the database was opened or last refreshed.
+		"""
+		if self.storage.refresh():
+			self.index   = AccountIndex(self.storage.names())
+			self.backups = BackupStore(self.storage, self.key)
 
 	def accounts(self, filter = "", list_all = True):
-		matched = set()
-		for account in self.all:
-			if account.startswith(".") and not filter.startswith("."):
-				continue
-			if not list_all and os.sep in account:
-				account = account.split(os.sep)[0] + os.sep
-			if filter in account:
-				matched.add(account)
-		return sorted(matched)
-
-	def select(self, filter = ""):
-		"""
-		Select an account that (at least partially) matches the filter.
-		"""
-		matched = self.accounts(filter)
-		if len(matched) == 0:
+		return self.index.search(filter, list_all)
+
+	def candidates(self, filter = "", strict = False):
+		"""
+		Return the accounts that (at least partially) match the filter, best first. Substring matches are preferred; if there are none, the filter may match as a subsequence (e.g., 'gml' for 'gmail'). When the best match is well ahead of the rest, it is returned alone.
+
+		If strict, as for commands that change or delete the account, only substring matches count, and one is returned alone only if the filter names it exactly or matches no other account.
+		"""
+		with span("match"):
+			if filter in self.index:
+				matched = [filter]
+			else:
+				matched = self.accounts(filter)
+				if len(matched) == 0 and not strict:
+					matched = self.index.fuzzy(filter)
+			ranked = self.matcher.rank(filter, matched)
+		if len(ranked) == 0:
 			# no matches
 			raise ValueError("Error: No matching account.")
-		elif len(matched) == 1:
-			# print and return the one matching account
-			print(f">>>>>>> {matched[0]}")
-			return matched[0]
+		if strict:
+			if len(ranked) == 1 and filter != "":
+				return [ranked[0][1]]
+		elif len(ranked) == 1 or (filter != "" and Matcher.decisive(ranked)):
+			return [ranked[0][1]]
+		return [name for score, name in ranked]
+
+	def select(self, filter = "", strict = False):
+		"""
+		Select an account that (at least partially) matches the filter, asking the user to choose when there's no clear best match. See candidates() for strict.
+		"""
+		matched = self.candidates(filter, strict)
+		if len(matched) == 1:
+			# print and return the best matching account
+			account = matched[0]
+			print(f">>>>>>> {account}")
 		else:
-			return Database.reduce_selection(matched)
+			account = Database.reduce_selection(matched)
+		self.usage.hit(account)
+		return account
 	
+	@staticmethod
+	def _validate(account, lines):
+		"""
+		Check an account name and its lines. Return the lines without surrounding whitespace or blank lines.
+		"""
+		if account[0] == '.' or account[-1] == '.':
+			raise ValueError("Error: Account name can't start or end with a '.' character.")
+		lines = [a.strip() for a in lines]
+		lines = [a for a in lines if a != ""]
+		if len(lines) == 0:
+			raise ValueError(f"Error: Blank password for account {account}.")
+		if " " in lines[0]:
+			raise ValueError(f"Error: Password cannot contain spaces.")
+		return lines
+
 	@staticmethod
 	def reduce_selection(matched):
 		# enumerate and print matched
@@ -78,7 +127,7 @@ class Database:
 				if len(new_matched) == 1:
 					return new_matched[0]
 				elif len(new_matched) > 1:
-					return reduce_selection(new_matched)
+					return Database.reduce_selection(new_matched)
 			except IndexError:
 				pass
 
@@ -114,110 +163,263 @@ class Database:
 		"""
 		Add lines to account file, overwriting existing content.
 		"""	
-		if account[0] == '.' or account[-1] == '.':
-			raise ValueError("Error: Account name can't start or end with a '.' character.")
-
-		# validate lines
-		lines = [a.strip() for a in lines]
-		lines = [a for a in lines if a != ""]
-		if len(lines) == 0:
-			raise ValueError(f"Error: Blank password for account {account}.")
-		if " " in lines[0]:
-			raise ValueError(f"Error: Password cannot contain spaces.")
+		lines = Database._validate(account, lines)
 
 		# encrypt lines
-		pw = lines[0]
-		lines = [self.key.encrypt(a) for a in lines]
+		with span("encrypt"):
+			data = records.encode(self.key, lines, account)
 
-		# filesystem changes
-		Database._make_parent_dirs(account)
+		# storage changes
 		try:
-			with open(account, "w") as f:
-				for line in lines:
-					f.write(line + "\n")
-		except FileNotFoundError:
+			self.storage.write(account, data)
+		except (FileNotFoundError, NotADirectoryError):
 			raise ValueError(f"Error: Could not create account: {account}")
-		self.all.add(account)
-		self.backup(account)
+		self.index.add(account)
+		with span("backup"):
+			self.backup(account, lines)
+		self.storage.flush()
+
+	def load_blocks(self, blocks, workers = None, batch = 256, on_error = None, progress = None):
+		"""
+		Add new accounts from an iterable of blocks, each a list of lines starting with the account name. Blocks are validated here, encrypted in batches across worker processes and written in order; the backups are all made at the end, and everything is flushed once. Invalid blocks are passed to on_error() as a ValueError and skipped. progress() is called with the running total after each batch. Return the number of accounts added.
+		"""
+		from .workers import chunks, map_with_key # imports multiprocessing
+		on_error = on_error or (lambda e: None)
+		seen = {} # account: digest of its contents, for the backups
+		def valid():
+			for block in blocks:
+				account = block[0]
+				try:
+					# check if account name is unavailable
+					if account in seen or self.exists(account):
+						raise ValueError(f"Error: Account {account} already exists.")
+					if self.isdir(account):
+						raise ValueError(f"Error: {account} is an existing directory.")
+					lines = Database._validate(account, block[1:])
+				except ValueError as e:
+					on_error(e)
+					continue
+				seen[account] = self.backups.digest(lines)
+				yield account, lines
+
+		added = []
+		try:
+			for encoded in map_with_key(records.encode_many, chunks(valid(), batch), self.key, workers):
+				with span("write", accounts = len(encoded)):
+					failed = dict(self.storage.write_many(encoded))
+				for account, data in encoded:
+					if account in failed:
+						on_error(ValueError(f"Error: Could not create account: {account}"))
+					else:
+						self.index.add(account)
+						added.append(account)
+				if progress:
+					progress(len(added))
+		finally:
+			# deferred backups
+			with span("backup", accounts = len(added)):
+				self.backups.save_many([(account, seen[account]) for account in added], workers, batch)
+			self.storage.flush()
+		return len(added)
+
+	def export(self, filter = "", workers = None, batch = 256):
+		"""
+		Yield (account, lines) for every account matching the filter, in sorted order. Accounts are read here and decrypted in batches across worker processes, with a bounded number of batches in flight.
+		"""
+		from .workers import chunks, map_with_key # imports multiprocessing
+		def read():
+			for account in self.accounts(filter):
+				yield account, self.storage.read(account)
+		for decoded in map_with_key(records.decode_many, chunks(read(), batch), self.key, workers):
+			yield from decoded
 
 	def content(self, account):
 		"""
 		Return the decrypted file contents.
 		"""
-		lines = []
-		with open(account) as f:
-			line = f.readline()
-			while line:
-				lines.append(self.key.decrypt(line))
-				line = f.readline()
-		return lines
+		with span("read"):
+			data = self.storage.read(account)
+		with span("decrypt"):
+			return records.decode(self.key, data, account)
+
+	def lines(self, account):
+		"""
+		Yield the decrypted lines of an account, decrypting only as far as they are consumed.
+		"""
+		yield from records.iter_decode(self.key, self.storage.stream(account), account)
+
+	def password(self, account):
+		"""
+		Return the first line of an account without decrypting the rest.
+		"""
+		lines = self.lines(account)
+		try:
+			return next(lines)
+		finally:
+			lines.close()
+
+	def exists(self, account):
+		return account in self.index
+
+	def isdir(self, name):
+		return self.index.isdir(name)
 	
 	def rm(self, account):
-		os.remove(account)
-		Database._rm_empty(account)
-		self.all.remove(account)
+		self.storage.remove(account)
+		self.storage.flush()
+		self.index.remove(account)
+		self.usage.remove(account)
 	
 	def mv(self, account1, account2):
 		if account2[0] == '.' or account2[-1] == '.':
 			raise ValueError("Error: Account name can't start or end with a '.' character.")
 		# check if account2 name is unavailable
-		if os.path.isfile(account2):
+		if self.exists(account2):
 			raise ValueError(f"Error: Account {account2} already exists.")
-		if os.path.isdir(account2):
+		if self.isdir(account2):
 			raise ValueError(f"Error: {account2} is an existing directory.")
 		
-		Database._make_parent_dirs(account2)
-		os.rename(account1, account2)
-		Database._rm_empty(account1)
-		
-		self.all.remove(account1)
-		self.all.add(account2)
-		
-		# move ALL backups
-		account1 = os.path.join(".backup", account1 + ".")
-		account2 = os.path.join(".backup", account2 + ".")
-		Database._make_parent_dirs(account2)
-		dirname  = os.path.dirname(account1)
-		backups  = os.listdir(dirname)
-		for b1 in backups:
-			b1 = os.path.join(dirname, b1)
-			if os.path.isfile(b1) and b1.startswith(account1):
-				b2 = b1.replace(account1, account2)
-				os.rename(b1, b2)
-				self.all.remove(b1)
-				self.all.add(b2)
-		Database._rm_empty(account1)
-
-	def backup(self, account):
-		"""
-		Copy the account file into the .backup directory, preserving any folder hierarchy. Also append the current date and time to the backup.
-		"""
-		account_bak  = os.path.join(".backup", account) 
-		account_bak += "." + time.strftime("%y%m%d%H%M%S")
-		Database._make_parent_dirs(account_bak)		
-		shutil.copyfile(account, account_bak)
-		self.all.add(account_bak)
+		# the new name inherits the account's history
+		data = self.storage.read(account1)
+		rebound = records.rebind(self.key, data, account1, account2)
+		if rebound is data:
+			self.storage.rename(account1, account2)
+		else:
+			self.storage.write(account2, rebound)
+			self.storage.remove(account1)
+		self.backups.rename(account1, account2)
+		self.storage.flush()
+		self.index.remove(account1)
+		self.index.add(account2)
+		self.usage.rename(account1, account2)
 
-	@staticmethod
-	def _rm_empty(account):
+	def backup(self, account, lines = None):
 		"""
-		remove potentially empty dirs
+		Save the current contents of the account as a new version in the backup store. Pass the lines if they are at hand, to save decrypting them.
 		"""
-		try:
-			dname = os.path.dirname(account)
-			while dname != '':
-				os.rmdir(dname)
-				dname = os.path.dirname(dname)
-		except OSError:
-			pass # dir not empty
+		if lines is None:
+			lines = self.content(account)
+		self.backups.save(account, self.backups.digest(lines))
 
-	@staticmethod
-	def _make_parent_dirs(account):
+	def history(self, account):
 		"""
-		Make all parent directories if they do not exist.
+		Return the saved versions of an account, including one that has since been deleted or renamed, as (time, hash) pairs, oldest first.
+		"""
+		return self.backups.versions(account)
+
+	def version(self, digest):
 		"""
-		dname = os.path.dirname(account)
+		Return the decrypted lines of a saved version.
+		"""
+		return self.backups.lines(digest)
+
+	def restore(self, account, when = None):
+		"""
+		Bring an account back as it was at the given time, in seconds since the epoch. By default, restore its latest version that differs from what it holds now, or the one it held last if it has been deleted or renamed. Return the time the restored version was saved.
+		"""
+		if self.isdir(account):
+			raise ValueError(f"Error: {account} is an existing directory.")
+		if when is not None:
+			version = self.backups.at(account, when)
+		else:
+			current = self.backups.digest(self.content(account)) if self.exists(account) else None
+			version = next((v for v in reversed(self.history(account)) if v[1] != current), None)
+		if version is None:
+			raise ValueError(f"Error: No earlier version of {account}.")
+		saved, digest = version
 		try:
-			os.makedirs(dname)
-		except (FileNotFoundError, FileExistsError):
-			pass
\ No newline at end of file
+			self.storage.write(account, self.backups.record(digest, account))
+		except (FileNotFoundError, NotADirectoryError):
+			raise ValueError(f"Error: Could not create account: {account}")
+		self.index.add(account)
+		self.backups.save(account, digest)
+		self.storage.flush()
+		return saved
+
+	def gc(self, last = None, daily = None, monthly = None):
+		"""
+		Drop backup versions outside the retention policy (see BackupStore.gc()) and delete what is no longer needed. Return the number of versions dropped, the number of objects deleted and the bytes they took.
+		"""
+		result = self.backups.gc(last, daily, monthly)
+		self.storage.flush()
+		self.storage.compact()
+		return result
+
+	def upgrade(self, backups = False, suite = None):
+		"""
+		Rewrite accounts (and optionally backups) stored in an older record format or another cipher suite, after switching new records to the given suite, if any. Return the number rewritten.
+		"""
+		if suite is not None:
+			self.key.set_suite(suite)
+		names = self.storage.names()
+		if backups:
+			names += self.backups.objects()
+		count = 0
+		for name in names:
+			data = self.storage.read(name)
+			if records.outdated(self.key, data):
+				self.storage.write(name, records.encode(self.key, records.decode(self.key, data, name), name))
+				count += 1
+		self.storage.flush()
+		return count
+
+	def rekey(self, master, backups = False, workers = None, batch = 256, checkpoint = 4096, progress = None):
+		"""
+		Move the database to a new data key. The key file is first saved with a new key to encrypt with, keeping the old one for reading. Every account, and with backups every backup, is then read, decrypted and encrypted again in batches across worker processes, in sorted order, and written back, with the progress checkpointed after every `checkpoint` files. Running rekey again after an interruption carries on from the checkpoint with the same new key. Once everything is done, the old key is dropped from the key file, which commits the rekey; without backups it stays, but only the backups still need it. progress() is called with the running total after each batch. Return the number of files re-encrypted.
+		"""
+		import bisect
+		from .rekey import Checkpoint, reencrypt_many
+		from .workers import chunks, map_with_key # imports multiprocessing
+		self.key.verify(master)
+		state = Checkpoint(os.path.dirname(self.key.keyfile), self.key)
+		resumed = state.load()
+		if resumed is None:
+			self.key.rotate()
+			self.key.save(master)
+			state.save(backups, "")
+			last = ""
+		else:
+			backups = resumed["backups"] if resumed["backups"] is not None else backups
+			last = resumed["last"]
+			self.logger.info(f"Resuming rekey after {last!r}.")
+
+		names = self.storage.names()
+		if backups:
+			names += self.backups.objects() + self.backups.manifests()
+		names.sort()
+		names = names[bisect.bisect_right(names, last):]
+		def read():
+			for name in names:
+				yield name, self.storage.read(name)
+		count = 0
+		unsaved = 0
+		for encrypted in map_with_key(reencrypt_many, chunks(read(), batch), self.key, workers):
+			failed = self.storage.write_many(encrypted)
+			if failed:
+				raise failed[0][1]
+			count   += len(encrypted)
+			unsaved += len(encrypted)
+			if unsaved >= checkpoint:
+				self.storage.flush()
+				state.save(backups, encrypted[-1][0])
+				unsaved = 0
+			if progress:
+				progress(count)
+		self.storage.flush()
+
+		if backups:
+			# nothing needs the old key any more
+			self.storage.rekeyed()
+			self.usage.rewrite()
+			self.key.retire()
+		self.key.save(master)
+		state.clear()
+		return count
+
+	def migrate(self, kind):
+		"""
+		Move all accounts and backups to a different storage backend.
+		"""
+		self.storage  = migrate(self.storage, kind, self.key)
+		self.index    = AccountIndex(self.storage.names())
+		self.backups  = BackupStore(self.storage, self.key)
\ No newline at end of file
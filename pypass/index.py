@@ -0,0 +1,178 @@
+import os
+import bisect
+
+
+class _Node:
+
+	__slots__ = ("children", "leaf")
+
+	def __init__(self):
+		self.children = {}
+		self.leaf     = False
+
+
+class AccountIndex:
+	"""
+	In-memory index of the live account names, kept up to date in place:
+
+	- a sorted list, so listing never has to sort,
+	- a trie of os.sep-separated path segments, for folder grouping and isdir(),
+	- a trigram index mapping every 3-character substring to the names containing it, so substring filters only look at candidates that share all of the filter's trigrams,
+	- a case-insensitive character index, giving the candidates for fuzzy (subsequence) matching.
+
+	Everything but the sorted list is built on first use, so opening the database only pays for the sort.
+	"""
+
+	N = 3
+
+	def __init__(self, names = ()):
+		self.sorted = sorted(set(names))
+		self._root  = None
+		self._grams = None
+		self._chars = None
+
+	def __len__(self):
+		return len(self.sorted)
+
+	def __iter__(self):
+		return iter(self.sorted)
+
+	def __contains__(self, name):
+		i = bisect.bisect_left(self.sorted, name)
+		return i < len(self.sorted) and self.sorted[i] == name
+
+	def add(self, name):
+		if name in self:
+			return
+		bisect.insort(self.sorted, name)
+		if self._root is not None:
+			self._add_path(name)
+		if self._grams is not None:
+			self._add_grams(name)
+		if self._chars is not None:
+			self._add_chars(name)
+
+	def remove(self, name):
+		i = bisect.bisect_left(self.sorted, name)
+		if i == len(self.sorted) or self.sorted[i] != name:
+			raise KeyError(name)
+		del self.sorted[i]
+		if self._root is not None:
+			self._remove_path(name)
+		if self._grams is not None:
+			for gram in AccountIndex._ngrams(name):
+				names = self._grams[gram]
+				names.discard(name)
+				if not names:
+					del self._grams[gram]
+		if self._chars is not None:
+			for c in set(name.lower()):
+				names = self._chars[c]
+				names.discard(name)
+				if not names:
+					del self._chars[c]
+
+	@property
+	def root(self):
+		if self._root is None:
+			self._root = _Node()
+			for name in self.sorted:
+				self._add_path(name)
+		return self._root
+
+	@property
+	def grams(self):
+		if self._grams is None:
+			self._grams = {}
+			for name in self.sorted:
+				self._add_grams(name)
+		return self._grams
+
+	@property
+	def chars(self):
+		if self._chars is None:
+			self._chars = {}
+			for name in self.sorted:
+				self._add_chars(name)
+		return self._chars
+
+	def isdir(self, name):
+		"""
+		Return True if name is a folder holding at least one account.
+		"""
+		node = self._find(name.rstrip(os.sep))
+		return node is not None and len(node.children) > 0
+
+	def search(self, filter = "", list_all = True):
+		"""
+		Return the sorted names containing filter. Unless list_all is set, accounts inside folders are collapsed into their top-level 'folder' + os.sep entry, and filter is matched against that.
+		"""
+		if not list_all:
+			return [name for name in self._top_level() if filter in name]
+		if filter == "":
+			return list(self.sorted)
+		if len(filter) < AccountIndex.N:
+			return [name for name in self.sorted if filter in name]
+		postings = sorted((self.grams.get(gram, ()) for gram in AccountIndex._ngrams(filter)), key = len)
+		if len(postings[0]) == 0:
+			return []
+		candidates = set(postings[0]).intersection(*postings[1:])
+		return sorted(name for name in candidates if filter in name)
+
+	def fuzzy(self, query):
+		"""
+		Return the names containing every character of query, ignoring case. This is a superset of the names query is a subsequence of.
+		"""
+		if query == "":
+			return list(self.sorted)
+		postings = sorted((self.chars.get(c, ()) for c in set(query.lower())), key = len)
+		if len(postings[0]) == 0:
+			return []
+		return set(postings[0]).intersection(*postings[1:])
+
+	def _top_level(self):
+		names = []
+		for segment, node in self.root.children.items():
+			if node.leaf:
+				names.append(segment)
+			if node.children:
+				names.append(segment + os.sep)
+		return sorted(names)
+
+	def _find(self, name):
+		node = self.root
+		for segment in name.split(os.sep):
+			node = node.children.get(segment)
+			if node is None:
+				return None
+		return node
+
+	def _add_path(self, name):
+		node = self._root
+		for segment in name.split(os.sep):
+			node = node.children.setdefault(segment, _Node())
+		node.leaf = True
+
+	def _remove_path(self, name):
+		path = [self._root]
+		segments = name.split(os.sep)
+		for segment in segments:
+			path.append(path[-1].children[segment])
+		path[-1].leaf = False
+		# prune nodes that no longer lead to any account
+		for segment, parent, node in zip(reversed(segments), reversed(path[:-1]), reversed(path[1:])):
+			if node.leaf or node.children:
+				break
+			del parent.children[segment]
+
+	def _add_grams(self, name):
+		for gram in AccountIndex._ngrams(name):
+			self._grams.setdefault(gram, set()).add(name)
+
+	def _add_chars(self, name):
+		for c in set(name.lower()):
+			self._chars.setdefault(c, set()).add(name)
+
+	@staticmethod
+	def _ngrams(text):
+		return {text[i:i+AccountIndex.N] for i in range(len(text) - AccountIndex.N + 1)}
@@ -0,0 +1,200 @@
+import os
+import json
+import itertools
+import logging
+
+from .locks import FileLock
+
+
+class Journal:
+	"""
+	Write-ahead journal that makes a group of file changes under root atomic and durable.
+
+	Changes are staged first: new contents are written to temporary files inside DIRNAME, and renames and removals are only noted. commit() syncs the staged files, then writes the list of changes to the journal file, ending with a commit line, and syncs it; from that point the group is durable. Only then are the changes applied (contents go into place with os.replace(), so each file is always either old or new) and the journal deleted. If the process dies before the commit line is on disk, recover() throws the staged changes away; if it dies after, recover() applies them again. Every change must therefore be safe to apply twice, which holds as long as each name appears only once per group; touches() lets the caller commit early when a name comes up again.
+
+	Several processes may change the same root at once, e.g. an agent and a one-shot command. Staged files are named after the process that wrote them, so no process overwrites or clears another's, and commit() and recover() hold an exclusive lock, so a group is never recovered or discarded while its writer is still committing it. Staged files left behind by a process that died before committing are deleted by recover().
+
+	Syncing each staged file costs one fsync per file, so for large groups a single os.sync() is used instead.
+	"""
+
+	REMOVED  = object()
+	DIRNAME  = ".journal"
+	FILENAME = "journal"
+	LOCKNAME = "lock"
+	SYNC_ALL = 64 # staged files above which one os.sync() is cheaper than an fsync each
+
+	_seq = itertools.count(1) # shared by every Journal in the process, so their staged files never collide
+
+	def __init__(self, root):
+		self.logger = logging.getLogger()
+		self.root = root
+		self.dir  = os.path.join(root, Journal.DIRNAME)
+		self.path = os.path.join(self.dir, Journal.FILENAME)
+		os.makedirs(self.dir, exist_ok = True)
+		self.lock  = FileLock(os.path.join(self.dir, Journal.LOCKNAME))
+		self.ops   = []
+		self.view  = {} # name: file holding its contents once the group is applied, or REMOVED
+
+	def put(self, name, data):
+		"""
+		Stage new contents for name.
+		"""
+		tmp = os.path.join(self.dir, f"{os.getpid()}.{next(Journal._seq)}.tmp")
+		with open(tmp, "wb") as f:
+			f.write(data)
+		self.ops.append(["put", name, os.path.basename(tmp)])
+		self.view[name] = tmp
+
+	def remove(self, name):
+		self.ops.append(["rm", name, None])
+		self.view[name] = Journal.REMOVED
+
+	def rename(self, old, new):
+		self.ops.append(["mv", old, new])
+		self.view[new] = os.path.join(self.root, old)
+		self.view[old] = Journal.REMOVED
+
+	def touches(self, name):
+		"""
+		Return True if the pending group already changes name.
+		"""
+		return name in self.view
+
+	def lookup(self, name):
+		"""
+		Return the file holding the staged contents of name, REMOVED, or None if the pending group doesn't change it.
+		"""
+		return self.view.get(name)
+
+	def commit(self, apply):
+		"""
+		Make the staged changes durable, then call apply(op, name, arg) for each of them in order. Return the number of changes.
+		"""
+		if not self.ops:
+			return 0
+		ops = self.ops
+		self._sync_files([os.path.join(self.dir, arg) for op, name, arg in ops if op == "put"])
+		with self.lock:
+			with open(self.path, "w") as f:
+				for op in ops:
+					f.write(json.dumps(op) + "\n")
+				f.write(json.dumps({"commit": len(ops)}) + "\n")
+				f.flush()
+				os.fsync(f.fileno())
+			self._sync_dir(self.dir)
+			self._apply(ops, apply)
+		self.ops  = []
+		self.view = {}
+		return len(ops)
+
+	def recover(self, apply):
+		"""
+		Finish a group that was committed but not fully applied, and discard one that was never committed, along with the files staged by processes that are gone. Return the number of changes applied again.
+		"""
+		with self.lock:
+			ops = []
+			try:
+				with open(self.path) as f:
+					lines = [json.loads(line) for line in f]
+				if lines and isinstance(lines[-1], dict) and lines[-1].get("commit") == len(lines) - 1:
+					ops = lines[:-1]
+				else:
+					self.logger.warning(f"Discarding uncommitted changes in {self.path}.")
+			except FileNotFoundError:
+				pass
+			except ValueError:
+				# the journal was torn while being written, so it was never committed
+				self.logger.warning(f"Discarding uncommitted changes in {self.path}.")
+			if ops:
+				self.logger.warning(f"Recovering {len(ops)} journaled changes.")
+				self._apply(ops, apply)
+			else:
+				self._clear([])
+			for entry in os.listdir(self.dir):
+				if entry.endswith(".tmp") and not _writer_alive(entry):
+					os.remove(os.path.join(self.dir, entry))
+		return len(ops)
+
+	def destroy(self):
+		"""
+		Delete the journal directory, once nothing is staged.
+		"""
+		try:
+			os.remove(self.lock.path)
+			os.rmdir(self.dir)
+		except OSError:
+			pass
+
+	def _apply(self, ops, apply):
+		for op, name, arg in ops:
+			if op == "put":
+				arg = os.path.join(self.dir, arg)
+			apply(op, name, arg)
+		# the changes must be on disk before the journal that could redo them is gone
+		dirs = set()
+		for op, name, arg in ops:
+			dirs.add(os.path.dirname(name))
+			if op == "mv":
+				dirs.add(os.path.dirname(arg))
+		self._sync_dirs(dirs)
+		self._clear(ops)
+
+	def _clear(self, ops):
+		"""
+		Delete the journal and what is left of the files staged for ops, leaving other processes' staged files alone.
+		"""
+		for path in [self.path] + [os.path.join(self.dir, arg) for op, name, arg in ops if op == "put"]:
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+
+	def _sync_files(self, paths):
+		if len(paths) > Journal.SYNC_ALL and hasattr(os, "sync"):
+			os.sync()
+			return
+		for path in paths:
+			with open(path, "rb") as f:
+				os.fsync(f.fileno())
+
+	def _sync_dirs(self, dirs):
+		if len(dirs) > Journal.SYNC_ALL and hasattr(os, "sync"):
+			os.sync()
+			return
+		for dname in dirs:
+			self._sync_dir(os.path.join(self.root, dname))
+
+	@staticmethod
+	def _sync_dir(path):
+		"""
+		Make the entries of a directory durable, where the platform allows it.
+		"""
+		try:
+			fd = os.open(path, os.O_RDONLY)
+		except OSError:
+			return # e.g. removed, or Windows, which can't open directories
+		try:
+			os.fsync(fd)
+		except OSError:
+			pass
+		finally:
+			os.close(fd)
+
+
+def _writer_alive(entry):
+	"""
+	Return True unless the process that staged the file named entry is known to be gone.
+	"""
+	pid = entry.split(".")[0]
+	if entry.count(".") != 2 or not pid.isdigit():
+		return False # staged by an older version, which didn't name the process
+	pid = int(pid)
+	if pid == os.getpid() or os.name == "nt": # there, os.kill() would terminate the process
+		return True
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except OSError:
+		pass # e.g. another user's
+	return True
@@ -0,0 +1,142 @@
+import time
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+try:
+	from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+except ImportError:
+	Argon2id = None # cryptography < 44
+
+
+class KDF:
+	"""
+	A password-based key derivation function together with its cost parameters.
+	"""
+
+	name    = None
+	LENGTH  = 32
+	DEFAULT = {}
+
+	def __init__(self, **params):
+		self.params = dict(self.DEFAULT, **params)
+
+	def __eq__(self, other):
+		return isinstance(other, KDF) and (self.name, self.params) == (other.name, other.params)
+
+	def __str__(self):
+		params = ", ".join(f"{k}={v}" for k, v in self.params.items())
+		return f"{self.name}({params})"
+
+	def to_dict(self):
+		return {"name": self.name, "params": self.params}
+
+	def derive(self, password, salt):
+		"""
+		Derive LENGTH bytes from the password (bytes) and salt.
+		"""
+		raise NotImplementedError()
+
+	def time(self, salt = b"\0" * 16):
+		"""
+		Return how many seconds one derivation takes on this machine.
+		"""
+		start = time.perf_counter()
+		self.derive(b"calibration", salt)
+		return time.perf_counter() - start
+
+	@classmethod
+	def calibrate(cls, target):
+		"""
+		Return the strongest parameters whose derivation takes about target seconds here, but never weaker than DEFAULT.
+		"""
+		raise NotImplementedError()
+
+
+class PBKDF2(KDF):
+
+	name    = "pbkdf2-sha256"
+	DEFAULT = {"iterations": 100000}
+
+	def derive(self, password, salt):
+		kdf = PBKDF2HMAC(
+			algorithm  = hashes.SHA256(),
+			length     = KDF.LENGTH,
+			salt       = salt,
+			iterations = self.params["iterations"],
+			backend    = default_backend()
+		)
+		return kdf.derive(password)
+
+	@classmethod
+	def calibrate(cls, target):
+		probe = cls(iterations = cls.DEFAULT["iterations"])
+		rate  = probe.params["iterations"] / probe.time()
+		iterations = max(int(rate * target) // 1000 * 1000, cls.DEFAULT["iterations"])
+		return cls(iterations = iterations)
+
+
+class ScryptKDF(KDF):
+
+	name    = "scrypt"
+	DEFAULT = {"n": 2**15, "r": 8, "p": 1}
+	MAX_MEMORY = 2**30 # bytes
+
+	def derive(self, password, salt):
+		kdf = Scrypt(
+			salt    = salt,
+			length  = KDF.LENGTH,
+			n       = self.params["n"],
+			r       = self.params["r"],
+			p       = self.params["p"],
+			backend = default_backend()
+		)
+		return kdf.derive(password)
+
+	@classmethod
+	def calibrate(cls, target):
+		kdf = cls()
+		elapsed = kdf.time()
+		# time and memory both grow linearly with n, which must be a power of 2
+		while elapsed * 2 <= target and 128 * kdf.params["r"] * kdf.params["n"] * 2 <= cls.MAX_MEMORY:
+			kdf = cls(n = kdf.params["n"] * 2)
+			elapsed = kdf.time()
+		return kdf
+
+
+class Argon2KDF(KDF):
+
+	name    = "argon2id"
+	DEFAULT = {"iterations": 2, "lanes": 4, "memory_cost": 64 * 1024} # memory in KiB
+	MIN_MEMORY = 19 * 1024
+
+	def derive(self, password, salt):
+		kdf = Argon2id(
+			salt        = salt,
+			length      = KDF.LENGTH,
+			iterations  = self.params["iterations"],
+			lanes       = self.params["lanes"],
+			memory_cost = self.params["memory_cost"],
+		)
+		return kdf.derive(password)
+
+	@classmethod
+	def calibrate(cls, target):
+		memory  = cls.DEFAULT["memory_cost"]
+		elapsed = cls(iterations = 1, memory_cost = memory).time()
+		# give up memory rather than go below the minimum number of passes
+		while elapsed * cls.DEFAULT["iterations"] > target and memory // 2 >= cls.MIN_MEMORY:
+			memory //= 2
+			elapsed /= 2
+		iterations = max(int(target / elapsed), cls.DEFAULT["iterations"])
+		return cls(iterations = iterations, memory_cost = memory)
+
+
+KDFS = {kdf.name: kdf for kdf in [PBKDF2, ScryptKDF] + ([Argon2KDF] if Argon2id is not None else [])}
+
+def from_dict(d):
+	try:
+		return KDFS[d["name"]](**d["params"])
+	except KeyError:
+		raise ValueError(f"Error: Unsupported key derivation function: {d.get('name')}")
@@ -0,0 +1,71 @@
+"""
+Exclusive locks on files, held between processes, for the files that an agent and one-shot commands may change at the same time.
+"""
+
+import os
+import threading
+
+
+class FileLock:
+	"""
+	An exclusive lock on path, created if need be. Used as a context manager, it blocks until no other process holds the lock. It is reentrant, so code holding it can call code that takes it again, and threads of one process take turns.
+	"""
+
+	def __init__(self, path):
+		self.path   = path
+		self._fd    = None
+		self._depth = 0
+		self._local = threading.RLock()
+
+	def __enter__(self):
+		self._local.acquire()
+		if self._depth == 0:
+			try:
+				self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+				lock(self._fd)
+			except:
+				if self._fd is not None:
+					os.close(self._fd)
+					self._fd = None
+				self._local.release()
+				raise
+		self._depth += 1
+		return self
+
+	def __exit__(self, *exc):
+		self._depth -= 1
+		if self._depth == 0:
+			try:
+				unlock(self._fd)
+			finally:
+				os.close(self._fd)
+				self._fd = None
+		self._local.release()
+
+
+def lock(fd):
+	"""
+	Block until this process holds the exclusive lock on the open file fd.
+	"""
+	try:
+		import fcntl
+	except ImportError:
+		import msvcrt
+		os.lseek(fd, 0, os.SEEK_SET) # Windows locks a range of bytes, starting here
+		while True:
+			try:
+				msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+				return
+			except OSError:
+				pass # gave up after 10 seconds; keep waiting
+	fcntl.flock(fd, fcntl.LOCK_EX)
+
+def unlock(fd):
+	try:
+		import fcntl
+	except ImportError:
+		import msvcrt
+		os.lseek(fd, 0, os.SEEK_SET)
+		msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+		return
+	fcntl.flock(fd, fcntl.LOCK_UN)
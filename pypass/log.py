@@ -1,21 +1,206 @@
+"""
+Logging to the database's log files.
+
+Records are put on a queue, and a background thread writes them out, so a command never waits for the disk. Log files are rotated when they grow too big, or when a record falls on a later day than the last one written, and the last few are kept.
+
+Optionally, each command also writes an audit record to a separate file, as a line of JSON: when it ran, the command and its positional args (account names, filters, files), how long it took, and whether it succeeded. Passwords and account contents are never part of it.
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
 import logging
+import threading
+
+AUDIT     = "pypass.audit" # name of the audit logger
+MAX_BYTES = 1 << 20
+BACKUPS   = 5
+DAYS      = 30
+
+_writer   = None
+_handlers = [] # queue handlers attached to loggers
+
+# logging.handlers has all of this, but importing it (with pickle and socket) would cost every command more than logging saves
+
+
+class RotatingFileHandler(logging.FileHandler):
+	"""
+	A file handler that moves the file to file.1 (file.1 to file.2, etc.) and starts a new one once it would grow past max_bytes, or when a record falls on a later period of days than the last record written. The last backups files are kept.
+	"""
+
+	def __init__(self, file, max_bytes = MAX_BYTES, backups = BACKUPS, days = DAYS):
+		super().__init__(file, encoding = "utf-8", delay = True)
+		self.max_bytes = max_bytes
+		self.backups   = max(backups, 1)
+		self.interval  = days * 86400 if days else None
+		self.period    = None
+		if self.interval and os.path.exists(file):
+			self.period = self._period(os.stat(file).st_mtime)
+
+	def _period(self, t):
+		# in local time, so that periods start at midnight
+		return int((t + time.localtime(t).tm_gmtoff) // self.interval)
+
+	def emit(self, record):
+		try:
+			if self.should_rollover(record):
+				self.rollover()
+		except Exception:
+			self.handleError(record)
+			return
+		super().emit(record)
+
+	def should_rollover(self, record):
+		if self.interval:
+			period = self._period(record.created)
+			last, self.period = self.period, period
+			if last is not None and period != last:
+				return True
+		if self.max_bytes > 0:
+			if self.stream is None:
+				self.stream = self._open()
+			self.stream.seek(0, os.SEEK_END)
+			return self.stream.tell() > 0 and self.stream.tell() + len(self.format(record)) + 1 > self.max_bytes
+		return False
+
+	def rollover(self):
+		if self.stream is not None:
+			self.stream.close()
+			self.stream = None
+		for i in range(self.backups - 1, 0, -1):
+			if os.path.exists(f"{self.baseFilename}.{i}"):
+				os.replace(f"{self.baseFilename}.{i}", f"{self.baseFilename}.{i + 1}")
+		if os.path.exists(self.baseFilename):
+			os.replace(self.baseFilename, f"{self.baseFilename}.1")
+
+
+class QueueHandler(logging.Handler):
+	"""
+	Put records on a queue for the writer thread, with their message formatted already, since the objects in its args may change once the call returns.
+	"""
+
+	def __init__(self, records):
+		super().__init__()
+		self.records = records
+
+	def emit(self, record):
+		try:
+			message = self.format(record)
+			record = logging.makeLogRecord(record.__dict__)
+			record.message = record.msg = message
+			record.args = record.exc_info = record.exc_text = record.stack_info = None
+			self.records.put(record)
+		except Exception:
+			self.handleError(record)
+
+
+class Writer(threading.Thread):
+	"""
+	The thread that takes records off the queue and hands them to the file handlers, until stop().
+	"""
+
+	def __init__(self, records, handlers):
+		super().__init__(name = "pypass log writer", daemon = True)
+		self.records  = records
+		self.handlers = handlers
+
+	def run(self):
+		while (record := self.records.get()) is not None:
+			for handler in self.handlers:
+				if record.levelno >= handler.level:
+					handler.handle(record)
+
+	def stop(self):
+		self.records.put(None)
+		self.join()
+		for handler in self.handlers:
+			handler.close()
+
+
+class JsonFormatter(logging.Formatter):
+	"""
+	Format records as one JSON object per line: the time, and the record's 'audit' fields, or its level and message if it has none.
+	"""
+
+	def format(self, record):
+		entry = {"time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S")}
+		fields = getattr(record, "audit", None)
+		if fields is None:
+			entry["level"]   = record.levelname
+			entry["message"] = record.getMessage()
+		else:
+			entry.update(fields)
+		return json.dumps(entry)
+
+
+def configure_logging(file, lvl = logging.INFO, audit = None, max_bytes = MAX_BYTES, backups = BACKUPS, days = DAYS):
+	"""
+	Log to file, and write audit records to the audit file, if given, through a background thread. Calling it again replaces the earlier configuration.
+	"""
+	global _writer
+	stop_logging()
+
+	logger = logging.getLogger()
+	logger.setLevel(lvl)
+	logger.propagate = 0
 
-def configure_logging(file, lvl = logging.INFO):		
-    logger = logging.getLogger()
-    logger.setLevel(lvl)
-    logger.propagate = 0
-    
 	# Format
-    formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s", "%Y/%m/%d %H:%M:%S")
-    
-	# Setup console logging
-    #ch = logging.StreamHandler()
-    #ch.setLevel(logging.DEBUG)
-    #ch.setFormatter(formatter)
-    #logger.addHandler(ch)
-    
-	# Setup file logging as well
-    fh = logging.FileHandler(file)
-    fh.setLevel(logging.DEBUG)
-    fh.setFormatter(formatter)
-    logger.addHandler(fh)
\ No newline at end of file
+	formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s", "%Y/%m/%d %H:%M:%S")
+
+	# Setup file logging
+	fh = RotatingFileHandler(file, max_bytes, backups, days)
+	fh.setLevel(logging.DEBUG)
+	fh.setFormatter(formatter)
+	fh.addFilter(lambda record: record.name != AUDIT) # they share the writer thread, not the file
+	handlers = [fh]
+
+	# Setup audit logging as well
+	if audit is not None:
+		ah = RotatingFileHandler(audit, max_bytes, backups, days)
+		ah.addFilter(logging.Filter(AUDIT))
+		ah.setFormatter(JsonFormatter())
+		handlers.append(ah)
+
+	# the writer thread
+	records = queue.SimpleQueue()
+	_writer = Writer(records, handlers)
+	_writer.start()
+	qh = QueueHandler(records)
+	logger.addHandler(qh)
+	_handlers.append((logger, qh))
+	if audit is not None:
+		# audit records go to the same queue, but only when asked to keep them
+		audit_logger = logging.getLogger(AUDIT)
+		audit_logger.addHandler(qh)
+		_handlers.append((audit_logger, qh))
+
+def stop_logging():
+	"""
+	Write out the records still queued and stop the writer thread.
+	"""
+	global _writer
+	while _handlers:
+		logger, handler = _handlers.pop()
+		logger.removeHandler(handler)
+	if _writer is not None:
+		_writer.stop()
+		_writer = None
+
+def auditing():
+	"""
+	Whether audit records are being kept.
+	"""
+	return any(logger.name == AUDIT for logger, handler in _handlers)
+
+def audit(**fields):
+	"""
+	Write an audit record with these fields.
+	"""
+	logger = logging.getLogger(AUDIT)
+	message = " ".join(f"{k}={v}" for k, v in fields.items())
+	logger.info(f"Audit: {message}", extra = {"audit": fields})
+
+logging.getLogger(AUDIT).propagate = False
+atexit.register(stop_logging)
@@ -0,0 +1,233 @@
+import os
+import json
+import math
+import time
+import logging
+
+from . import locks
+
+
+class Usage:
+	"""
+	How often and how recently each account was selected, kept encrypted in a .usage file and read on first use.
+
+	Hits are only counted in memory, so selecting an account costs no write. save() writes them out, and is called when the database is flushed; a long session also saves once its oldest unsaved hit is SAVE_AFTER seconds old. Other processes may have saved hits of their own in the meantime, so save() reads the file again, under a lock, and replays the changes made here on top of it.
+	"""
+
+	FILENAME   = ".usage"
+	HALF_LIFE  = 30 * 24 * 60 * 60 # seconds
+	SAVE_AFTER = 60 # seconds
+
+	def __init__(self, root, key):
+		self.path  = os.path.join(root, Usage.FILENAME)
+		self.key   = key
+		self._hits = None
+		self._changes  = [] # not saved yet, as (op, args)
+		self._unsaved  = None # time of the first of them
+
+	@property
+	def hits(self):
+		if self._hits is None:
+			try:
+				with open(self.path) as f:
+					self._hits = self._decrypt(f.read())
+			except FileNotFoundError:
+				self._hits = {}
+		return self._hits
+
+	def weight(self, account, now = None):
+		"""
+		Return log(1 + count), halved for every HALF_LIFE since the last use.
+		"""
+		if account not in self.hits:
+			return 0.0
+		count, last = self.hits[account]
+		age = (now or time.time()) - last
+		return math.log1p(count) * 0.5 ** (max(age, 0) / Usage.HALF_LIFE)
+
+	def hit(self, account):
+		self._change("hit", account, time.time())
+		if time.monotonic() - self._unsaved >= Usage.SAVE_AFTER:
+			self.save()
+
+	def rename(self, account1, account2):
+		if account1 in self.hits:
+			self._change("mv", account1, account2)
+			self.save()
+
+	def remove(self, account):
+		if account in self.hits:
+			self._change("rm", account)
+			self.save()
+
+	def save(self):
+		"""
+		Write out the changes made since the last save, merged with those other processes saved.
+		"""
+		if self._changes:
+			self._write()
+
+	def rewrite(self):
+		"""
+		Write the statistics again, e.g. under a new key.
+		"""
+		if self.hits or self._changes:
+			self._write()
+
+	def _change(self, op, *args):
+		Usage._replay(self.hits, [(op, args)])
+		self._changes.append((op, args))
+		if self._unsaved is None:
+			self._unsaved = time.monotonic()
+
+	def _write(self):
+		# rewritten in place: creating a new file would change the database directory's mtime and invalidate the name index
+		fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+		with open(fd, "r+") as f:
+			locks.lock(fd)
+			try:
+				hits = self._decrypt(f.read())
+				Usage._replay(hits, self._changes)
+				f.seek(0)
+				f.truncate()
+				f.write(self.key.encrypt(json.dumps(hits)))
+				f.flush()
+			finally:
+				locks.unlock(fd)
+		self._hits    = hits
+		self._changes = []
+		self._unsaved = None
+
+	def _decrypt(self, text):
+		if not text:
+			return {}
+		try:
+			return {account: tuple(hit) for account, hit in json.loads(self.key.decrypt(text)).items()}
+		except Exception as e:
+			# losing the statistics only affects ranking
+			logging.getLogger().warning(f"Ignoring unreadable {self.path}: {e!r}")
+			return {}
+
+	@staticmethod
+	def _replay(hits, changes):
+		for op, args in changes:
+			if op == "hit":
+				account, now = args
+				count, last = hits.get(account, (0, 0))
+				hits[account] = (count + 1, max(last, now))
+			elif op == "mv":
+				account1, account2 = args
+				if account1 in hits:
+					hits[account2] = hits.pop(account1)
+			elif op == "rm":
+				hits.pop(args[0], None)
+
+
+class Matcher:
+	"""
+	Rank account names against a query. The query must appear in the name as a case-insensitive subsequence. Each matched character scores points, with bonuses for starting a word or path segment and for following the previous match directly, and a penalty for each gap. Matches that fit inside the last path segment (the account's own name, not its folders) get a boost, and accounts that were picked often and recently rank higher.
+	"""
+
+	MATCH       = 16
+	BOUNDARY    = 8
+	CONSECUTIVE = 10
+	GAP_OPEN    = 3
+	MAX_GAP     = 8
+	SEGMENT     = 24
+	EXACT       = 1000
+	USAGE       = 20
+	DECISIVE    = 40 # lead the best match needs over the next to be picked without asking
+
+	WORD_BREAKS = os.sep + " -_.@"
+
+	def __init__(self, usage = None):
+		self.usage = usage
+
+	def score(self, query, name, now = None):
+		"""
+		Return the score of name, or None if the query does not match it.
+		"""
+		q = query.lower()
+		n = name.lower()
+		if q == n:
+			return Matcher.EXACT
+		segment_start = n.rfind(os.sep) + 1
+		positions = Matcher._align(q, n, segment_start)
+		if positions is not None:
+			bonus = Matcher.SEGMENT
+		else:
+			positions = Matcher._align(q, n, 0)
+			if positions is None:
+				return None
+			bonus = 0
+		if q == n[segment_start:]:
+			bonus += Matcher.SEGMENT
+		# shorter names break ties, except when there's no query to be short relative to
+		s = bonus - 0.1 * len(n) if q else 0.0
+		prev = None
+		for p in positions:
+			s += Matcher.MATCH
+			if p == 0 or n[p-1] in Matcher.WORD_BREAKS:
+				s += Matcher.BOUNDARY
+			if prev is not None:
+				if p == prev + 1:
+					s += Matcher.CONSECUTIVE
+				else:
+					s -= Matcher.GAP_OPEN + min(p - prev - 1, Matcher.MAX_GAP)
+			prev = p
+		if self.usage is not None:
+			s += Matcher.USAGE * self.usage.weight(name, now)
+		return s
+
+	def rank(self, query, names):
+		"""
+		Return (score, name) pairs for the matching names, best first.
+		"""
+		now = time.time()
+		ranked = []
+		for name in names:
+			s = self.score(query, name, now)
+			if s is not None:
+				ranked.append((s, name))
+		ranked.sort(key = lambda x: (-x[0], x[1]))
+		return ranked
+
+	@staticmethod
+	def decisive(ranked):
+		"""
+		Return True if the best match is far enough ahead to pick it without asking.
+		"""
+		return len(ranked) == 1 or ranked[0][0] - ranked[1][0] >= Matcher.DECISIVE
+
+	@staticmethod
+	def _align(q, n, start):
+		"""
+		Return the positions of the shortest window of n[start:] containing q as a subsequence, or None.
+		"""
+		if q == "":
+			return []
+		# find where the first complete match ends
+		i = 0
+		for j in range(start, len(n)):
+			if n[j] == q[i]:
+				i += 1
+				if i == len(q):
+					end = j
+					break
+		else:
+			return None
+		# walk back to the latest start that still matches
+		i = len(q) - 1
+		for j in range(end, start - 1, -1):
+			if n[j] == q[i]:
+				i -= 1
+				if i < 0:
+					first = j
+					break
+		positions = []
+		i = 0
+		for j in range(first, end + 1):
+			if i < len(q) and n[j] == q[i]:
+				positions.append(j)
+				i += 1
+		return positions
@@ -1,12 +1,19 @@
 import sys
 import os
 import time
+import threading
+import json
 import shlex
+import itertools
 import argparse
 import textwrap
-import pyperclip
 import logging
-from contextlib import contextmanager
+
+from io import StringIO
+from contextlib import contextmanager, redirect_stdout, redirect_stderr
+
+from . import log, timing
+from .timing import span
 
 
 @contextmanager
@@ -16,15 +23,59 @@ def _chdir(dir):
 	yield
 	os.chdir(old_dir)
 
+async def in_thread(func, *args):
+	"""
+	Await func(*args) run in a daemon thread. Unlike asyncio.to_thread(), a thread stuck waiting for input can't keep the program from exiting.
+	"""
+	import asyncio
+	loop   = asyncio.get_running_loop()
+	future = loop.create_future()
+	def call():
+		try:
+			result = func(*args)
+		except BaseException as e:
+			loop.call_soon_threadsafe(future.set_exception, e)
+		else:
+			loop.call_soon_threadsafe(future.set_result, result)
+	threading.Thread(target = call, daemon = True).start()
+	return await future
+
 class ErrorCatchingArgumentParser(argparse.ArgumentParser):
     def exit(self, status = 0, message = None):
+        if message:
+            self._print_message(message, sys.stderr)
         raise EOFError()
 
 class Parser:
+
+	SUBCOMMANDS = { # name: (help, handler), in the order they are listed
+		"master":    ("change master password", "master"),
+		"ls":        ("list accounts", "ls"),
+		"load":      ("load accounts from a file", "load"),
+		"add":       ("add a new account", "add"),
+		"edit":      ("edit an existing account", "edit"),
+		"copy":      ("copy an account password to the clipboard", "copy"),
+		"print":     ("print all account details", "print_account"),
+		"mv":        ("rename an account", "mv"),
+		"rm":        ("delete an account", "rm"),
+		"history":   ("list the saved versions of an account", "history"),
+		"restore":   ("bring back an earlier version of an account", "restore"),
+		"migrate":   ("convert the database to another storage format", "migrate"),
+		"upgrade":   ("rewrite accounts stored in an older format", "upgrade"),
+		"gc":        ("delete old backups and reclaim their space", "gc"),
+		"calibrate": ("tune the master password key derivation to this machine", "calibrate"),
+		"rekey":     ("re-encrypt the database under a new data key", "rekey"),
+		"export":    ("write decrypted accounts to a file", "export"),
+		"help":      ("show this help message and exit", "help"),
+	}
+	COMMANDS = list(SUBCOMMANDS)
 	
-	def __init__(self, db):
+	def __init__(self, db, clipboard = None):
 		self.logger = logging.getLogger()
 		self.db = db
+		self._clipboard = clipboard
+		self.lock = threading.Lock()
+		self.assume_yes = False # answer yes to any [y/n] prompts, as in batch()
 		
 		self.parser = ErrorCatchingArgumentParser(prog = "pypass",
 			description = "Create, store, and retrieve passwords for multiple accounts.")
@@ -34,91 +85,183 @@ class Parser:
 			help = "do not copy passwords to the clipboard")
 		self.parser.add_argument("-a", "--all", dest = "list_all", action = "store_true",
 			help = "show all accounts inside subdirectories")
-		self.parser.add_argument("-t", "--time", dest = "seconds", nargs = 1, default = 20, type = int,
+		self.parser.add_argument("-t", "--time", dest = "seconds", default = 20, type = int,
 			help = "time, in seconds, to keep the password copied to the clipboard")
-		subparsers = self.parser.add_subparsers(dest = "command", title = "subcommands",
+		self.parser.add_argument("--profile", dest = "profile", action = "store_true",
+			help = "print how long each step of the command took")
+		self.parser.add_argument("--trace", dest = "trace", metavar = "FILE", default = None,
+			help = "save the timings as a Chrome trace (see chrome://tracing or https://ui.perfetto.dev)")
+		# subcommand parsers are only built when needed, see _subparser()
+		self.subparsers = self.parser.add_subparsers(dest = "command", title = "subcommands",
 			description = "Type 'COMMAND -h' to see how to use these subcommands.")
 
-		self.parser_master = subparsers.add_parser("master", help = "change master password")
+	def __getattr__(self, name):
+		# parser_ls, parser_add, etc.
+		if name.startswith("parser_") and name[len("parser_"):] in Parser.SUBCOMMANDS:
+			return self._subparser(name[len("parser_"):])
+		raise AttributeError(name)
+
+	@property
+	def clipboard(self):
+		if self._clipboard is None:
+			from .clipboard import Clipboard # imports pyperclip, which most commands never need
+			self._clipboard = Clipboard()
+		return self._clipboard
 
-		self.parser_ls = subparsers.add_parser("ls", help = "list accounts")
-		self.parser_ls.add_argument("-a", "--all", dest = "list_all", action = "store_true",
+	def wait_for_clipboard(self):
+		"""
+		Block until anything copied has been cleared from the clipboard.
+		"""
+		if self._clipboard is not None:
+			self._clipboard.wait()
+
+	def build_all(self):
+		"""
+		Build the parsers of all subcommands, e.g. to print the full help.
+		"""
+		for command in Parser.SUBCOMMANDS:
+			self._subparser(command)
+
+	def _subparser(self, command):
+		"""
+		Return the parser of a subcommand, building it on first use.
+		"""
+		p = self.__dict__.get(f"parser_{command}")
+		if p is None:
+			help, handler = Parser.SUBCOMMANDS[command]
+			p = self.subparsers.add_parser(command, help = help)
+			add_args = getattr(self, f"_args_{command}", None)
+			if add_args is not None:
+				add_args(p)
+			p.set_defaults(func = getattr(self, handler))
+			setattr(self, f"parser_{command}", p)
+		return p
+
+
+	### Subcommand arguments ##############################################
+
+
+	def _args_ls(self, p):
+		p.add_argument("-a", "--all", dest = "list_all", action = "store_true",
 			help = "show all accounts inside subdirectories")
-		self.parser_ls.add_argument("arg", metavar = "filter", nargs = "?", default = "",
+		p.add_argument("arg", metavar = "filter", nargs = "?", default = "",
 			help = "optionally filter account names containing this string")
 
-		self.parser_load = subparsers.add_parser("load", help = "load accounts from a file")
-		self.parser_load.add_argument("infile", metavar = "file", type = argparse.FileType(),
+	def _args_load(self, p):
+		p.add_argument("infile", metavar = "file", type = argparse.FileType(),
 			help = "file to load (or '-' to read from the console); The file/input should be formatted as such: [ACCOUNT\\nPASSWORD\\n[MISC\\n]*\\n]+")
+		p.add_argument("-w", "--workers", dest = "workers", default = None, type = int,
+			help = "number of processes to encrypt with (default: one per CPU)")
 
-		self.parser_add = subparsers.add_parser("add", help = "add a new account")
-		self.parser_add.add_argument("arg", metavar = "account_name", # nargs = 1 # saved as a list, causes problems
+	def _args_add(self, p):
+		p.add_argument("arg", metavar = "account_name", # nargs = 1 # saved as a list, causes problems
 			help = "name of the new account to add")
-		self.parser_add.add_argument("-g", "--generate", dest = "length", nargs = "?", action = "store",
+		p.add_argument("-g", "--generate", dest = "length", nargs = "?", action = "store",
 			default = -1, const = 16, type = int,
 			help = "generate password (default: False/16 characters)")
-		self.parser_add.add_argument("-s", "--symbols", dest = "symbols", nargs = "?", action = "store",
+		p.add_argument("-s", "--symbols", dest = "symbols", nargs = "?", action = "store",
 			default = None, const = "",
 			help = "symbols to select from when generating passwords; no symbols used if no argument given")
-		self.parser_add.add_argument("-m", "--multiline", dest = "multiline", action = "store_true",
+		p.add_argument("-m", "--multiline", dest = "multiline", action = "store_true",
 			help = "ask user for multiple lines of input")
-		self.parser_add.add_argument("--no-clip", dest = "clip", action = "store_false",
+		p.add_argument("--no-clip", dest = "clip", action = "store_false",
 			help = "do not copy passwords to the clipboard")
-		self.parser_add.add_argument("-t", "--time", dest = "seconds", nargs = 1, default = 20, type = int,
+		p.add_argument("-t", "--time", dest = "seconds", default = 20, type = int,
 			help = "time, in seconds, to keep the password copied to the clipboard")
 
-		self.parser_edit = subparsers.add_parser("edit", help = "edit an existing account")
-		self.parser_edit.add_argument("arg", metavar = "account_name", nargs = "?", default = "",
+	def _args_edit(self, p):
+		p.add_argument("arg", metavar = "account_name", nargs = "?", default = "",
 			help = "name of the account to edit")					
-		self.parser_edit.add_argument("-g", "--generate", dest = "length", nargs = "?", action = "store",
+		p.add_argument("-g", "--generate", dest = "length", nargs = "?", action = "store",
 			default = -1, const = 16, type = int,
 			help = "generate password (default: False/16 characters)")
-		self.parser_edit.add_argument("-s", "--symbols", dest = "symbols", nargs = "?", action = "store",
+		p.add_argument("-s", "--symbols", dest = "symbols", nargs = "?", action = "store",
 			default = None, const = "",
 			help = "symbols to select from when generating passwords; no symbols used if no argument given")
-		self.parser_edit.add_argument("-m", "--multiline", dest = "multiline", action = "store_true",
+		p.add_argument("-m", "--multiline", dest = "multiline", action = "store_true",
 			help = "ask user for multiple lines of input")
-		self.parser_edit.add_argument("--no-clip", dest = "clip", action = "store_false",
+		p.add_argument("--no-clip", dest = "clip", action = "store_false",
 			help = "do not copy passwords to the clipboard")
-		self.parser_edit.add_argument("-t", "--time", dest = "seconds", nargs = 1, default = 20, type = int,
+		p.add_argument("-t", "--time", dest = "seconds", default = 20, type = int,
 			help = "time, in seconds, to keep the password copied to the clipboard")
 
-		self.parser_copy = subparsers.add_parser("copy", help = "copy an account password to the clipboard")
-		self.parser_copy.add_argument("arg", metavar = "account_name", nargs = "?", default = "",
+	def _args_copy(self, p):
+		p.add_argument("arg", metavar = "account_name", nargs = "?", default = "",
 			help = "name of the account to copy")
-		self.parser_copy.add_argument("--no-clip", dest = "clip", action = "store_false",
+		p.add_argument("--no-clip", dest = "clip", action = "store_false",
 			help = "do not copy passwords to the clipboard")
-		self.parser_copy.add_argument("-t", "--time", dest = "seconds", nargs = 1, default = 20, type = int,
+		p.add_argument("-t", "--time", dest = "seconds", default = 20, type = int,
 			help = "time, in seconds, to keep the password copied to the clipboard")
 
-		self.parser_print = subparsers.add_parser("print", help = "print all account details")
-		self.parser_print.add_argument("arg", metavar = "account_name", nargs = "?", default = "",
+	def _args_print(self, p):
+		p.add_argument("arg", metavar = "account_name", nargs = "?", default = "",
 			help = "name of the account to print")
 
-		self.parser_mv = subparsers.add_parser("mv", help = "rename an account")
-		self.parser_mv.add_argument("arg", metavar = "account_name",
+	def _args_mv(self, p):
+		p.add_argument("arg", metavar = "account_name",
 			help = "name of the account to rename")
-		self.parser_mv.add_argument("arg2", metavar = "new_account_name",
+		p.add_argument("arg2", metavar = "new_account_name",
 			help = "new name for the account")
 
-		self.parser_rm = subparsers.add_parser("rm", help = "delete an account")
-		self.parser_rm.add_argument("arg", metavar = "account_name", nargs = "?", default = "",
+	def _args_rm(self, p):
+		p.add_argument("arg", metavar = "account_name", nargs = "?", default = "",
 			help = "name of the account to delete")
-		self.parser_rm.add_argument("-y", "--yes", dest = "yes", action = "store_true",
+		p.add_argument("-y", "--yes", dest = "yes", action = "store_true",
 			help = "answer yes to any [y/n] prompts")
 
-		self.parser_help = subparsers.add_parser("help", help = "show this help message and exit")
-
-		self.parser_master.set_defaults(func = self.master)
-		self.parser_ls.set_defaults(func = self.ls)
-		self.parser_load.set_defaults(func = self.load)
-		self.parser_add.set_defaults(func = self.add)
-		self.parser_edit.set_defaults(func = self.edit)
-		self.parser_copy.set_defaults(func = self.copy)
-		self.parser_print.set_defaults(func = self.print_account)
-		self.parser_mv.set_defaults(func = self.mv)
-		self.parser_rm.set_defaults(func = self.rm)
-		self.parser_help.set_defaults(func = lambda *x: self.parser.print_help())
+	def _args_history(self, p):
+		p.add_argument("arg", metavar = "account_name",
+			help = "name of the account, which may have been deleted or renamed since")
+		p.add_argument("-p", "--passwords", dest = "passwords", action = "store_true",
+			help = "show the password of each version")
+
+	def _args_restore(self, p):
+		p.add_argument("arg", metavar = "account_name",
+			help = "name of the account, which may have been deleted or renamed since")
+		p.add_argument("--at", dest = "at", metavar = "TIME", default = None, type = Parser._time,
+			help = "restore the version that was current at this time, e.g. '2024-05-01 13:00' or '3d' for 3 days ago (default: the latest version that differs from the current one)")
+
+	def _args_migrate(self, p):
+		p.add_argument("arg", metavar = "format", choices = ["dir", "packed"],
+			help = "'dir' stores one file per account; 'packed' stores everything in a single indexed vault file (running it again compacts the vault)")
+
+	def _args_upgrade(self, p):
+		from . import ciphers # imports cryptography
+		p.add_argument("-b", "--backups", dest = "backups", action = "store_true",
+			help = "upgrade backups as well")
+		p.add_argument("-c", "--cipher", dest = "suite", default = None, choices = sorted(ciphers.SUITES),
+			help = "cipher suite to write accounts with from now on (default: keep the current one)")
+
+	def _args_gc(self, p):
+		p.add_argument("-l", "--keep-last", dest = "last", default = None, type = int,
+			help = "keep the last N versions of each account")
+		p.add_argument("-d", "--keep-daily", dest = "daily", default = None, type = int,
+			help = "keep the last version of each of the last N days that have one")
+		p.add_argument("-m", "--keep-monthly", dest = "monthly", default = None, type = int,
+			help = "keep the last version of each of the last N months that have one")
+
+	def _args_calibrate(self, p):
+		from . import kdf # imports cryptography
+		p.add_argument("-t", "--target", dest = "target", default = 250, type = int,
+			help = "time, in milliseconds, that unlocking should take (default: 250)")
+		p.add_argument("-k", "--kdf", dest = "kdf", default = "scrypt", choices = sorted(kdf.KDFS),
+			help = "key derivation function to use (default: scrypt)")
+
+	def _args_rekey(self, p):
+		p.add_argument("-b", "--backups", dest = "backups", action = "store_true",
+			help = "re-encrypt backups as well, so the old key can be dropped")
+		p.add_argument("-w", "--workers", dest = "workers", default = None, type = int,
+			help = "number of processes to encrypt with (default: one per CPU)")
+
+	def _args_export(self, p):
+		p.add_argument("arg", metavar = "filter", nargs = "?", default = "",
+			help = "optionally export only account names containing this string")
+		p.add_argument("-o", "--output", dest = "outfile", default = "-", type = argparse.FileType("w"),
+			help = "file to write (default: print to the console); it is only readable by you")
+		p.add_argument("-f", "--format", dest = "format", default = "blocks", choices = ["blocks", "jsonl"],
+			help = "'blocks' is the format read by load; 'jsonl' writes one JSON object per account")
+		p.add_argument("-w", "--workers", dest = "workers", default = None, type = int,
+			help = "number of processes to decrypt with (default: one per CPU)")
 
 	def parse(self, args):
 		"""
@@ -132,26 +275,133 @@ class Parser:
 		
 		args = [a.replace("/", os.sep) for a in args]
 
-		# default subcommand
-		if all(s not in args for s in ["master", "ls", "add", "rm", "edit", "mv", "load", "copy", "print", "help"]):
-			args.insert(0, "copy")
-		
-		# -n implies -g
-		if any(f in args for f in ["-s", "--symbols"]) and "-g" not in args:
-			args.append("-g")
+		with span("parse"):
+			# default subcommand
+			if all(s not in args for s in Parser.COMMANDS):
+				args.insert(0, "copy")
+			self._subparser(Parser.command(args))
+			
+			# -n implies -g
+			if any(f in args for f in ["-s", "--symbols"]) and "-g" not in args:
+				args.append("-g")
 
-		self.logger.debug(f"Processed args: {args}")
+			self.logger.debug(f"Processed args: {args}")
 
-		args = self.parser.parse_args(args)
+			args = self.parser.parse_args(args)
 
 		if args.func is self.load:
 			args.arg = os.path.abspath(args.arg)
+		if self.assume_yes:
+			args.yes = True
 		
-		lvl = logging.INFO if args.command in ["master", "add", "rm", "edit", "mv", "load"] else logging.DEBUG
+		lvl = logging.INFO if args.command in ["master", "add", "rm", "edit", "mv", "restore", "load", "migrate", "upgrade", "gc", "calibrate", "rekey", "export"] else logging.DEBUG
 		self.logger.log(lvl, f"{vars(args)}")
 		
-		with _chdir(self.db.dir):
-			args.func(args)
+		if self.db is None:
+			args.func(args) # only help works without a database
+			return
+
+		# timing may already be on for the whole process, see one_shot()
+		started = (args.profile or args.trace is not None) and not timing.enabled()
+		if started:
+			timing.enable()
+		start = time.perf_counter()
+		outcome, error = "error", None
+		try:
+			with _chdir(self.db.dir), span(args.command):
+				args.func(args)
+			outcome = "ok"
+		except (KeyboardInterrupt, EOFError):
+			outcome = "cancelled"
+			raise
+		except Exception as e:
+			error = str(e) if isinstance(e, ValueError) else type(e).__name__
+			raise
+		finally:
+			if log.auditing():
+				self._audit(args, outcome, error, time.perf_counter() - start)
+			if timing.enabled():
+				self._report(args, started)
+
+	def _audit(self, args, outcome, error, elapsed):
+		"""
+		Write the audit record of a command: its positional args, which name accounts, filters or files but never hold secrets, how long it took, and how it ended.
+		"""
+		positional = {}
+		for action in self._subparser(args.command)._actions:
+			if not action.option_strings:
+				value = getattr(args, action.dest, None)
+				positional[action.metavar or action.dest] = getattr(value, "name", value) # files by name
+		fields = {"command": args.command, "args": positional, "ms": round(elapsed * 1000, 3), "outcome": outcome}
+		if error is not None:
+			fields["error"] = error
+		log.audit(**fields)
+
+	def _report(self, args, started):
+		"""
+		Log the time the command took, step by step, and print it too if asked to with --profile. If timing was started for this command only, save the trace and stop timing.
+		"""
+		for line in timing.report(f"'{args.command}'"):
+			self.logger.info(line)
+			if args.profile:
+				print(line, file = sys.stderr)
+		if started:
+			if args.trace is not None:
+				timing.write_trace(args.trace)
+			timing.disable()
+
+	def batch(self, lines):
+		"""
+		Run commands, one per line, answering yes to any [y/n] prompts and giving them no other input. Blank lines and lines starting with '#' are skipped. Yield a result for each command: its line number, the command, whether it succeeded ('ok' or 'error'), the error message, what it printed and how long it took, in ms.
+		"""
+		self.assume_yes = True
+		stdin = sys.stdin
+		try:
+			for number, line in enumerate(lines, 1):
+				line = line.strip()
+				if not line or line.startswith("#"):
+					continue
+				out, err = StringIO(), StringIO()
+				result = {"line": number, "command": line, "outcome": "error"}
+				start = time.perf_counter()
+				try:
+					sys.stdin = StringIO()
+					with redirect_stdout(out), redirect_stderr(err):
+						self.parse(line)
+					result["outcome"] = "ok"
+				except EOFError:
+					# argparse errors end up here too, after printing why
+					usage = [l for l in err.getvalue().splitlines() if l.strip()]
+					result["error"] = usage[-1] if usage else "Error: Command needs input, which batch mode can't give."
+				except ValueError as e:
+					result["error"] = str(e) if str(e).startswith("Error") else f"Error: {e}" # e.g. from shlex
+				except Exception as e:
+					self.logger.exception(f"Batch command failed: {line}")
+					result["error"] = f"Error: {type(e).__name__}: {e}"
+				finally:
+					sys.stdin = stdin
+				result["ms"] = round((time.perf_counter() - start) * 1000, 3)
+				result["output"] = out.getvalue()
+				yield result
+		finally:
+			self.assume_yes = False
+
+	@staticmethod
+	def command(args):
+		"""
+		Return the subcommand named in a list of args, or the default, 'copy'.
+		"""
+		return next((a for a in args if a in Parser.SUBCOMMANDS), "copy")
+
+	async def run(self, args):
+		"""
+		Parse and run a command in a worker thread, so the event loop stays free to restore the clipboard and serve agent clients while the command waits for input. Commands run one at a time, each after picking up what other processes changed in the database since the last one.
+		"""
+		def parse():
+			with self.lock:
+				self.db.refresh()
+				self.parse(args)
+		await in_thread(parse)
 
 
 	### Command handlers ##################################################
@@ -182,37 +432,44 @@ class Parser:
 		"""
 		self.db.key.login()
 
-		# read lines
-		lines = args.infile.readlines()
-		lines = [line.strip() for line in lines]
+		def on_error(e):
+			self.logger.error(str(e))
+			print(e)
+
+		start = time.perf_counter()
+		def progress(count):
+			rate = count / max(time.perf_counter() - start, 1e-9)
+			print(f"Loaded {count} accounts ({rate:.0f}/s)", end = "\r", file = sys.stderr, flush = True)
+
+		blocks = Parser._read_blocks(args.infile)
+		count  = self.db.load_blocks(blocks, args.workers, on_error = on_error, progress = progress)
+		elapsed = time.perf_counter() - start
+		print(f"Loaded {count} accounts in {elapsed:.1f} s ({count / max(elapsed, 1e-9):.0f} accounts/s).", file = sys.stderr)
+		self.logger.info(f"Loaded {count} accounts in {elapsed:.1f} s.")
 
-		# separate into blocks
-		blocks = [[]]
-		for line in lines:
-			if line == "":
-				if blocks[-1] != []:
-					blocks.append([])
+	def export(self, args):
+		"""
+		Write decrypted accounts in the load format or as JSON lines.
+		"""
+		self.db.key.login()
+		out = args.outfile
+		if out is not sys.stdout:
+			os.chmod(out.name, 0o600)
+		count = 0
+		start = time.perf_counter()
+		try:
+			for account, lines in self.db.export(args.arg, args.workers):
+				account = account.replace(os.sep, "/")
+				if args.format == "jsonl":
+					out.write(json.dumps({"account": account, "password": lines[0], "notes": lines[1:]}) + "\n")
 				else:
-					pass
-			else:
-				blocks[-1].append(line)
-		if blocks[-1] == []:
-			blocks.pop()
-		
-		# add
-		for block in blocks:
-			block[0] = block[0].replace(".", "-")
-			block[0] = block[0].replace("/", os.sep)
-			try:
-				# check if account name is unavailable
-				if os.path.isfile(block[0]):
-					raise ValueError(f"Error: Account {account} already exists.")
-				if os.path.isdir(block[0]):
-					raise ValueError(f"Error: {account} is an existing directory.")
-				self.db.add_block(block[0], block[1:])
-			except ValueError as e:
-				self.logger.error(str(e))
-				print(e)
+					out.write("\n".join([account] + lines) + "\n\n")
+				count += 1
+		finally:
+			if out is not sys.stdout:
+				out.close()
+		elapsed = time.perf_counter() - start
+		print(f"Exported {count} accounts in {elapsed:.1f} s ({count / max(elapsed, 1e-9):.0f} accounts/s).", file = sys.stderr)
 
 	def add(self, args):
 		"""
@@ -226,14 +483,14 @@ class Parser:
 		symbols   = args.symbols
 
 		# check if account name is unavailable
-		if os.path.isfile(account):
+		if self.db.exists(account):
 			raise ValueError(f"Error: Account {account} already exists.")
-		if os.path.isdir(account):
+		if self.db.isdir(account):
 			raise ValueError(f"Error: {account} is an existing directory.")
 		
 		self.db.add_input(account, generate, multiline, symbols)
 		if args.clip:
-			Parser._clip_text(self.db.content(account)[0], args.seconds)
+			self._clip_text(self.db.password(account), args.seconds)
 
 	def edit(self, args):
 		"""
@@ -241,34 +498,24 @@ class Parser:
 		"""
 		self.db.key.login()
 		
-		args.arg  = self.db.select(args.arg)
+		args.arg  = self.db.select(args.arg, strict = True)
 		
 		account   = args.arg
 		generate  = args.length
 		multiline = args.multiline
 		symbols   = args.symbols
-		
-		old_account = account + ".old"
-
-		os.rename(account, old_account)
 
-		try:
-			lines         = self.db.content(old_account)
-			multiline    |= len(lines) > 1
-			lines         = "\n".join(lines)
-			print(lines)
-			print()
-
-			self.db.add_input(account, generate, multiline, symbols)
-			
-		except Exception as e:
-			os.rename(old_account, account)
-			raise e
+		lines      = self.db.content(account)
+		multiline |= len(lines) > 1
+		lines      = "\n".join(lines)
+		print(lines)
+		print()
 
-		os.remove(old_account)
+		# the account is only overwritten once all input has been validated
+		self.db.add_input(account, generate, multiline, symbols)
 		
 		if args.clip:
-			Parser._clip_text(self.db.content(account)[0], args.seconds)
+			self._clip_text(self.db.password(account), args.seconds)
 
 	def copy(self, args):
 		"""
@@ -276,9 +523,9 @@ class Parser:
 		"""
 		self.db.key.login()
 		account = self.db.select(args.arg)
-		pw = self.db.content(account)[0]
+		pw = self.db.password(account)
 		if args.clip:
-			Parser._clip_text(pw, args.seconds)
+			self._clip_text(pw, args.seconds)
 		else:
 			print(pw)
 
@@ -296,15 +543,96 @@ class Parser:
 		"""
 		Rename account.
 		"""
-		account1 = self.db.select(args.arg)
+		account1 = self.db.select(args.arg, strict = True)
 		account2 = args.arg2
 		self.db.mv(account1, account2)
+
+	def history(self, args):
+		"""
+		Print the saved versions of an account, newest first.
+		"""
+		self.db.key.login()
+		account  = self._account_with_history(args.arg)
+		current  = self.db.backups.digest(self.db.content(account)) if self.db.exists(account) else None
+		print(f"History of {account}:")
+		for saved, digest in reversed(self.db.history(account)):
+			line = f"  {Parser._strftime(saved)}"
+			if args.passwords:
+				line += f"  {self.db.version(digest)[0]}"
+			if digest == current:
+				line += "  (current)"
+			print(line)
+
+	def restore(self, args):
+		"""
+		Restore an earlier version of an account.
+		"""
+		self.db.key.login()
+		account = self._account_with_history(args.arg, strict = True)
+		saved = self.db.restore(account, args.at)
+		print(f"Restored {account} as saved at {Parser._strftime(saved)}.")
+
+	def upgrade(self, args):
+		"""
+		Rewrite accounts stored in an older record format.
+		"""
+		self.db.key.login()
+		count = self.db.upgrade(args.backups, args.suite)
+		print(f"Upgraded {count} account{'s' if count != 1 else ''}.")
+
+	def gc(self, args):
+		"""
+		Apply a retention policy to the backups and delete what is no longer needed.
+		"""
+		self.db.key.login()
+		dropped, deleted, size = self.db.gc(args.last, args.daily, args.monthly)
+		print(f"Dropped {dropped} version{'s' if dropped != 1 else ''} and deleted {deleted} backup file{'s' if deleted != 1 else ''}, reclaiming {size / 1024:.1f} KiB.")
+
+	def calibrate(self, args):
+		"""
+		Benchmark the key derivation function and save parameters for the target unlock time.
+		"""
+		self.db.key.login()
+		params = self.db.key.calibrate(args.target / 1000, args.kdf)
+		print(f"Selected {params}, which takes {params.time() * 1000:.0f} ms here.")
+		print("The master key will be re-wrapped with these parameters at the next login.")
+
+	def rekey(self, args):
+		"""
+		Re-encrypt the database under a new data key, resuming an interrupted rekey.
+		"""
+		self.db.key.login()
+		master = input("Master Password: ")
+		start = time.perf_counter()
+		def progress(count):
+			rate = count / max(time.perf_counter() - start, 1e-9)
+			print(f"Re-encrypted {count} files ({rate:.0f}/s)", end = "\r", file = sys.stderr, flush = True)
+		count = self.db.rekey(master, args.backups, args.workers, progress = progress)
+		elapsed = time.perf_counter() - start
+		print(f"Re-encrypted {count} files in {elapsed:.1f} s ({count / max(elapsed, 1e-9):.0f} files/s).", file = sys.stderr)
+		self.logger.info(f"Re-encrypted {count} files in {elapsed:.1f} s.")
+
+	def migrate(self, args):
+		"""
+		Convert the database to another storage backend.
+		"""
+		self.db.key.login()
+		self.db.migrate(args.arg)
+		print(f"Database is now stored in {args.arg} format.")
 		
+	def help(self, args):
+		"""
+		Print help for the program and list all subcommands.
+		"""
+		parser = Parser(self.db)
+		parser.build_all()
+		parser.parser.print_help()
+
 	def rm(self, args):
 		"""
 		Delete account.
 		"""
-		account = self.db.select(args.arg)
+		account = self.db.select(args.arg, strict = True)
 		if args.yes or Parser._yesno("Delete?", False):
 			self.db.rm(account)
 
@@ -312,29 +640,55 @@ class Parser:
 	### Miscellaneous functions ###########################################
 
 	
+	def _clip_text(self, text, seconds):
+		"""
+		Temporarily copy text to clipboard. The old contents are restored in the background.
+		"""
+		self.clipboard.copy(text, seconds)
+		print(f"Copied to clipboard for {seconds} seconds.")
+	
+	def _account_with_history(self, name, strict = False):
+		"""
+		Return the account a history or restore command is about: the name as given if it has a history, which may be a deleted account, or else the best matching account.
+		"""
+		if self.db.history(name):
+			return name
+		return self.db.select(name, strict)
+
 	@staticmethod
-	def _clip_text(text, seconds):
+	def _time(text):
 		"""
-		Temporarily copy text to clipboard.
+		Parse a date and time such as '2024-05-01 13:00', or a time ago such as '90m', '12h', '3d' or '2w'. Return seconds since the epoch.
 		"""
-		old_clip = pyperclip.paste()
-		pyperclip.copy(text)
-		p = lambda s: print(s, end = "", flush = True)
+		units = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60, "w": 7 * 24 * 60 * 60}
+		if text[-1:] in units and text[:-1].isdigit():
+			return time.time() - int(text[:-1]) * units[text[-1]]
+		import datetime
 		try:
-			for s in range(seconds, 0, -1):
-				p("Copied to clipboard [" + "="*s + " "*(seconds-s) + "]")
-				try:
-					time.sleep(1)
-				finally:
-					#p("\b" * 52)
-					p("\r")
-		except KeyboardInterrupt:
-			pass
-		finally:
-			#p(" "*52 + "\b"*52)
-			p(" "*52 + "\r")
-			pyperclip.copy(old_clip)
-	
+			return datetime.datetime.fromisoformat(text).timestamp()
+		except ValueError:
+			raise argparse.ArgumentTypeError(f"invalid time: '{text}'")
+
+	@staticmethod
+	def _strftime(seconds):
+		return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(seconds))
+
+	@staticmethod
+	def _read_blocks(infile):
+		"""
+		Yield blocks of non-blank lines separated by blank lines, reading the file as it goes. The first line of each block is made into a valid account name.
+		"""
+		block = []
+		for line in itertools.chain(infile, [""]):
+			line = line.strip()
+			if line:
+				block.append(line)
+			elif block:
+				block[0] = block[0].replace(".", "-")
+				block[0] = block[0].replace("/", os.sep)
+				yield block
+				block = []
+
 	@staticmethod
 	def _yesno(prompt, default = True):
 		"""
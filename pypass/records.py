@@ -0,0 +1,99 @@
+"""
+Encoding of account contents.
+
+Version 1 (legacy) files hold one encrypted token per line of the account. Version 2 files start with a 'pypass:2' header line, followed by one encrypted token per section, where a section is several account lines joined by newlines. The password is written as its own first section and all remaining lines as a second one, so an account costs at most two encryptions, and the password can be read without decrypting the notes. The header can never be mistaken for a version 1 token, since ':' is not part of the token alphabet.
+
+Version 1 and 2 tokens are Fernet tokens. Version 3 files are laid out like version 2, but name the cipher suite (see ciphers.py) in the header, as in 'pypass:3:aes-256-gcm', and the tokens may be bound to the name the file is stored under. Records are still written as version 2 when the suite is Fernet, so that older versions of pypass can read them.
+"""
+
+from . import ciphers
+
+HEADER  = b"pypass:"
+VERSION = 3
+
+
+def encode(key, lines, name = None):
+	"""
+	Encrypt account lines into the current record format, with the key's cipher suite, for storing under name.
+	"""
+	suite = ciphers.SUITES[key.suite]
+	sections = [lines[0]]
+	if len(lines) > 1:
+		sections.append("\n".join(lines[1:]))
+	if suite.name == ciphers.DEFAULT:
+		data = [HEADER + b"2"]
+	else:
+		data = [HEADER + f"{VERSION}:{suite.name}".encode()]
+	data.extend(suite.encrypt(key, section, name).encode() for section in sections)
+	return b"\n".join(data) + b"\n"
+
+def iter_decode(key, data, name = None):
+	"""
+	Decrypt a record of any version stored under name, given as an iterable of raw lines, into account lines. Tokens are only read and decrypted as the lines are consumed.
+	"""
+	data = iter(data)
+	first = next(data, b"").strip()
+	ver, suite = _header(first)
+	suite = ciphers.SUITES[suite]
+	if ver == 1 and first:
+		yield key.decrypt(first.decode())
+	for token in data:
+		token = token.strip()
+		if not token:
+			continue
+		text = suite.decrypt(key, token.decode(), name)
+		if ver > 1:
+			yield from text.split("\n")
+		else:
+			yield text
+
+def decode(key, data, name = None):
+	"""
+	Decrypt a record of any version stored under name into account lines.
+	"""
+	return list(iter_decode(key, data.splitlines(), name))
+
+def encode_many(key, items):
+	"""
+	Encode (name, lines) pairs into (name, data) pairs.
+	"""
+	return [(name, encode(key, lines, name)) for name, lines in items]
+
+def decode_many(key, items):
+	"""
+	Decode (name, data) pairs into (name, lines) pairs.
+	"""
+	return [(name, decode(key, data, name)) for name, data in items]
+
+def rebind(key, data, old, new):
+	"""
+	Return a record stored under old, made ready to be stored under new: the same data unless its cipher suite binds it to its name, otherwise encoded again.
+	"""
+	if not ciphers.SUITES[_header(data.split(b"\n", 1)[0])[1]].bound:
+		return data
+	return encode(key, decode(key, data, old), new)
+
+def outdated(key, data):
+	"""
+	Whether encode() would write a record in a different format or cipher suite.
+	"""
+	ver, suite = _header(data.split(b"\n", 1)[0])
+	return ver == 1 or suite != key.suite
+
+def version(data):
+	return _header(data.split(b"\n", 1)[0])[0]
+
+def _header(first):
+	"""
+	Return the version and cipher suite of a record, given its first line.
+	"""
+	if not first.startswith(HEADER):
+		return 1, ciphers.DEFAULT
+	ver, _, suite = first[len(HEADER):].strip().decode().partition(":")
+	ver = int(ver)
+	if ver > VERSION:
+		raise ValueError(f"Error: Account was written by a newer version of pypass (record format {ver}).")
+	suite = suite or ciphers.DEFAULT
+	if suite not in ciphers.SUITES:
+		raise ValueError(f"Error: Account was written by a newer version of pypass (cipher suite {suite}).")
+	return ver, suite
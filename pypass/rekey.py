@@ -0,0 +1,66 @@
+"""
+Re-encryption of a database under a new data key; see Database.rekey().
+"""
+
+import os
+import json
+import logging
+
+from . import records
+from .backups import BackupStore
+
+
+class Checkpoint:
+	"""
+	How far an interrupted rekey got, kept encrypted in a .rekey file, so that running rekey again picks up where it stopped rather than starting over with yet another key.
+	"""
+
+	FILENAME = ".rekey"
+
+	def __init__(self, root, key):
+		self.path = os.path.join(root, Checkpoint.FILENAME)
+		self.key  = key
+
+	def load(self):
+		"""
+		Return the saved state, or None if no rekey is under way.
+		"""
+		try:
+			with open(self.path) as f:
+				return json.loads(self.key.decrypt(f.read()))
+		except FileNotFoundError:
+			return None
+		except Exception as e:
+			# torn while being rewritten; starting over is safe, since re-encrypting twice does no harm
+			logging.getLogger().warning(f"Ignoring unreadable {self.path}: {e!r}")
+			return {"backups": None, "last": ""}
+
+	def save(self, backups, last):
+		"""
+		Record that every name up to and including last, in sorted order, has been re-encrypted and flushed.
+		"""
+		# rewritten in place, like .usage, so the database directory's mtime only changes when the file is created
+		with open(self.path, "w") as f:
+			f.write(self.key.encrypt(json.dumps({"backups": backups, "last": last})))
+			f.flush()
+			os.fsync(f.fileno())
+
+	def clear(self):
+		try:
+			os.remove(self.path)
+		except FileNotFoundError:
+			pass
+
+
+def reencrypt_many(key, items):
+	"""
+	Decrypt (name, data) pairs with any accepted key and encrypt them again with the current one. Accounts and backup versions are records, written back in the current record format; backup manifests are single tokens.
+	"""
+	out = []
+	for name, data in items:
+		if name.startswith(BackupStore.MANIFESTS + os.sep):
+			data = key.encrypt(key.decrypt(data.decode())).encode()
+		else:
+			data = records.encode(key, records.decode(key, data, name), name)
+		out.append((name, data))
+	return out
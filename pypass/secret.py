@@ -0,0 +1,96 @@
+"""
+Memory for key material that can be wiped.
+
+Python's bytes and str are immutable, so a key held in one stays on the heap, and possibly in swap or a core dump, until the memory happens to be reused. A SecretBuffer instead keeps its contents in a private anonymous mapping, which is locked into RAM and left out of core dumps where the platform allows, and which wipe() overwrites with zeros before unmapping it.
+"""
+
+import os
+import sys
+import mmap
+import logging
+
+_LIBC = None # loaded by _libc() when first needed, along with ctypes
+
+
+def _libc():
+	global _LIBC
+	if _LIBC is None:
+		_LIBC = False
+		if sys.platform != "win32":
+			import ctypes
+			try:
+				_LIBC = ctypes.CDLL(None, use_errno = True)
+			except OSError:
+				pass
+	return _LIBC or None
+
+
+class SecretBuffer:
+	"""
+	A fixed-size, mutable buffer for secrets, initially all zeros. Read and fill it through view, without making copies.
+	"""
+
+	def __init__(self, size):
+		self.size   = size
+		self._mmap  = mmap.mmap(-1, max(size, 1))
+		self.view   = memoryview(self._mmap)[:size]
+		self.locked = self._mlock(True)
+		if hasattr(mmap, "MADV_DONTDUMP"):
+			self._mmap.madvise(mmap.MADV_DONTDUMP)
+
+	@classmethod
+	def fill(cls, *parts):
+		"""
+		Return a buffer holding the concatenated parts.
+		"""
+		buffer = cls(sum(len(p) for p in parts))
+		offset = 0
+		for part in parts:
+			buffer.view[offset:offset + len(part)] = part
+			offset += len(part)
+		return buffer
+
+	def __len__(self):
+		return self.size
+
+	def wiped(self):
+		return self._mmap is None
+
+	def wipe(self):
+		"""
+		Overwrite the contents with zeros, then unlock and unmap the memory. Views taken of view keep the memory mapped until they are released, but see only zeros.
+		"""
+		if self._mmap is None:
+			return
+		self._mmap[:] = bytes(len(self._mmap))
+		if self.locked:
+			self._mlock(False)
+		self.view.release()
+		try:
+			self._mmap.close()
+		except BufferError:
+			pass # still exported; unmapped when the last view goes
+		self._mmap = None
+
+	def _mlock(self, lock):
+		libc = _libc()
+		if libc is None:
+			return False
+		import ctypes
+		pointer = ctypes.c_char.from_buffer(self._mmap)
+		try:
+			func = libc.mlock if lock else libc.munlock
+			if func(ctypes.c_void_p(ctypes.addressof(pointer)), ctypes.c_size_t(len(self._mmap))) == 0:
+				return True
+			if lock:
+				# usually RLIMIT_MEMLOCK; the buffer still works, it may just be swapped out
+				logging.getLogger().debug(f"Could not lock key memory: {os.strerror(ctypes.get_errno())}")
+			return False
+		finally:
+			del pointer
+
+	def __del__(self):
+		try:
+			self.wipe()
+		except Exception:
+			pass
@@ -0,0 +1,861 @@
+import os
+import json
+import struct
+import logging
+from contextlib import contextmanager
+
+from .journal import Journal
+from .locks import FileLock
+from .timing import span
+
+
+class Storage:
+	"""
+	Base class for account storage backends. Account contents are opaque bytes; names are relative paths using os.sep. Names under .backup belong to the BackupStore and are kept apart from the live accounts.
+	"""
+
+	kind = None
+
+	def names(self):
+		"""
+		Return a list of the live account names.
+		"""
+		raise NotImplementedError()
+
+	def backups(self):
+		"""
+		Return a list of the names under .backup.
+		"""
+		raise NotImplementedError()
+
+	def exists(self, account):
+		raise NotImplementedError()
+
+	def isdir(self, name):
+		raise NotImplementedError()
+
+	def read(self, account):
+		raise NotImplementedError()
+
+	def stream(self, account):
+		"""
+		Yield the raw lines of an account, reading no more than the caller consumes where the backend allows it.
+		"""
+		yield from self.read(account).splitlines(True)
+
+	def write(self, account, data):
+		raise NotImplementedError()
+
+	def write_many(self, items):
+		"""
+		Write (account, data) pairs. Return (account, error) pairs for the ones that could not be written.
+		"""
+		failed = []
+		for account, data in items:
+			try:
+				self.write(account, data)
+			except OSError as e:
+				failed.append((account, e))
+		return failed
+
+	def copy(self, account, name):
+		"""
+		Make name hold the current contents of account.
+		"""
+		self.copy_many([(account, name)])
+
+	def copy_many(self, pairs):
+		"""
+		Copy several (account, name) pairs. Return (name, error) pairs for the copies that could not be made.
+		"""
+		return self.write_many((name, self.read(account)) for account, name in pairs)
+
+	def remove(self, account):
+		raise NotImplementedError()
+
+	def rename(self, account1, account2):
+		raise NotImplementedError()
+
+	def flush(self):
+		"""
+		Make pending changes durable.
+		"""
+		pass
+
+	def refresh(self):
+		"""
+		Pick up the changes other processes made since the storage was opened or last refreshed. Return True if the names may have changed.
+		"""
+		return False
+
+	def compact(self):
+		"""
+		Give back the space left behind by removed contents, for backends that don't do so right away.
+		"""
+		pass
+
+	def rekeyed(self):
+		"""
+		Encrypt whatever else the backend keeps encrypted again, under the key's new data key.
+		"""
+		pass
+
+	def destroy(self):
+		"""
+		Delete everything held by this backend.
+		"""
+		raise NotImplementedError()
+
+
+class DirectoryStorage(Storage):
+	"""
+	One file per account, preserving any folder hierarchy, with the backup store's files under .backup.
+
+	Changes go through a Journal and take effect together at the next flush(), which makes them durable with one commit. Reads see staged contents. Opening the storage finishes or discards whatever a crash left in the journal.
+
+	Other processes may change the same files. Their flushes append to the name caches, which refresh() notices, reading the caches again.
+	"""
+
+	kind = "dir"
+
+	def __init__(self, root = ".", key = None):
+		self.root = os.path.abspath(root)
+		try:
+			os.mkdir(self._path(".backup"))
+		except OSError:
+			pass # exists
+		self.key = key
+		self.index        = None
+		self.backup_index = None
+		self.journal = Journal(self.root)
+		self.journal.recover(self._apply)
+		if key is not None:
+			with self.journal.lock:
+				self._load_indexes()
+
+	def names(self):
+		if self.index is not None:
+			return list(self.index.names)
+		return self._staged(self._scan(".", skip = ".backup")[0], False)
+
+	def backups(self):
+		if self.backup_index is None:
+			return self._staged(self._scan(".backup")[0], True)
+		if not self.backup_index.loaded:
+			with self._caches():
+				self.journal.commit(self._apply)
+				self.backup_index.flush()
+				if not self.backup_index.load():
+					self.backup_index.rebuild(*self._scan(".backup"))
+		return list(self.backup_index.names)
+
+	def exists(self, account):
+		staged = self.journal.lookup(account)
+		if staged is not None:
+			return staged is not Journal.REMOVED
+		return os.path.isfile(self._path(account))
+
+	def isdir(self, name):
+		return os.path.isdir(self._path(name))
+
+	def read(self, account):
+		with open(self._current(account), "rb") as f:
+			return f.read()
+
+	def stream(self, account):
+		with open(self._current(account), "rb") as f:
+			yield from f
+
+	def write(self, account, data):
+		self._stage(account)
+		self._touch(account)
+		path = self._path(account)
+		_make_parent_dirs(path)
+		if os.path.isdir(path):
+			raise IsADirectoryError(path)
+		self.journal.put(account, data)
+		self._changed(account)
+
+	def write_many(self, items):
+		# create each parent directory once rather than once per account
+		failed = []
+		made = set()
+		for account, data in items:
+			self._stage(account)
+			self._touch(account)
+			try:
+				path  = self._path(account)
+				dname = os.path.dirname(path)
+				if dname not in made:
+					os.makedirs(dname, exist_ok = True)
+					made.add(dname)
+				if os.path.isdir(path):
+					raise IsADirectoryError(path)
+				self.journal.put(account, data)
+			except OSError as e:
+				failed.append((account, e))
+				continue
+			self._changed(account)
+		return failed
+
+	def remove(self, account):
+		self._stage(account)
+		self._touch(account)
+		self.journal.remove(account)
+		self._changed(account, removed = True)
+
+	def rename(self, account1, account2):
+		self._stage(account1)
+		self._stage(account2)
+		self._touch(account1)
+		self._touch(account2)
+		_make_parent_dirs(self._path(account2))
+		self.journal.rename(account1, account2)
+		self._changed(account1, removed = True)
+		self._changed(account2)
+
+	def flush(self):
+		with span("flush"):
+			if self.index is None:
+				self.journal.commit(self._apply)
+				return
+			with self._caches():
+				self.journal.commit(self._apply)
+				self.index.flush()
+				self.backup_index.flush()
+
+	def refresh(self):
+		if self.index is None:
+			return True # names() scans every time, but the caller may be holding on to what it returned
+		with self.journal.lock:
+			self.flush()
+			if self._stamp() == self._seen:
+				return False
+			self._load_indexes()
+		return True
+
+	def rekeyed(self):
+		# the caches are encrypted; rebuilding them rewrites them in full
+		if self.index is not None:
+			self.flush()
+			with self._caches():
+				self.index.rebuild(*self._scan(".", skip = ".backup"))
+				self.backup_index.rebuild(*self._scan(".backup"))
+
+	def destroy(self):
+		self.flush()
+		for name in self.names() + self.backups():
+			os.remove(self._path(name))
+			_rm_empty(self.root, name)
+		if self.index is not None:
+			self.index.destroy()
+			self.backup_index.destroy()
+		try:
+			os.rmdir(self._path(".backup"))
+		except OSError:
+			pass
+		self.journal.destroy()
+
+	def _path(self, name):
+		return os.path.join(self.root, name)
+
+	def _load_indexes(self):
+		self.index = NameIndex(self.root, self.key, ".", skip = ".backup")
+		if not self.index.load():
+			self.index.rebuild(*self._scan(".", skip = ".backup"))
+		# only loaded when backups() is first called
+		self.backup_index = NameIndex(self.root, self.key, ".backup")
+		self._seen = self._stamp()
+
+	@contextmanager
+	def _caches(self):
+		"""
+		Hold the journal's lock while changing the name caches, and note their state afterwards unless another process had changed them first, so that refresh() still picks that up.
+		"""
+		with self.journal.lock:
+			fresh = self._stamp() == self._seen
+			yield
+			if fresh:
+				self._seen = self._stamp()
+
+	def _stamp(self):
+		"""
+		Return what identifies the current state of the name caches on disk.
+		"""
+		stamp = []
+		for index in (self.index, self.backup_index):
+			try:
+				st = os.stat(index.path)
+				stamp.append((st.st_ino, st.st_size, st.st_mtime_ns))
+			except FileNotFoundError:
+				stamp.append(None)
+		return stamp
+
+	def _current(self, account):
+		"""
+		Return the file holding the latest contents of an account, staged or not.
+		"""
+		staged = self.journal.lookup(account)
+		if staged is Journal.REMOVED:
+			raise FileNotFoundError(account)
+		return staged or self._path(account)
+
+	def _staged(self, names, backups):
+		"""
+		Apply the journal's pending changes to the result of a scan.
+		"""
+		names = set(names)
+		for name, staged in self.journal.view.items():
+			if name.startswith(".backup" + os.sep) == backups:
+				if staged is Journal.REMOVED:
+					names.discard(name)
+				else:
+					names.add(name)
+		return list(names)
+
+	def _stage(self, name):
+		# each name may only be changed once per journal commit
+		if self.journal.touches(name):
+			self.journal.commit(self._apply)
+
+	def _apply(self, op, name, arg):
+		"""
+		Carry out one journaled change. Changes may be applied again after a crash, so each one checks whether it is already done.
+		"""
+		if op == "put":
+			if os.path.exists(arg):
+				_make_parent_dirs(self._path(name))
+				os.replace(arg, self._path(name))
+		elif op == "rm":
+			try:
+				os.remove(self._path(name))
+			except FileNotFoundError:
+				pass
+			_rm_empty(self.root, name)
+		elif op == "mv":
+			if os.path.exists(self._path(name)) and not os.path.exists(self._path(arg)):
+				_make_parent_dirs(self._path(arg))
+				os.rename(self._path(name), self._path(arg))
+			_rm_empty(self.root, name)
+
+	def _index_for(self, name):
+		if name.startswith(".backup" + os.sep):
+			return self.backup_index
+		return self.index
+
+	def _touch(self, name):
+		if self.index is not None:
+			self._index_for(name).touch(name)
+
+	def _changed(self, name, removed = False):
+		if self.index is not None:
+			self._index_for(name).update(name, removed)
+
+	def _scan(self, top, skip = None):
+		"""
+		Walk a subtree. Return the set of names and the mtime of every directory, each taken before the directory is listed so a concurrent change can only make the result look stale, never fresh.
+		"""
+		names = set()
+		dirs  = {}
+		stack = [top]
+		while stack:
+			dname = stack.pop()
+			path  = self._path(dname)
+			dirs[dname] = os.stat(path).st_mtime_ns
+			with os.scandir(path) as it:
+				for entry in it:
+					name = os.path.normpath(os.path.join(dname, entry.name))
+					if entry.is_dir(follow_symlinks = False):
+						if name != skip and not entry.name.startswith("."):
+							stack.append(name)
+					elif not entry.name.startswith("."):
+						names.add(name)
+		return names, dirs
+
+
+class NameIndex:
+	"""
+	Encrypted on-disk cache of the names in one subtree of a DirectoryStorage, so opening the database doesn't have to walk the tree.
+
+	Every line of the file is an encrypted JSON object. The first is a snapshot of all names; each flush() appends one more line with the names added and removed since, along with the mtimes of the directories they touched, as they were before and after the change. The cache is only trusted if each line starts from the mtimes the previous lines left behind and every recorded directory still has its final mtime, so anything changed behind pypass's back forces a rescan. Because the chain is checked on load, changes can be appended without loading the cache first.
+	"""
+
+	FILENAME   = ".index"
+	VERSION    = 2
+	MAX_DELTAS = 1000
+
+	def __init__(self, root, key, top = ".", skip = None):
+		self.root   = root
+		self.key    = key
+		self.top    = top
+		self.skip   = skip
+		self.path   = os.path.join(root, top, NameIndex.FILENAME)
+		self.loaded = False
+		self.names  = set()
+		self.dirs   = {}
+		self.added   = set()
+		self.removed = set()
+		self.before  = {}
+
+	def load(self):
+		"""
+		Read the cache. Return False if it is missing, unreadable or stale.
+		"""
+		try:
+			with open(self.path) as f:
+				lines = f.read().splitlines()
+			snapshot = json.loads(self.key.decrypt(lines[0]))
+			if snapshot.get("version") != NameIndex.VERSION:
+				return False
+			names = set(snapshot["names"])
+			dirs  = snapshot["dirs"]
+			for line in lines[1:]:
+				delta = json.loads(self.key.decrypt(line))
+				if any(dirs.get(dname) != mtime for dname, mtime in delta["before"].items()):
+					return False
+				names.difference_update(delta["rm"])
+				names.update(delta["add"])
+				dirs.update(delta["dirs"])
+				for dname in delta["gone"]:
+					dirs.pop(dname, None)
+		except FileNotFoundError:
+			return False
+		except Exception as e:
+			# an unreadable cache only costs a rescan
+			logging.getLogger().warning(f"Ignoring unreadable {self.path}: {e!r}")
+			return False
+		if any(self._mtime(dname) != mtime for dname, mtime in dirs.items()):
+			return False
+		self.names  = names
+		self.dirs   = dirs
+		self.loaded = True
+		if len(lines) > NameIndex.MAX_DELTAS:
+			self._save()
+		return True
+
+	def rebuild(self, names, dirs):
+		"""
+		Replace the cache with the result of a full scan.
+		"""
+		self.names  = set(names)
+		self.dirs   = dict(dirs)
+		self.loaded = True
+		self._save()
+
+	def touch(self, name):
+		"""
+		Note the mtimes of the directories that creating, removing or renaming name is about to change.
+		"""
+		for dname in self._ancestors(name):
+			if dname not in self.before:
+				self.before[dname] = self._mtime(dname)
+
+	def update(self, name, removed = False):
+		"""
+		Record that name was created or removed.
+		"""
+		if removed:
+			self.names.discard(name)
+			self.added.discard(name)
+			self.removed.add(name)
+		else:
+			self.names.add(name)
+			self.removed.discard(name)
+			self.added.add(name)
+
+	def flush(self):
+		"""
+		Append the pending changes.
+		"""
+		if not self.before:
+			return
+		dirs = {}
+		gone = []
+		for dname in self.before:
+			mtime = self._mtime(dname)
+			if mtime is None:
+				gone.append(dname)
+			else:
+				dirs[dname] = mtime
+		delta = {"add": sorted(self.added), "rm": sorted(self.removed), "before": self.before, "dirs": dirs, "gone": gone}
+		with open(self.path, "a") as f:
+			f.write(self.key.encrypt(json.dumps(delta)) + "\n")
+		self.dirs.update(dirs)
+		for dname in gone:
+			self.dirs.pop(dname, None)
+		self.added   = set()
+		self.removed = set()
+		self.before  = {}
+
+	def destroy(self):
+		try:
+			os.remove(self.path)
+		except FileNotFoundError:
+			pass
+
+	def _save(self):
+		snapshot = {"version": NameIndex.VERSION, "names": sorted(self.names), "dirs": self.dirs}
+		tmp = self.path + ".tmp"
+		with open(tmp, "w") as f:
+			f.write(self.key.encrypt(json.dumps(snapshot)) + "\n")
+		os.replace(tmp, self.path)
+		# replacing the file changed the mtime of the top directory itself
+		self.added   = set()
+		self.removed = set()
+		self.before  = {self.top: self.dirs.get(self.top)}
+		self.flush()
+
+	def _ancestors(self, name):
+		dname = os.path.dirname(name)
+		while dname and dname != self.top:
+			yield dname
+			dname = os.path.dirname(dname)
+		yield self.top
+
+	def _mtime(self, dname):
+		try:
+			return os.stat(os.path.join(self.root, dname)).st_mtime_ns
+		except FileNotFoundError:
+			return None
+
+
+class PackedStorage(Storage):
+	"""
+	All accounts in a single append-only vault file:
+
+		MAGIC | record | record | ... | table | footer
+
+	write() keeps the new record in memory, and flush() appends the records written since, then a fresh table of (offset, length, name) entries followed by a fixed-size footer that points to it. Opening the vault reads the footer and the table; reading an account is a single seek and read. Copies, which the backup store makes of every version it keeps, are extra table entries pointing at the same record, so they cost no space. Superseded records and tables stay behind as dead space, and flush() compacts the vault once that is more than half of it.
+
+	Other processes may change the vault too, e.g. an agent and a one-shot command. flush() and compact() hold an exclusive lock on LOCKNAME, and flush() first reads the table another process may have written since, so that the table it writes has their changes as well as its own. Nothing but flush() and compact() writes to the vault, so records written but not flushed can't be lost to another process compacting it; reads notice when it has been replaced and read its table again.
+	"""
+
+	kind     = "packed"
+	FILENAME = ".vault"
+	LOCKNAME = ".vault.lock"
+	MAGIC    = b"PYPASS\x00\x01"
+	TAIL     = b"PPTABLE1"
+	FOOTER   = struct.Struct("<QQ8s") # table offset, table length, TAIL
+	ENTRY    = struct.Struct("<QIH")  # record offset, record length, name length
+	SLACK    = 1 << 16 # dead bytes left alone however small the vault
+	PENDING  = 1 << 22 # bytes of unflushed records above which write() flushes
+
+	def __init__(self, root = ".", key = None, filename = None):
+		self.logger = logging.getLogger()
+		self.root = os.path.abspath(root)
+		self.path = os.path.join(self.root, filename or PackedStorage.FILENAME)
+		self.lock = FileLock(os.path.join(self.root, PackedStorage.LOCKNAME))
+		self.table   = {} # name: (offset, length), as of the last table read or written
+		self.changes = {} # name: data, (offset, length, name it was copied from) or None if removed, since then
+		self.pending = 0 # bytes of data in changes
+		self.ino  = None # of the vault the table belongs to
+		self.size = 0 # up to the last footer
+		self.live = 0 # bytes a compacted vault would take
+		with self.lock:
+			if os.path.isfile(self.path):
+				with open(self.path, "rb") as f:
+					self._load(f)
+			else:
+				with open(self.path, "wb") as f:
+					f.write(PackedStorage.MAGIC)
+					self.size = self._write_table(f, self.table)
+					self.ino  = os.fstat(f.fileno()).st_ino
+				self.live = self.size
+
+	def names(self):
+		return [name for name in self._names() if not name.startswith(".")]
+
+	def backups(self):
+		return [name for name in self._names() if name.startswith(".")]
+
+	def refresh(self):
+		st = os.stat(self.path)
+		if (st.st_ino, st.st_size) == (self.ino, self.size):
+			return False
+		with self.lock, open(self.path, "rb") as f:
+			self._load(f)
+		return True
+
+	def exists(self, account):
+		return self._find(account) is not None
+
+	def isdir(self, name):
+		prefix = name.rstrip(os.sep) + os.sep
+		return any(n.startswith(prefix) for n in self._names() if not n.startswith("."))
+
+	def read(self, account):
+		found = self._find(account)
+		if found is None:
+			raise FileNotFoundError(account)
+		if not isinstance(found, tuple):
+			return found
+		with open(self.path, "rb") as f:
+			if os.fstat(f.fileno()).st_ino != self.ino:
+				# compacted by another process, so the records have moved
+				with self.lock:
+					self._load(f)
+				return self.read(account)
+			f.seek(found[0])
+			return f.read(found[1])
+
+	def write(self, account, data):
+		self.changes[account] = data
+		self.pending += len(data)
+		if self.pending > PackedStorage.PENDING:
+			self.flush()
+
+	def remove(self, account):
+		if self._find(account) is None:
+			raise KeyError(account)
+		self.changes[account] = None
+
+	def rename(self, account1, account2):
+		self.changes[account2] = self._copy_of(account1)
+		self.changes[account1] = None
+
+	def copy_many(self, pairs):
+		# copies share the record
+		for account, name in pairs:
+			self.changes[name] = self._copy_of(account)
+		return []
+
+	def flush(self):
+		if not self.changes:
+			return
+		with span("flush"), self.lock:
+			with open(self.path, "r+b") as f:
+				st = os.fstat(f.fileno())
+				if (st.st_ino, st.st_size) != (self.ino, self.size):
+					self._load(f) # changed by another process
+				f.seek(0, os.SEEK_END)
+				written = {} # id(data): where it was written, so copies share it
+				for name, found in self.changes.items():
+					if found is None:
+						self.table.pop(name, None)
+					elif isinstance(found, tuple):
+						self.table[name] = found[:2]
+					else:
+						if id(found) not in written:
+							written[id(found)] = (f.tell(), len(found))
+							f.write(found)
+						self.table[name] = written[id(found)]
+				start = f.tell()
+				self.size = self._write_table(f, self.table)
+			self.changes = {}
+			self.pending = 0
+			self.live = self._records() + self.size - start
+			dead = self.size - self.live
+			if dead > self.live and dead > PackedStorage.SLACK:
+				with span("compact"):
+					self._compact()
+
+	def compact(self):
+		"""
+		Rewrite the vault without dead space. Backups that share a record keep sharing it. The new vault replaces the old one only once it is complete.
+		"""
+		with self.lock:
+			self.flush()
+			self._compact()
+
+	def _compact(self):
+		tmp = self.path + ".tmp"
+		table = {}
+		copied = {}
+		with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+			st = os.fstat(src.fileno())
+			if (st.st_ino, st.st_size) != (self.ino, self.size):
+				self._load(src)
+			dst.write(PackedStorage.MAGIC)
+			for name, loc in self.table.items():
+				if loc not in copied:
+					src.seek(loc[0])
+					copied[loc] = (dst.tell(), loc[1])
+					dst.write(src.read(loc[1]))
+				table[name] = copied[loc]
+			self.size = self._write_table(dst, table)
+			ino = os.fstat(dst.fileno()).st_ino
+		os.replace(tmp, self.path)
+		self.table = table
+		self.ino   = ino
+		self.live  = self.size
+
+	def _write_table(self, f, table):
+		"""
+		Append a table of the given entries and its footer to the vault open as f, and wait until they are on disk. Return the size of the vault.
+		"""
+		data = [struct.pack("<I", len(table))]
+		for name, (offset, length) in table.items():
+			name = name.encode()
+			data.append(PackedStorage.ENTRY.pack(offset, length, len(name)))
+			data.append(name)
+		data = b"".join(data)
+		offset = f.tell()
+		f.write(data)
+		f.write(PackedStorage.FOOTER.pack(offset, len(data), PackedStorage.TAIL))
+		f.flush()
+		os.fsync(f.fileno())
+		return f.tell()
+
+	def _records(self):
+		"""
+		Return the bytes taken by the magic number and the records still in the table, counting shared records once.
+		"""
+		return len(PackedStorage.MAGIC) + sum(length for offset, length in set(self.table.values()))
+
+	def _find(self, name):
+		"""
+		Return the unflushed contents of name, where its record is, or None if there is no such name.
+		"""
+		if name in self.changes:
+			return self.changes[name]
+		return self.table.get(name)
+
+	def _copy_of(self, account):
+		"""
+		Return what a copy of account holds until the next flush(): its unflushed contents, or its record, along with the name to find it by should the vault be compacted in the meantime.
+		"""
+		found = self._find(account)
+		if found is None:
+			raise KeyError(account)
+		if isinstance(found, tuple) and len(found) == 2:
+			return found + (account,)
+		return found
+
+	def _names(self):
+		if not self.changes:
+			return self.table.keys()
+		names = set(self.table)
+		for name, found in self.changes.items():
+			if found is None:
+				names.discard(name)
+			else:
+				names.add(name)
+		return names
+
+	def destroy(self):
+		with self.lock:
+			os.remove(self.path)
+		try:
+			os.remove(self.lock.path)
+		except OSError:
+			pass
+		self.table   = {}
+		self.changes = {}
+
+	def _load(self, f):
+		"""
+		Read the table of the vault open as f. If it is not the vault the table was read from before, unflushed copies of records are pointed at where those records are now.
+		"""
+		f.seek(0)
+		if f.read(len(PackedStorage.MAGIC)) != PackedStorage.MAGIC:
+			raise ValueError(f"Error: {self.path} is not a pypass vault.")
+		table_offset, table_len = self._find_footer(f)
+		f.seek(table_offset)
+		data = f.read(table_len)
+		count, = struct.unpack_from("<I", data)
+		pos = 4
+		table = {}
+		for i in range(count):
+			offset, length, name_len = PackedStorage.ENTRY.unpack_from(data, pos)
+			pos += PackedStorage.ENTRY.size
+			name = data[pos:pos+name_len].decode()
+			pos += name_len
+			table[name] = (offset, length)
+		ino = os.fstat(f.fileno()).st_ino
+		if self.ino is not None and ino != self.ino:
+			for name, found in list(self.changes.items()):
+				if isinstance(found, tuple):
+					if found[2] in table:
+						self.changes[name] = table[found[2]] + found[2:]
+					else:
+						self.logger.warning(f"Could not copy {found[2]} to {name}: another process removed it.")
+						del self.changes[name]
+		self.table = table
+		self.ino   = ino
+		self.size  = table_offset + table_len + PackedStorage.FOOTER.size
+		self.live  = self._records() + table_len + PackedStorage.FOOTER.size
+
+	def _find_footer(self, f):
+		"""
+		Locate the last complete footer. Normally this is the end of the file, but if the process died between write() and flush(), search backwards past the unreferenced records.
+		"""
+		size = f.seek(0, os.SEEK_END)
+		end  = size
+		while end >= len(PackedStorage.MAGIC) + PackedStorage.FOOTER.size:
+			f.seek(end - PackedStorage.FOOTER.size)
+			table_offset, table_len, tail = PackedStorage.FOOTER.unpack(f.read(PackedStorage.FOOTER.size))
+			if tail == PackedStorage.TAIL and table_offset + table_len + PackedStorage.FOOTER.size == end:
+				if end != size:
+					self.logger.warning(f"Ignoring {size - end} unflushed bytes at the end of {self.path}.")
+				return table_offset, table_len
+			# back up to the previous occurrence of the footer tag
+			f.seek(0)
+			end = f.read(end - 1).rfind(PackedStorage.TAIL)
+			if end < 0:
+				break
+			end += len(PackedStorage.TAIL)
+		raise ValueError(f"Error: {self.path} is corrupt.")
+
+
+STORAGE = {
+	DirectoryStorage.kind : DirectoryStorage,
+	PackedStorage.kind    : PackedStorage,
+}
+
+def open_storage(root = ".", key = None):
+	"""
+	Open whichever backend already holds data in root, defaulting to one file per account.
+	"""
+	if os.path.isfile(os.path.join(root, PackedStorage.FILENAME)):
+		return PackedStorage(root, key)
+	return DirectoryStorage(root, key)
+
+def migrate(src, kind, key = None):
+	"""
+	Copy every account and backup from src into a new backend of the given kind, then delete src. Return the new backend.
+	"""
+	if kind == src.kind:
+		if kind == PackedStorage.kind:
+			src.compact()
+		return src
+	if kind == PackedStorage.kind:
+		# build under a temporary name so a crash never leaves a partial vault in charge
+		tmp = PackedStorage.FILENAME + ".tmp"
+		try:
+			os.remove(os.path.join(src.root, tmp))
+		except FileNotFoundError:
+			pass
+		dst = PackedStorage(src.root, key, tmp)
+	else:
+		dst = STORAGE[kind](src.root, key)
+	for name in src.names() + src.backups():
+		dst.write(name, src.read(name))
+	dst.flush()
+	if kind == PackedStorage.kind:
+		path = os.path.join(src.root, PackedStorage.FILENAME)
+		os.replace(dst.path, path)
+		dst.path = path
+	src.destroy()
+	return dst
+
+def _rm_empty(root, name):
+	"""
+	remove potentially empty dirs
+	"""
+	try:
+		dname = os.path.dirname(name)
+		while dname != '':
+			os.rmdir(os.path.join(root, dname))
+			dname = os.path.dirname(dname)
+	except OSError:
+		pass # dir not empty
+
+def _make_parent_dirs(path):
+	"""
+	Make all parent directories if they do not exist.
+	"""
+	dname = os.path.dirname(path)
+	try:
+		os.makedirs(dname)
+	except (FileNotFoundError, FileExistsError):
+		pass
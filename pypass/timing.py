@@ -0,0 +1,139 @@
+"""
+Timing spans, to find out where the time of a command goes.
+
+Code marks the steps worth timing with 'with span(name):'. Until enable() is called, span() returns a shared context manager that does nothing, so the marked code pays for one call and no more. Once enabled, every span is recorded with its thread. report() then breaks the time recorded since the last report down by span name, and write_trace() saves everything as Chrome trace events, which chrome://tracing and https://ui.perfetto.dev can show as a timeline.
+
+pypass enables this with the --profile and --trace FILE options, or the PYPASS_PROFILE and PYPASS_TRACE environment variables.
+"""
+
+import os
+import json
+import time
+import threading
+
+_recorder = None
+
+
+class _Null:
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+_NULL = _Null()
+
+
+class _Span:
+
+	__slots__ = ("name", "args", "start")
+
+	def __init__(self, name, args):
+		self.name = name
+		self.args = args
+
+	def __enter__(self):
+		self.start = time.perf_counter_ns()
+		return self
+
+	def __exit__(self, *exc):
+		recorder = _recorder
+		if recorder is not None:
+			recorder.events.append((self.name, self.start, time.perf_counter_ns(), threading.get_ident(), self.args))
+		return False
+
+
+class _Recorder:
+
+	def __init__(self):
+		self.events = [] # (name, start ns, end ns, thread, args)
+		self.origin = time.perf_counter_ns()
+		self.reported = 0 # events already in a report
+		self.since    = self.origin
+
+
+def span(name, **args):
+	"""
+	Return a context manager that records how long its block takes under name, with args for the trace, when timing is enabled.
+	"""
+	if _recorder is None:
+		return _NULL
+	return _Span(name, args)
+
+def enable():
+	global _recorder
+	if _recorder is None:
+		_recorder = _Recorder()
+
+def disable():
+	global _recorder
+	_recorder = None
+
+def enabled():
+	return _recorder is not None
+
+def requested(args):
+	"""
+	Return whether command line args or the environment ask for timing, and the trace file to write, if any.
+	"""
+	trace = os.environ.get("PYPASS_TRACE") or None
+	for i, arg in enumerate(args):
+		if arg == "--trace" and i + 1 < len(args):
+			trace = args[i + 1]
+		elif arg.startswith("--trace="):
+			trace = arg[len("--trace="):]
+	profile = "--profile" in args or os.environ.get("PYPASS_PROFILE", "0") not in ("", "0")
+	return profile or trace is not None, trace
+
+def report(title):
+	"""
+	Return lines breaking down the time since the last report by span name: the time spent in each kind of span in all, the time not spent in spans nested in them, and how many there were, most expensive first.
+	"""
+	recorder = _recorder
+	if recorder is None:
+		return []
+	now    = time.perf_counter_ns()
+	events = recorder.events[recorder.reported:]
+	recorder.reported += len(events)
+	wall   = now - recorder.since
+	recorder.since = now
+
+	totals = {} # name: [total, self, count]
+	stacks = {} # thread: [(end, name)] of the enclosing spans
+	for name, start, end, thread, args in sorted(events, key = lambda e: (e[3], e[1], -e[2])):
+		stack = stacks.setdefault(thread, [])
+		while stack and stack[-1][0] <= start:
+			stack.pop()
+		if stack:
+			totals[stack[-1][1]][1] -= end - start
+		entry = totals.setdefault(name, [0, 0, 0])
+		entry[0] += end - start
+		entry[1] += end - start
+		entry[2] += 1
+		stack.append((end, name))
+
+	lines = [f"Profile of {title}: {wall / 1e6:.1f} ms", f"{'total ms':>10} {'self ms':>10} {'calls':>6}  span"]
+	for name, (total, own, count) in sorted(totals.items(), key = lambda item: -item[1][0]):
+		lines.append(f"{total / 1e6:>10.2f} {own / 1e6:>10.2f} {count:>6}  {name}")
+	return lines
+
+def write_trace(path):
+	"""
+	Save every span recorded so far to path in the Chrome trace event format.
+	"""
+	recorder = _recorder
+	if recorder is None:
+		return
+	pid = os.getpid()
+	events = [{
+		"name": name,
+		"ph":   "X",
+		"ts":   (start - recorder.origin) / 1000,
+		"dur":  (end - start) / 1000,
+		"pid":  pid,
+		"tid":  thread,
+		"args": {k: str(v) for k, v in args.items()},
+	} for name, start, end, thread, args in list(recorder.events)]
+	with open(path, "w") as f:
+		json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
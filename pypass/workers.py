@@ -0,0 +1,51 @@
+import os
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .crypto import DataKey
+
+
+_key = None
+
+def _init(keys, suite):
+	global _key
+	_key = DataKey(keys, suite)
+
+def _call(func, chunk):
+	return func(_key, chunk)
+
+
+def chunks(iterable, size):
+	"""
+	Yield lists of up to size consecutive items.
+	"""
+	it = iter(iterable)
+	while True:
+		chunk = list(itertools.islice(it, size))
+		if not chunk:
+			return
+		yield chunk
+
+def map_with_key(func, chunks, key, workers = None):
+	"""
+	Yield func(key, chunk) for each chunk, in order, computed across a pool of worker processes that each hold a copy of the data key. At most two chunks per worker are in flight, so memory stays bounded however long the input is. func must be a module-level function. With one worker, or if there is only one chunk, everything runs in this process without starting a pool.
+	"""
+	workers = workers or os.cpu_count() or 1
+	chunks  = iter(chunks)
+	first   = next(chunks, None)
+	if first is None:
+		return
+	second = next(chunks, None)
+	if workers == 1 or second is None:
+		for chunk in itertools.chain([first], [second] if second is not None else [], chunks):
+			yield func(key, chunk)
+		return
+	with ProcessPoolExecutor(workers, initializer = _init, initargs = (key.keys(), key.suite)) as pool:
+		pending = deque()
+		for chunk in itertools.chain([first, second], chunks):
+			pending.append(pool.submit(_call, func, chunk))
+			if len(pending) >= 2 * workers:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
@@ -6,6 +6,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 from pypass.parser import Parser
 
 p = Parser(None)
+p.build_all()
 
 text = \
 f'''# pypass
@@ -13,6 +14,8 @@ Command-line password manager, written entirely in Python.
 
 ## Useage
 
+Run `python -m pypass` (or `pypass`, once installed) for an interactive session, or give a command to run just that one, e.g. `pypass copy gmail`. The database is kept in the package's `db` folder, unless `PYPASS_DB` names another one.
+
 ```
 {p.parser.format_help()}
 ```
@@ -33,7 +36,7 @@ List accounts.
 
 ### `load` Command
 
-Load accounts from a file or the console. Use Ctrl-Z + Enter to finish console input.
+Load accounts from a file or the console. Use Ctrl-Z + Enter to finish console input. The file is read as a stream and encrypted in batches across several processes, so very large exports load quickly; progress is reported as it goes.
 ```
 {p.parser_load.format_help()}
 ```
@@ -80,6 +83,62 @@ Delete an account.
 {p.parser_rm.format_help()}
 ```
 
+### `history` Command
+
+List the saved versions of an account, newest first, marking the one it holds now. `-p` shows the password of each version. The account may have been deleted or renamed since; use its old name. Looking up one account's history reads only its own manifest.
+```
+{p.parser_history.format_help()}
+```
+
+### `restore` Command
+
+Bring back an earlier version of an account, which also works for accounts that have since been deleted or renamed. `--at` picks the version that was current at a given time, as a date and time or as a time ago such as `3d`; by default it is the latest version that differs from what the account holds now, or its last version if it has been deleted. The replaced contents stay in the history, so a restore can itself be undone.
+```
+{p.parser_restore.format_help()}
+```
+
+### `migrate` Command
+
+Convert the database between storage formats. `dir` keeps one file per account; `packed` keeps every account and backup in a single indexed vault file, which is much faster to open for large databases. Migrating to `packed` when the database is already packed compacts the vault.
+```
+{p.parser_migrate.format_help()}
+```
+
+### `upgrade` Command
+
+Rewrite accounts stored in the older one-token-per-line format into the current format, which encrypts each account as a single record. Old accounts are still read transparently, so this is optional; it makes files smaller and faster to read. Backups are left alone unless `-b` is given. With `-c`, accounts are written with the given cipher suite from then on, and existing ones are rewritten with it. `aes-256-gcm` and `chacha20-poly1305` are authenticated ciphers that are faster than the default, `fernet`, and make smaller files. They also tie each file to its name, so files swapped for one another fail to decrypt. Each file records its suite, so a database can mix them.
+```
+{p.parser_upgrade.format_help()}
+```
+
+### `gc` Command
+
+Every time an account is written, its contents are saved as a new version in the backup store under `.backup`. Identical contents are stored only once, whichever accounts they belong to, and each account's versions are listed in a small encrypted manifest of its own, so renamed and deleted accounts keep their history. `gc` drops the versions outside a retention policy: the last `-l` versions, plus the last version of each of the last `-d` days and `-m` months. The newest version of every account is always kept. It then deletes the stored contents no version needs any more and reports the space reclaimed. Without options it only does the second part. Backups made by older versions of pypass, one full copy each, are moved into the store the first time the database is opened.
+```
+{p.parser_gc.format_help()}
+```
+
+### `calibrate` Command
+
+Benchmark key derivation on this machine and choose the strongest parameters that unlock in about the target time. They are saved in the key file header and take effect the next time the master password is entered, when the key is transparently re-wrapped.
+```
+{p.parser_calibrate.format_help()}
+```
+
+### `rekey` Command
+
+Generate a new data key, the key that actually encrypts the accounts, and re-encrypt every account with it, and with `-b` every backup too. The work is spread across processes, and the throughput is reported as it goes. Progress is checkpointed, so an interrupted rekey carries on where it stopped when run again. The old key stays in the key file until everything has been re-encrypted, and removing it is the last step. Without `-b` it is kept for reading the backups only. Unlike `master`, which only re-wraps the data key under a new master password, this makes a leaked data key useless for everything written from then on. Stop the agent first.
+```
+{p.parser_rekey.format_help()}
+```
+
+### `export` Command
+
+Write decrypted accounts, optionally only those matching a filter, to a file or the console. The default format is the one read by `load`, so an export can be loaded into another database; `-f jsonl` writes one JSON object per account instead. Accounts are decrypted in parallel and written in sorted order. Output files are created readable only by you, but they hold every password in plain text: keep them safe.
+```
+{p.parser_export.format_help()}
+```
+
 ### `help` Command
 
 Print help.
@@ -87,6 +146,12 @@ Print help.
 {p.parser_help.format_help()}
 ```
 
+## Agent
+
+`python -m pypass agent` logs in once and then keeps the unlocked database in memory, listening on a Unix socket that only you can use. While it runs, one-shot `ls`, `copy`, `print` and `add` commands are sent to the agent instead of unlocking the database again, so lookups take milliseconds. The agent locks the key after 15 idle minutes (or `PYPASS_TIMEOUT` seconds), and the next command asks for the master password. The socket is created in `$XDG_RUNTIME_DIR` or the temporary directory, unless `PYPASS_SOCKET` names another path. Stop the agent with Ctrl-C. An interactive session serves these commands too, unless an agent is already running.
+
+Passwords copied to the clipboard, by the agent or in interactive mode, are cleared in the background, so you can keep working in the meantime.
+
 '''
 
 text = [line + "\n" for line in text.split("\n")]
@@ -15,5 +15,6 @@ setup(
     author_email = "joetache4@gmail.com",
     url = "https://github.com/joetache4/pypass",
     license = license,
-    packages = find_packages(exclude = ("tests", "docs"))
+    packages = find_packages(exclude = ("tests", "docs")),
+    entry_points = {"console_scripts": ["pypass = pypass.__main__:main"]}
 )
\ No newline at end of file
@@ -0,0 +1,177 @@
+import os
+import socket
+import asyncio
+import threading
+import pytest
+
+from pypass import clipboard, __main__
+from pypass.log import configure_logging, stop_logging
+from pypass.agent import Agent
+from pypass.client import Client, peer_uid
+from pypass.database import Database
+from pypass.parser import Parser
+
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason = "needs Unix domain sockets")
+
+@pytest.fixture(scope = "function")
+def agent():
+	os.mkdir("db") # apart from the socket
+	db = Database("db", "password")
+	db.add_block("gmail", ["pw1", "note"])
+	db.add_block("bank", ["pw2"])
+	agent = Agent(db, os.path.abspath("sock/agent.sock"))
+	thread = threading.Thread(target = agent.serve)
+	thread.start()
+	while not Client.running(agent.path):
+		pass
+	yield agent
+	agent.shutdown()
+	thread.join()
+
+@pytest.mark.usefixtures("cleandir")
+class TestAgent:
+
+	def test_requests(self, agent):
+		client = Client(agent.path)
+		assert client.accounts() == ["bank", "gmail"]
+		assert client.select("gml") == "gmail"
+		assert client.password("gmail") == "pw1"
+		assert client.content("gmail") == ["pw1", "note"]
+		assert client.exists("bank") and not client.exists("x")
+		client.add_block("x", ["pw3"])
+		assert agent.db.password("x") == "pw3"
+		with pytest.raises(ValueError):
+			client.add_block("x", ["pw4"])
+		with pytest.raises(ValueError):
+			client.select("zzz")
+		client.close()
+		assert os.stat(agent.path).st_mode & 0o077 == 0
+
+	def test_parser(self, capsys, helpers, agent):
+		client = Client(agent.path)
+		parser = Parser(client)
+		parser.parse("print gmail")
+		assert "pw1\nnote" in capsys.readouterr().out
+		with helpers.replace_stdin(["0"]):
+			parser.parse("copy --no-clip")
+		assert capsys.readouterr().out.endswith("0. gmail\n1. bank\nselect> pw1\n") # ranked by use
+		with helpers.replace_stdin(["abc"]):
+			parser.parse("add new --no-clip")
+		assert agent.db.password("new") == "abc"
+		client.close()
+
+	def test_locked(self, helpers, agent):
+		client = Client(agent.path)
+		agent.db.key.lock()
+		with helpers.replace_stdin(["wrong"]):
+			with pytest.raises(ValueError):
+				client.password("bank")
+		with helpers.replace_stdin(["password"]):
+			assert client.password("bank") == "pw2"
+		assert not agent.db.key.locked()
+		client.close()
+
+	def test_clip(self, monkeypatch, agent):
+		board = {"text": "old"}
+		monkeypatch.setattr(clipboard.pyperclip, "paste", lambda: board["text"])
+		monkeypatch.setattr(clipboard.pyperclip, "copy", lambda text: board.update(text = text))
+		client1 = Client(agent.path)
+		client2 = Client(agent.path)
+		Parser(client1, client1).parse("copy gmail")
+		assert board["text"] == "pw1"
+		# served while the first restore is still waiting
+		assert client2.password("bank") == "pw2"
+		client2.copy("pw2", 60)
+		assert board["text"] == "pw2" and agent.clipboard.pending()
+		agent.clipboard.restore()
+		assert board["text"] == "old"
+		client1.close()
+		client2.close()
+
+	def test_running(self, agent):
+		assert Client.running(agent.path)
+		with pytest.raises(ValueError):
+			Agent(agent.db, agent.path).serve()
+		assert not Client.running(os.path.abspath("sock/none.sock"))
+
+	def test_private(self, agent):
+		client = Client(agent.path)
+		assert peer_uid(client.sock) in (None, os.getuid())
+		client.close()
+		# e.g. created by another user beforehand
+		os.makedirs("shared")
+		os.chmod("shared", 0o777)
+		with pytest.raises(ValueError):
+			Client(os.path.abspath("shared/agent.sock"))
+		with pytest.raises(ValueError):
+			Agent(agent.db, os.path.abspath("shared/agent.sock")).serve()
+		assert not os.path.exists("shared/agent.sock")
+		os.symlink(os.path.abspath("sock"), "link")
+		with pytest.raises(ValueError):
+			Client(os.path.abspath("link/agent.sock"))
+
+	@pytest.mark.parametrize("kind", ["dir", "packed"])
+	def test_shared(self, agent, kind):
+		agent.db.migrate(kind)
+		client = Client(agent.path)
+		assert client.accounts() == ["bank", "gmail"]
+		# another process changes the database behind the agent's back
+		other = Database("db", "password")
+		other.mv("gmail", "gmail2")
+		other.add_block("new", ["pw3"])
+		assert client.accounts() == ["bank", "gmail2", "new"]
+		assert client.password("gmail2") == "pw1"
+		with pytest.raises(ValueError):
+			client.add_block("new", ["overwritten"])
+		assert Database("db", "password").content("new") == ["pw3"]
+		client.add_block("gmail", ["pw4"])
+		assert other.history("gmail") # its backups are still there
+		client.close()
+
+	def test_audit(self, agent):
+		configure_logging("x.log", audit = "x.audit")
+		try:
+			client = Client(agent.path)
+			client.password("bank")
+			client.request("login", master = "hunter2")
+			with pytest.raises(ValueError):
+				client.select("zzz")
+			client.close()
+		finally:
+			stop_logging()
+		with open("x.audit") as f:
+			text = f.read()
+		assert '"command": "agent password", "args": {"account": "bank"}' in text
+		assert '"command": "agent login", "args": {}' in text
+		assert '"args": {"filter": "zzz"}, "ms"' in text and '"outcome": "error"' in text
+		assert "pw2" not in text and "hunter2" not in text
+
+	def test_one_shot(self, monkeypatch, capsys, helpers, agent):
+		monkeypatch.setenv("PYPASS_DB", os.path.abspath("db"))
+		monkeypatch.setenv("PYPASS_SOCKET", agent.path)
+		try:
+			for command in ["mv gmail gmail2", "rm -y gmail", "edit gmail", "rekey", "--batch -"]:
+				assert __main__.one_shot(command.split()) == 1
+				assert capsys.readouterr().out.startswith("Error: Stop the agent")
+			assert agent.db.storage.exists("gmail") and not os.path.exists(os.path.join("db", "gmail2"))
+			# served by the agent, or only reading
+			with helpers.replace_stdin(["pw3"]):
+				assert __main__.one_shot("add new --no-clip".split()) == 0
+			with helpers.replace_stdin(["password"]):
+				assert __main__.one_shot("history new".split()) == 0
+			assert __main__.one_shot("print new".split()) == 0
+			assert capsys.readouterr().out.endswith("pw3\n")
+		finally:
+			stop_logging()
+
+	def test_interactive(self, monkeypatch, capsys, helpers):
+		monkeypatch.setenv("PYPASS_SOCKET", os.path.abspath("sock/agent.sock"))
+		db = Database(".", "password")
+		with helpers.replace_stdin(["", ""]):
+			asyncio.run(__main__.interactive(db))
+		assert "Serving" not in capsys.readouterr().out
+		assert not os.path.exists("sock") # only when asked to
+		with helpers.replace_stdin(["", ""]):
+			asyncio.run(__main__.interactive(db, serve = True))
+		assert f"Serving agent clients on {os.path.abspath('sock/agent.sock')}." in capsys.readouterr().out
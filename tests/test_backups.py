@@ -0,0 +1,87 @@
+import os
+import time
+import pytest
+
+from pypass.backups import BackupStore, retained
+from pypass.database import Database
+from pypass.storage import DirectoryStorage, PackedStorage
+
+
+@pytest.fixture(scope = "function", params = [DirectoryStorage, PackedStorage])
+def db(request):
+	db = Database(".", "password")
+	if request.param is PackedStorage:
+		db.migrate("packed")
+	return db
+
+@pytest.mark.usefixtures("cleandir")
+class TestBackups:
+
+	def test_dedup(self, db):
+		db.add_block("a", ["abc", "note"])
+		db.add_block("a", ["xyz"])
+		db.add_block("a", ["abc", "note"]) # within the same second
+		db.add_block("b", ["abc", "note"])
+		versions = db.backups.versions("a")
+		assert len(versions) == 3
+		assert versions[0][1] == versions[2][1] == db.backups.versions("b")[0][1]
+		assert len(db.backups.objects()) == 2
+		assert db.backups.read(versions[1][1]) != db.backups.read(versions[0][1])
+		# names don't show on disk
+		assert not any(name.startswith(os.path.join(".backup", "a")) for name in db.storage.backups())
+
+	def test_rm_mv(self, db):
+		db.add_block("a", ["abc"])
+		db.mv("a", "b")
+		db.add_block("b", ["xyz"])
+		assert len(db.backups.versions("a")) == 1
+		assert len(db.backups.versions("b")) == 2
+		db.rm("b")
+		db = Database(".", "password")
+		assert len(db.backups.versions("a")) == 1
+		assert len(db.backups.versions("b")) == 2
+
+	def test_gc(self, db):
+		for i in range(5):
+			db.add_block("a", [f"pw{i}"])
+		db.add_block("b", ["pw"])
+		assert db.gc() == (0, 0, 0)
+		dropped, deleted, size = db.gc(last = 2)
+		assert (dropped, deleted) == (3, 3)
+		assert size > 0
+		assert len(db.backups.objects()) == 3
+		db = Database(".", "password")
+		assert [db.backups.read(digest) for t, digest in db.backups.versions("a")]
+		assert len(db.backups.versions("a")) == 2
+		assert len(db.backups.versions("b")) == 1
+
+	def test_retained(self):
+		day = 24 * 60 * 60
+		start = time.mktime((2024, 1, 1, 12, 0, 0, 0, 0, -1))
+		# two versions a day for 90 days
+		times = [start + i * day / 2 for i in range(180)]
+		assert retained(times) == {179}
+		assert retained(times, last = 3) == {177, 178, 179}
+		assert retained(times, daily = 3) == {176, 178, 179} # 179 is the only one on its day
+		monthly = retained(times, monthly = 2)
+		assert len(monthly) == 2 and 179 in monthly
+		assert time.localtime(times[min(monthly)]).tm_mon == time.localtime(times[179]).tm_mon - 1
+		assert retained(times, last = 3, daily = 3) == {176, 177, 178, 179}
+
+	def test_upgrade(self):
+		db = Database(".", "password")
+		db.add_block("a", ["abc"])
+		os.remove(BackupStore.FORMAT)
+		for stamp, lines in [("230101000000", ["old"]), ("230102000000", ["old"]), ("230103000000", ["abc"])]:
+			db.storage.write(os.path.join(".backup", "a." + stamp), "".join(db.key.encrypt(line) + "\n" for line in lines).encode())
+		db.storage.write(os.path.join(".backup", "f", "b.230101000000"), db.storage.read("a"))
+		db.storage.flush()
+
+		db = Database(".", "password")
+		versions = db.backups.versions("a")
+		assert len(versions) == 4
+		assert versions[0][1] == versions[1][1]
+		assert versions[2][1] == versions[3][1]
+		assert len(db.backups.versions(os.path.join("f", "b"))) == 1
+		assert len(db.backups.objects()) == 2
+		assert db.backups.upgrade() == 0
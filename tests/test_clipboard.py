@@ -0,0 +1,53 @@
+import time
+import pytest
+
+from pypass import clipboard
+from pypass.clipboard import Clipboard
+
+
+@pytest.fixture(scope = "function")
+def clip(monkeypatch):
+	board = {"text": "old"}
+	monkeypatch.setattr(clipboard.pyperclip, "paste", lambda: board["text"])
+	monkeypatch.setattr(clipboard.pyperclip, "copy", lambda text: board.update(text = text))
+	return board
+
+class TestClipboard:
+
+	def wait(self, cb):
+		for i in range(200):
+			if not cb.pending():
+				return
+			time.sleep(0.01)
+		pytest.fail("Clipboard was not restored")
+
+	def test_restore(self, clip):
+		cb = Clipboard()
+		cb.copy("pw1", 0.05)
+		assert clip["text"] == "pw1"
+		self.wait(cb)
+		assert clip["text"] == "old"
+
+	def test_copy_again(self, clip):
+		cb = Clipboard()
+		cb.copy("pw1", 0.05)
+		cb.copy("pw2", 0.2) # replaces the first restore
+		time.sleep(0.1)
+		assert clip["text"] == "pw2"
+		self.wait(cb)
+		assert clip["text"] == "old"
+
+	def test_restore_now(self, clip):
+		cb = Clipboard()
+		cb.copy("pw1", 60)
+		assert cb.pending()
+		cb.restore()
+		assert not cb.pending()
+		assert clip["text"] == "old"
+
+	def test_changed_meanwhile(self, clip):
+		cb = Clipboard()
+		cb.copy("pw1", 0.05)
+		clip["text"] = "something else"
+		self.wait(cb)
+		assert clip["text"] == "something else"
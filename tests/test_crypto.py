@@ -1,8 +1,12 @@
 import os
+import time
+import base64
 import random
 import pytest
 
-from pypass.crypto import MasterKey, generate_password
+from pypass import kdf
+from pypass.crypto import MasterKey, generate_password, generate_passwords
+from cryptography.fernet import Fernet, InvalidToken
 
 @pytest.mark.usefixtures("cleandir")
 class TestCrypto:
@@ -10,18 +14,103 @@ class TestCrypto:
 	def test_init(self):
 		assert os.listdir() == []
 		key = MasterKey("pw")
-		assert os.listdir() == [".key", ".salt"]
-		assert key.bkey is not None
-		assert key.fkey is not None
+		assert os.listdir() == [".key"]
+		assert not key.locked()
+		assert len(key.keys()) == 1
 	
 	def test_save(self):
 		pass
+
+	def test_legacy(self):
+		# key file layout from before the header was added
+		salt = os.urandom(16)
+		bkey = Fernet.generate_key()
+		kek  = Fernet(base64.urlsafe_b64encode(kdf.PBKDF2().derive(b"pw", salt)))
+		with open(".salt", "wb") as f:
+			f.write(salt)
+		with open(".key", "wb") as f:
+			f.write(kek.encrypt(bkey))
+
+		key = MasterKey("pw")
+		assert key.keys() == [bkey]
+		assert os.listdir() == [".key"]
+		assert MasterKey("pw").keys() == [bkey]
+		with pytest.raises(ValueError):
+			MasterKey("wrong")
+
+	def test_calibrate(self):
+		key  = MasterKey("pw")
+		bkey = key.keys()[0]
+		assert key.kdf == kdf.PBKDF2()
+		new = key.calibrate(0.01, kdf.ScryptKDF.name)
+		assert new == kdf.ScryptKDF()
+
+		key = MasterKey("pw")
+		assert key.keys() == [bkey]
+		assert key.kdf == new
+		assert key.next is None
+		assert MasterKey("pw").keys() == [bkey]
+		assert kdf.PBKDF2.calibrate(0.01) == kdf.PBKDF2()
 	
 	def test_login(self):
 		pass
+
+	def test_rotate(self):
+		key  = MasterKey("pw")
+		old  = key.keys()[0]
+		code = key.encrypt("abc")
+		digest = key.digest("abc")
+		key.rotate()
+		key.save("pw")
+
+		key = MasterKey("pw")
+		assert key.keys()[1:] == [old] and key.keys()[0] != old
+		assert key.decrypt(code) == "abc"
+		assert Fernet(key.keys()[0]).decrypt(key.encrypt("xyz").encode()) == b"xyz"
+		assert key.digest("abc") == digest
+		with pytest.raises(ValueError):
+			key.verify("wrong")
+		key.verify("pw")
+
+		key.retire()
+		key.save("pw")
+		key = MasterKey("pw")
+		assert len(key.keys()) == 1
+		with pytest.raises(Exception):
+			key.decrypt(code)
+		assert key.digest("abc") == digest
 	
 	def test_encrypt_decrypt(self):
 		key = MasterKey("pw")
+		fernet = Fernet(key.keys()[0])
+		assert fernet.decrypt(key.encrypt("abc").encode()) == b"abc"
+		assert key.decrypt(fernet.encrypt(b"xyz").decode()) == "xyz"
+		with pytest.raises(InvalidToken):
+			key.decrypt(Fernet(Fernet.generate_key()).encrypt(b"xyz").decode())
+		with pytest.raises(InvalidToken):
+			key.decrypt("not a token")
+
+	def test_wipe(self, caplog):
+		key = MasterKey("pw")
+		data = key._data
+		key.lock()
+		assert key.locked() and data._secret.wiped()
+		with pytest.raises(ValueError):
+			data.encrypt("abc")
+		with pytest.raises(ValueError):
+			key.login("wrong")
+		assert "wrong" not in caplog.text
+
+	def test_timeout(self, helpers):
+		key = MasterKey("pw", timeout = 0.2)
+		code = key.encrypt("abc")
+		key.login() # still unlocked, so no prompt
+		os.remove(".key") # cached for the session
+		time.sleep(0.5)
+		assert key.locked()
+		with helpers.replace_stdin(["pw"]):
+			assert key.decrypt(code) == "abc"
+		assert not key.locked()
 	
 	def test_generate_password(self):
 		with pytest.raises(ValueError):
@@ -37,4 +126,35 @@ class TestCrypto:
 			if symbol is None:
 				assert any(c in passwd for c in "!@#$%^&*()-+=.,?<>_:{}|*/")
 			else:
-				assert all(c not in passwd for c in "!@#$%^&*()-+=.,?<>_:{}|*/")
\ No newline at end of file
+				assert all(c not in passwd for c in "!@#$%^&*()-+=.,?<>_:{}|*/")
+
+	def test_generate_passwords(self):
+		assert generate_passwords(0) == []
+		passwords = generate_passwords(50, 8, "!")
+		assert len(set(passwords)) == 50
+		assert all(len(p) == 8 and "!" in p for p in passwords)
+
+	def test_uniformity(self):
+		def chi2(counts, expected):
+			return sum((c - e) ** 2 / e for c, e in zip(counts, expected))
+		def limit(df, z = 5):
+			# Wilson-Hilferty: 5 standard deviations above the mean, so a correct generator fails about once in 3.5 million runs
+			return df * (1 - 2 / (9 * df) + z * (2 / (9 * df)) ** 0.5) ** 3
+
+		n, length = 20000, 10
+		charsets = ["abcdefghijkmnpqrstuvwxyz", "ABCDEFGHJKLMNPQRSTUVWXYZ", "23456789"]
+		alphabet = "".join(charsets)
+		passwords = generate_passwords(n, length, "")
+
+		# every character: one forced pick from its charset plus the free picks from the whole alphabet
+		counts = dict.fromkeys(alphabet, 0)
+		for p in passwords:
+			for c in p:
+				counts[c] += 1
+		expected = [n * (1 / len(group) + (length - len(charsets)) / len(alphabet)) for group in charsets for c in group]
+		assert chi2([counts[c] for c in alphabet], expected) < limit(len(alphabet) - 1)
+
+		# the shuffle puts digits anywhere
+		digits = [sum(p[i] in charsets[2] for p in passwords) for i in range(length)]
+		total = sum(digits)
+		assert chi2(digits, [total / length] * length) < limit(length - 1)
@@ -1,5 +1,8 @@
+import os
 import pytest
 
+from pypass import records
+from cryptography.fernet import Fernet, InvalidToken
 from pypass.database import Database
 
 
@@ -7,4 +10,178 @@ from pypass.database import Database
 class TestDatabase:
 	
 	def test_init(self):
-		db = Database(".", "password")
\ No newline at end of file
+		db = Database(".", "password")
+
+	def test_select(self, helpers):
+		db = Database(".", "password")
+		for account in ["gmail", "gmx", "aa", "aaa", "bank"]:
+			db.add_block(account, ["pw"])
+		assert db.select("bank") == "bank"
+		assert db.select("aa") == "aa" # exact name, even though "aaa" also matches
+		assert db.select("gml") == "gmail" # subsequence
+		with pytest.raises(ValueError):
+			db.select("xyz")
+		with helpers.replace_stdin(["1"]):
+			assert db.select("gm") == "gmx"
+		with helpers.replace_stdin(["a"]):
+			assert db.select("g") == "gmail"
+
+		# strict, as for rm, mv and edit: no subsequences, and no guessing
+		assert db.select("ban", strict = True) == "bank"
+		assert db.select("aa", strict = True) == "aa"
+		with pytest.raises(ValueError):
+			db.select("gml", strict = True)
+		with helpers.replace_stdin([""]):
+			with pytest.raises(EOFError):
+				db.select("gm", strict = True) # gmail or gmx, so ask
+
+	def test_upgrade(self):
+		db = Database(".", "password")
+		db.add_block("a", ["abc", "def"])
+		legacy = "".join(db.key.encrypt(line) + "\n" for line in ["xyz", "123"]).encode()
+		db.storage.write("a", legacy)
+		backup = db.backups.objects()[0]
+		db.storage.write(backup, legacy)
+		assert db.content("a") == ["xyz", "123"]
+
+		assert db.upgrade() == 1
+		assert not records.outdated(db.key, db.storage.read("a"))
+		assert records.version(db.storage.read(backup)) == 1
+		assert db.content("a") == ["xyz", "123"]
+		assert db.upgrade(backups = True) == 1
+		assert db.upgrade(backups = True) == 0
+
+	def test_cipher(self):
+		db = Database(".", "password")
+		db.add_block("a", ["abc", "note"])
+		db.add_block("b", ["xyz"])
+		assert db.upgrade(suite = "aes-256-gcm") == 2
+		assert db.storage.read("a").startswith(b"pypass:3:aes-256-gcm\n")
+
+		db = Database(".", "password")
+		assert db.key.suite == "aes-256-gcm"
+		db.add_block("c", ["new"])
+		db.add_block("a", ["abc", "changed"])
+		db.mv("b", "d" + os.sep + "b")
+		assert db.content("d" + os.sep + "b") == ["xyz"]
+		assert db.password("a") == "abc"
+		assert db.restore("a") > 0
+		assert db.content("a") == ["abc", "note"]
+		assert [db.version(digest) for t, digest in db.history("a")][-2:] == [["abc", "changed"], ["abc", "note"]]
+
+		# swapped files don't decrypt
+		data = db.storage.read("c")
+		db.storage.write("e", data)
+		with pytest.raises(InvalidToken):
+			db.content("e")
+		db.storage.write("c", data.replace(b"aes-256-gcm", b"chacha20-poly1305"))
+		with pytest.raises(InvalidToken):
+			db.content("c")
+		db.storage.write("c", data)
+		db.storage.remove("e")
+
+		# mixed vault
+		db.upgrade(suite = "fernet")
+		assert db.content("a") == ["abc", "note"]
+		assert records.version(db.storage.read("a")) == 2
+		bound = [name for name in db.backups.objects() if records.version(db.storage.read(name)) == 3]
+		assert 0 < len(bound) < len(db.backups.objects())
+		assert [db.version(digest) for t, digest in db.history("a")][-2:] == [["abc", "changed"], ["abc", "note"]]
+		assert db.upgrade(backups = True) == len(bound)
+
+	def test_password(self):
+		db = Database(".", "password")
+		db.add_block("a", ["abc"] + [f"note {i}" for i in range(100)])
+		calls = []
+		decrypt = db.key.decrypt
+		db.key.decrypt = lambda token: calls.append(token) or decrypt(token)
+		assert db.password("a") == "abc"
+		assert len(calls) == 1
+		assert list(db.lines("a")) == db.content("a")
+
+	def test_load_blocks(self):
+		db = Database(".", "password")
+		db.add_block("taken", ["pw"])
+		blocks = [[f"f{i % 3}{os.sep}a{i}", f"pw{i}", "note"] for i in range(50)]
+		blocks += [["taken", "pw"], ["blank", " "], [f"f0{os.sep}a0", "pw"], ["f1", "pw"]]
+		errors = []
+		totals = []
+		count = db.load_blocks(blocks, workers = 2, batch = 8, on_error = errors.append, progress = totals.append)
+		assert count == 50
+		assert len(errors) == 4
+		assert totals[-1] == 50
+		assert db.content(f"f2{os.sep}a14") == ["pw14", "note"]
+		assert len(db.backups.versions(f"f1{os.sep}a49")) == 1
+		assert set(Database(".", "password").index) == set(db.index)
+
+	def test_restore(self, monkeypatch):
+		db = Database(".", "password")
+		clock = {"now": 1000}
+		monkeypatch.setattr("time.time", lambda: clock["now"])
+		for lines in [["v1"], ["v2", "note"], ["v3"]]:
+			db.add_block("a", lines)
+			clock["now"] += 100
+		assert [t for t, digest in db.history("a")] == [1000, 1100, 1200]
+
+		assert db.restore("a") == 1100 # the latest that differs
+		assert db.content("a") == ["v2", "note"]
+		clock["now"] += 100
+		assert db.restore("a", 1050) == 1000
+		assert db.content("a") == ["v1"]
+		with pytest.raises(ValueError):
+			db.restore("a", 999)
+
+		# deleted and renamed accounts
+		db.mv("a", "b")
+		db.rm("b")
+		db = Database(".", "password")
+		assert db.restore("a", 1250) == 1200
+		assert db.content("a") == ["v3"]
+		assert db.restore("b") == 1400
+		assert db.content("b") == ["v1"]
+		assert db.accounts() == ["a", "b"]
+		with pytest.raises(ValueError):
+			db.restore("c")
+
+	def test_rekey(self, monkeypatch):
+		db = Database(".", "password")
+		for i in range(30):
+			db.add_block(f"f{i % 3}{os.sep}a{i}", [f"pw{i}", "note"])
+		db.add_block("a0", ["old"])
+		db.add_block("a0", ["new"])
+		old = db.key.keys()[0]
+
+		# interrupted after the first checkpoint
+		write_many = db.storage.write_many
+		calls = []
+		def crash(items):
+			calls.append(items)
+			if len(calls) == 3:
+				raise KeyboardInterrupt()
+			return write_many(items)
+		monkeypatch.setattr(db.storage, "write_many", crash)
+		with pytest.raises(KeyboardInterrupt):
+			db.rekey("password", backups = True, workers = 1, batch = 8, checkpoint = 16)
+		monkeypatch.undo()
+		with pytest.raises(ValueError):
+			db.rekey("wrong")
+
+		db = Database(".", "password")
+		new, *retired = db.key.keys()
+		assert new != old and retired == [old]
+		assert db.content("f1" + os.sep + "a4") == ["pw4", "note"]
+		count = db.rekey("password", workers = 1, batch = 8, checkpoint = 16)
+		assert 0 < count < 31 + 33 + 31 # resumed, with the backups as first asked
+
+		db = Database(".", "password")
+		assert db.key.keys() == [new]
+		assert not os.path.exists(".rekey")
+		for name in db.storage.names() + db.backups.objects() + db.backups.manifests():
+			for token in db.storage.read(name).splitlines()[-1:]:
+				with pytest.raises(InvalidToken):
+					Fernet(old).decrypt(token)
+		for i in range(30):
+			assert db.content(f"f{i % 3}{os.sep}a{i}") == [f"pw{i}", "note"]
+		assert [db.version(digest) for t, digest in db.history("a0")] == [["old"], ["new"]]
+		assert db.restore("a0") > 0
+		assert db.content("a0") == ["old"]
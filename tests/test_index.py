@@ -0,0 +1,58 @@
+import os
+import random
+import pytest
+
+from pypass.index import AccountIndex
+
+
+def _linear(names, filter = "", list_all = True):
+	matched = set()
+	for account in names:
+		if not list_all and os.sep in account:
+			account = account.split(os.sep)[0] + os.sep
+		if filter in account:
+			matched.add(account)
+	return sorted(matched)
+
+class TestIndex:
+
+	def test_search(self):
+		names = ["gmail", "AOL", "cc pin", f"shopping{os.sep}amazon", f"shopping{os.sep}ebay", f"a{os.sep}b{os.sep}c", "amazon"]
+		index = AccountIndex(names)
+		assert list(index) == sorted(names)
+		for filter in ["", "a", "am", "ama", "amazon", "shop", f"g{os.sep}a", "zzz", "c p"]:
+			for list_all in [True, False]:
+				assert index.search(filter, list_all) == _linear(names, filter, list_all)
+
+	def test_update(self):
+		rand  = random.Random(0)
+		parts = ["mail", "bank", "shop", "work", "home"]
+		names = set()
+		index = AccountIndex()
+		for i in range(500):
+			name = os.sep.join(rand.choice(parts) for j in range(rand.randint(1, 3))) + str(rand.randint(0, 50))
+			if name in names:
+				names.remove(name)
+				index.remove(name)
+			else:
+				names.add(name)
+				index.add(name)
+		assert list(index) == sorted(names)
+		for filter in ["", "1", "ma", "bank", f"{os.sep}sh", "ork2"]:
+			for list_all in [True, False]:
+				assert index.search(filter, list_all) == _linear(names, filter, list_all)
+
+	def test_isdir(self):
+		index = AccountIndex(["a", f"b{os.sep}c{os.sep}d"])
+		assert "a" in index
+		assert "b" not in index
+		assert index.isdir("b")
+		assert index.isdir(f"b{os.sep}c")
+		assert not index.isdir("a")
+		assert not index.isdir("c")
+
+		index.remove(f"b{os.sep}c{os.sep}d")
+		assert not index.isdir("b")
+		assert index.search("", False) == ["a"]
+		with pytest.raises(KeyError):
+			index.remove("b")
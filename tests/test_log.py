@@ -0,0 +1,83 @@
+import os
+import json
+import time
+import logging
+import pytest
+
+from pypass import log
+from pypass.log import configure_logging, stop_logging
+from pypass.database import Database
+from pypass.parser import Parser
+
+
+@pytest.fixture(autouse = True)
+def restore():
+	level = logging.getLogger().level
+	yield
+	stop_logging()
+	logging.getLogger().setLevel(level)
+
+@pytest.mark.usefixtures("cleandir")
+class TestLog:
+
+	def test_queue(self):
+		configure_logging("x.log")
+		logging.getLogger().info("hello")
+		logging.getLogger().debug("hidden")
+		stop_logging() # waits for the writer thread
+		with open("x.log") as f:
+			text = f.read()
+		assert "| INFO | hello" in text and "hidden" not in text
+		assert not log.auditing()
+
+	def test_rotate_size(self):
+		configure_logging("x.log", max_bytes = 200, backups = 2)
+		for i in range(30):
+			logging.getLogger().info(f"message {i:02}")
+		stop_logging()
+		assert sorted(os.listdir(".")) == ["x.log", "x.log.1", "x.log.2"]
+		assert all(os.path.getsize(name) <= 200 for name in os.listdir("."))
+		with open("x.log") as f:
+			assert "message 29" in f.read()
+
+	def test_rotate_days(self):
+		with open("x.log", "w") as f:
+			f.write("old\n")
+		old = time.time() - 2 * 86400
+		os.utime("x.log", (old, old))
+		configure_logging("x.log", days = 1)
+		logging.getLogger().info("new")
+		logging.getLogger().info("newer") # same day
+		stop_logging()
+		with open("x.log.1") as f:
+			assert f.read() == "old\n"
+		with open("x.log") as f:
+			assert len(f.readlines()) == 2
+
+	def test_audit(self, helpers):
+		db = Database(".", "password")
+		parser = Parser(db)
+		configure_logging(".log", audit = ".audit")
+		assert log.auditing()
+		with helpers.replace_stdin(["secretpassword", ""]):
+			parser.parse("add mail --no-clip")
+		parser.parse("mv mail gmail")
+		with pytest.raises(ValueError):
+			parser.parse("print nothing")
+		stop_logging()
+		assert not log.auditing()
+
+		with open(".audit") as f:
+			records = [json.loads(line) for line in f]
+		assert [(r["command"], r["args"], r["outcome"]) for r in records] == [
+			("add", {"account_name": "mail"}, "ok"),
+			("mv", {"account_name": "mail", "new_account_name": "gmail"}, "ok"),
+			("print", {"account_name": "nothing"}, "error"),
+		]
+		assert records[2]["error"] == "Error: No matching account."
+		assert all(r["ms"] >= 0 and "time" in r for r in records)
+		for name in [".audit", ".log"]:
+			with open(name) as f:
+				assert "secret" not in f.read()
+		with open(".log") as f:
+			assert "Audit" not in f.read()
@@ -0,0 +1,65 @@
+import os
+import time
+import pytest
+
+from pypass.match import Matcher, Usage
+from pypass.crypto import MasterKey
+
+
+@pytest.mark.usefixtures("cleandir")
+class TestMatch:
+
+	def test_score(self):
+		m = Matcher()
+		assert m.score("gml", "gmail") is not None
+		assert m.score("GMAIL", "gmail") == Matcher.EXACT
+		assert m.score("gmx", "gmail") is None
+		assert m.score("aaa", "aa") is None
+		# contiguous beats scattered, word starts beat word middles
+		assert m.score("mail", "gmail") > m.score("mail", "my-aim-list")
+		assert m.score("bank", "my bank") > m.score("bank", "embankment")
+		# matches in the account's own name beat matches in its folders
+		assert m.score("mail", f"mail{os.sep}bank") < m.score("mail", f"bank{os.sep}mail")
+
+	def test_rank(self):
+		m = Matcher()
+		names = ["gmail", f"work{os.sep}gmail", "gmx", "github"]
+		ranked = m.rank("gm", names)
+		assert [name for score, name in ranked][:2] == ["gmx", "gmail"]
+		assert "github" not in [name for score, name in ranked]
+		assert Matcher.decisive(m.rank("gmail", ["gmail", "gmx"]))
+		assert not Matcher.decisive(m.rank("gm", ["gmail", "gmx"]))
+
+	def test_usage(self):
+		key = MasterKey("pw")
+		usage = Usage(".", key)
+		m = Matcher(usage)
+		assert m.rank("mail", ["gmail", "hotmail"])[0][1] == "gmail"
+		usage.hit("hotmail")
+		usage.hit("hotmail")
+		assert m.rank("mail", ["gmail", "hotmail"])[0][1] == "hotmail"
+		assert not os.path.exists(Usage.FILENAME) # hits are only written by save()
+		usage.save()
+
+		usage = Usage(".", key)
+		assert usage.weight("hotmail") > 0
+		assert usage.weight("hotmail", time.time() + 2 * Usage.HALF_LIFE) < usage.weight("hotmail") / 3
+		usage.rename("hotmail", "outlook")
+		assert usage.weight("hotmail") == 0
+		usage.remove("outlook")
+		assert Usage(".", key).hits == {}
+
+	def test_usage_shared(self):
+		# e.g. an agent and a one-shot command, each counting hits
+		key = MasterKey("pw")
+		first  = Usage(".", key)
+		second = Usage(".", key)
+		first.hit("gmail")
+		second.hit("gmail")
+		second.hit("hotmail")
+		second.save()
+		first.hit("gmail")
+		first.save()
+		hits = Usage(".", key).hits
+		assert hits["gmail"][0] == 3
+		assert hits["hotmail"][0] == 1
@@ -1,7 +1,11 @@
 import os
+import json
+import asyncio
 import pytest
+from io import StringIO
 
 from pypass.database import Database
+from pypass import clipboard
 from pypass.parser import Parser
 
 
@@ -17,16 +21,14 @@ class TestParser:
 		try:			
 			with helpers.replace_stdin(["y", "newpassword"]):
 				parser.parse("master")
-			parser.db.key.bkey = None
-			parser.db.key.fkey = None
+			parser.db.key.lock()
 			parser.db.key.login("newpassword")
 		except Exception as e:
 			print(e)
 			assert 0
 		
 		with pytest.raises(ValueError):
-			parser.db.key.bkey = None
-			parser.db.key.fkey = None
+			parser.db.key.lock()
 			parser.db.key.login("password") # should be wrong by now
 	
 	def test_add(self, helpers, monkeypatch, parser):		
@@ -35,28 +37,28 @@ class TestParser:
 		parser.parse("add a -g")
 		assert clip.called
 		assert os.path.isfile("a")
-		assert any(f.startswith("a.") for f in os.listdir(".backup"))
+		assert parser.db.backups.versions("a")
 		
 		monkeypatch.setattr(Parser, "_clip_text", lambda: pytest.fail("Clipboard disabled"))
 		
 		with helpers.replace_stdin(["abc"]):
 			parser.parse("add aa --no-clip")
 			assert os.path.isfile("aa")
-			assert any(f.startswith("aa.") for f in os.listdir(".backup"))
+			assert parser.db.backups.versions("aa")
 		
 		with helpers.replace_stdin(["abc", "def"]):
 			parser.parse("add aaa -m --no-clip")
 			assert os.path.isfile("aaa")
-			assert any(f.startswith("aaa.") for f in os.listdir(".backup"))
+			assert parser.db.backups.versions("aaa")
 			
 		with helpers.replace_stdin():
 			parser.parse("add b/b -g --no-clip")
 			assert os.path.isfile("b/b")
-			assert any(f.startswith("b.") for f in os.listdir(".backup/b"))
+			assert parser.db.backups.versions(os.path.join("b", "b"))
 			
 			parser.parse("add b/bb -g --no-clip")
 			assert os.path.isfile("b/bb")
-			assert any(f.startswith("bb.") for f in os.listdir(".backup/b"))
+			assert parser.db.backups.versions(os.path.join("b", "bb"))
 			
 			with pytest.raises(ValueError):
 				parser.parse("add b -g --no-clip")
@@ -75,11 +77,11 @@ class TestParser:
 			
 			parser.parse("add c.com -g --no-clip")
 			assert os.path.isfile("c.com")
-			assert any(f.startswith("c.com.") for f in os.listdir(".backup"))
+			assert parser.db.backups.versions("c.com")
 			
 			parser.parse("add ' d d ' -g --no-clip")
 			assert os.path.isfile(" d d ")
-			assert any(f.startswith(" d d .") for f in os.listdir(".backup"))
+			assert parser.db.backups.versions(" d d ")
 	
 	def test_mv(self, helpers, monkeypatch, parser):		
 		monkeypatch.setattr(Parser, "_clip_text", lambda: pytest.fail("Clipboard disabled"))
@@ -88,27 +90,24 @@ class TestParser:
 			parser.parse("add a -g --no-clip")
 			parser.parse("mv a b")
 			assert not os.path.isfile("a")
-			assert not any(f.startswith("a.") for f in os.listdir(".backup"))
 			assert os.path.isfile("b")
-			assert any(f.startswith("b.") for f in os.listdir(".backup"))
+			# the history is shared with the new name
+			assert parser.db.backups.versions("b") == parser.db.backups.versions("a") != []
 			
 			parser.parse("mv b a/a")
 			assert not os.path.isfile("b")
-			assert not any(f.startswith("b.") for f in os.listdir(".backup"))
 			assert os.path.isfile("a/a")
-			assert any(f.startswith("a.") for f in os.listdir(".backup/a"))
+			assert parser.db.backups.versions(os.path.join("a", "a"))
 			
 			parser.parse("mv a b\\b") # autocompletes a
 			assert not os.path.isdir("a")
-			assert not os.path.isdir(".backup/a")
 			assert os.path.isfile("b/b")
-			assert any(f.startswith("b.") for f in os.listdir(".backup/b"))
+			assert parser.db.backups.versions(os.path.join("b", "b"))
 			
 			parser.parse("mv b/b a/a/a")
 			assert not os.path.isdir("b")
-			assert not os.path.isdir(".backup/b")
 			assert os.path.isfile("a/a/a")
-			assert any(f.startswith("a.") for f in os.listdir(".backup/a/a"))
+			assert parser.db.backups.versions(os.path.join("a", "a", "a"))
 	
 	def test_rm(self, helpers, monkeypatch, parser):		
 		monkeypatch.setattr(Parser, "_clip_text", lambda: pytest.fail("Clipboard disabled"))
@@ -117,13 +116,37 @@ class TestParser:
 			parser.parse("add aa -g --no-clip")
 			parser.parse("rm a")
 			assert not os.path.isfile("aa")
-			assert any(f.startswith("aa.") for f in os.listdir(".backup"))
+			assert parser.db.backups.versions("aa")
 		
 		with helpers.replace_stdin():
 			parser.parse("add aa/a -g --no-clip")
 			parser.parse("rm a -y")
 			assert not os.path.isdir("aa")
-			assert any(f.startswith("a.") for f in os.listdir(".backup/aa"))
+			assert parser.db.backups.versions(os.path.join("aa", "a"))
+	
+	def test_history_restore(self, capsys, helpers, parser):
+		with helpers.replace_stdin(["old"]):
+			parser.parse("add acc --no-clip")
+		with helpers.replace_stdin(["new"]):
+			parser.parse("edit acc --no-clip")
+		capsys.readouterr()
+		parser.parse("history ac -p")
+		out = capsys.readouterr().out.splitlines()
+		assert out[0] == ">>>>>>> acc"
+		assert out[1] == "History of acc:"
+		assert out[2].endswith("  new  (current)") and out[3].endswith("  old")
+
+		parser.parse("rm acc -y")
+		parser.parse("restore acc")
+		assert parser.db.content("acc") == ["new"]
+		parser.parse("restore acc --at 0m")
+		assert parser.db.content("acc") == ["new"]
+		with pytest.raises(ValueError):
+			parser.parse("restore acc --at '2001-01-01 12:00'")
+		with pytest.raises(EOFError):
+			parser.parse("restore acc --at never")
+		parser.parse("restore acc")
+		assert parser.db.content("acc") == ["old"]
 	
 	def test_ls(self, capsys, helpers, parser):			
 		parser.parse("ls")
@@ -140,6 +163,50 @@ class TestParser:
 		captured = capsys.readouterr()
 		assert captured.out == helpers.lines_str(["", "Accounts:", "  aaa", "  new account", ""])
 	
+	def test_profile(self, capsys, parser):
+		from pypass import timing
+		parser.parse("add aaa -g --no-clip")
+		capsys.readouterr()
+		parser.parse("--profile print aaa")
+		captured = capsys.readouterr()
+		assert "aaa" in captured.out and "Profile" not in captured.out
+		assert captured.err.splitlines()[0].startswith("Profile of 'print': ")
+		assert {"print", "read", "decrypt"} <= {line.split()[-1] for line in captured.err.splitlines()[2:]}
+		assert not timing.enabled()
+
+		parser.parse("--trace trace.json print aaa")
+		assert capsys.readouterr().err == ""
+		with open("trace.json") as f:
+			assert "print" in [e["name"] for e in json.load(f)["traceEvents"]]
+		assert not timing.enabled()
+
+	def test_batch(self, capsys, parser):
+		script = [
+			"# provisioning",
+			"add mail -g --no-clip",
+			"",
+			"add bank -g 20 --no-clip",
+			"add notes --no-clip", # would ask for the password
+			"mv mail gmail",
+			"rm bank", # would ask to confirm
+			"rm -y gml", # no guessing which account to delete
+			"ls",
+			"mv",
+			"print nothing",
+		]
+		results = list(parser.batch(script))
+		assert [(r["line"], r["outcome"]) for r in results] == [
+			(2, "ok"), (4, "ok"), (5, "error"), (6, "ok"), (7, "ok"), (8, "error"), (9, "ok"), (10, "error"), (11, "error")]
+		assert "input" in results[2]["error"]
+		assert results[5]["error"] == "Error: No matching account."
+		assert "required" in results[7]["error"]
+		assert results[8]["error"] == "Error: No matching account."
+		assert results[6]["output"] == "\nAccounts:\n  gmail\n\n"
+		assert all(r["ms"] >= 0 for r in results)
+		assert parser.db.accounts() == ["gmail"]
+		assert capsys.readouterr().out == ""
+		assert not parser.assume_yes
+
 	def test_print_account(self, helpers, capsys, monkeypatch, parser):		
 		monkeypatch.setattr(Parser, "_clip_text", lambda: pytest.fail("Clipboard disabled"))
 		
@@ -264,4 +331,36 @@ even more
 		monkeypatch.setattr(Parser, "_clip_text", clip.call)
 		parser.parse("copy x")
 		assert clip.called
-		assert clip.args[0] == "passwd_xyz"
\ No newline at end of file
+		assert clip.args[0] == "passwd_xyz"
+
+	def test_export(self, helpers, capsys, parser):
+		with helpers.replace_stdin(["abc", "def", "ghi"]):
+			parser.parse("add x/aa -m --no-clip")
+		with helpers.replace_stdin(["xyz"]):
+			parser.parse("add bb --no-clip")
+		capsys.readouterr()
+
+		parser.parse("export")
+		captured = capsys.readouterr()
+		assert captured.out == helpers.lines_str(["bb", "xyz", "", "x/aa", "abc", "def", "ghi", ""])
+		assert list(Parser._read_blocks(StringIO(captured.out))) == [["bb", "xyz"], [f"x{os.sep}aa", "abc", "def", "ghi"]]
+
+		parser.parse("export a -f jsonl -w 2")
+		captured = capsys.readouterr()
+		assert json.loads(captured.out) == {"account": "x/aa", "password": "abc", "notes": ["def", "ghi"]}
+
+	def test_run(self, monkeypatch, capsys, parser):
+		board = {"text": "old"}
+		monkeypatch.setattr(clipboard.pyperclip, "paste", lambda: board["text"])
+		monkeypatch.setattr(clipboard.pyperclip, "copy", lambda text: board.update(text = text))
+		async def session():
+			await parser.run("add a -g -t 60")
+			password = board["text"]
+			# the restore is pending, but commands still run
+			await asyncio.gather(parser.run("print a"), parser.run("ls"))
+			return password
+		password = asyncio.run(session())
+		assert password in capsys.readouterr().out
+		assert parser.clipboard.pending()
+		parser.clipboard.restore()
+		assert board["text"] == "old"
@@ -0,0 +1,62 @@
+import pytest
+
+from pypass import records
+from pypass.crypto import MasterKey
+from cryptography.fernet import InvalidToken
+
+
+@pytest.mark.usefixtures("cleandir")
+class TestRecords:
+
+	def test_encode_decode(self):
+		key = MasterKey("pw")
+		lines = ["passwd", "user: someone", "", "notes"]
+		data = records.encode(key, lines)
+		assert not records.outdated(key, data)
+		assert records.decode(key, data) == lines
+
+	def test_legacy(self):
+		key = MasterKey("pw")
+		lines = ["passwd", "user: someone", "more notes", "even more notes"]
+		legacy = "".join(key.encrypt(line) + "\n" for line in lines).encode()
+		assert records.version(legacy) == 1
+		assert records.decode(key, legacy) == lines
+		# at most two tokens, however many lines
+		assert len(records.encode(key, lines)) < len(legacy) * 2 / 3
+
+	def test_newer_version(self):
+		key = MasterKey("pw")
+		data = records.encode(key, ["passwd"]).replace(b"pypass:2", b"pypass:99")
+		with pytest.raises(ValueError):
+			records.decode(key, data)
+
+	def test_iter_decode(self):
+		key = MasterKey("pw")
+		lines = ["passwd"] + [f"note {i}" for i in range(100)]
+		data = records.encode(key, lines)
+		assert len(data.splitlines()) == 3
+		calls = []
+		decrypt = key.decrypt
+		key.decrypt = lambda token: calls.append(token) or decrypt(token)
+		assert next(records.iter_decode(key, data.splitlines())) == "passwd"
+		assert len(calls) == 1
+		assert list(records.iter_decode(key, data.splitlines())) == lines
+		assert records.decode(key, records.encode(key, ["passwd"])) == ["passwd"]
+
+	def test_suites(self):
+		key = MasterKey("pw")
+		lines = ["passwd", "notes"]
+		fernet = records.encode(key, lines, "a")
+		key.set_suite("chacha20-poly1305")
+		data = records.encode(key, lines, "a")
+		assert data.startswith(b"pypass:3:chacha20-poly1305\n")
+		assert len(data) < len(fernet)
+		assert records.decode(key, data, "a") == lines
+		with pytest.raises(InvalidToken):
+			records.decode(key, data, "b")
+		assert records.decode(key, fernet, "b") == lines # not bound to its name
+		assert records.outdated(key, fernet) and not records.outdated(key, data)
+		assert records.rebind(key, fernet, "a", "b") is fernet
+		assert records.decode(key, records.rebind(key, data, "a", "b"), "b") == lines
+		with pytest.raises(ValueError):
+			records.decode(key, data.replace(b"chacha20-poly1305", b"rot13"))
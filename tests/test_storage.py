@@ -0,0 +1,231 @@
+import os
+import sys
+import subprocess
+import pytest
+
+from pypass.database import Database
+from pypass.journal import Journal
+from pypass.storage import DirectoryStorage, PackedStorage, NameIndex, open_storage, migrate
+
+
+@pytest.fixture(scope = "function", params = [DirectoryStorage, PackedStorage])
+def storage(request):
+	return request.param(".")
+
+def dead_pid():
+	p = subprocess.Popen([sys.executable, "-c", ""])
+	p.wait()
+	return p.pid
+
+@pytest.mark.usefixtures("cleandir")
+class TestStorage:
+
+	def test_read_write(self, storage):
+		storage.write("a", b"abc\n")
+		storage.write(os.path.join("b", "b"), b"def\n")
+		storage.flush()
+		assert storage.read("a") == b"abc\n"
+		assert storage.read(os.path.join("b", "b")) == b"def\n"
+		assert storage.exists("a")
+		assert not storage.exists("b")
+		assert storage.isdir("b")
+		assert not storage.isdir("a")
+
+		storage.write("a", b"xyz\n")
+		assert storage.read("a") == b"xyz\n"
+
+		storage.remove("a")
+		assert not storage.exists("a")
+		with pytest.raises(FileNotFoundError):
+			storage.read("a")
+
+	def test_copy_rename(self, storage):
+		storage.write("a", b"abc\n")
+		backup = os.path.join(".backup", "a")
+		storage.copy("a", backup)
+		storage.write("a", b"xyz\n")
+		assert storage.read(backup) == b"abc\n"
+
+		assert storage.names() == ["a"]
+		assert storage.backups() == [backup]
+
+		storage.rename("a", os.path.join("c", "c"))
+		storage.flush()
+		assert not storage.exists("a")
+		assert storage.read(os.path.join("c", "c")) == b"xyz\n"
+		assert storage.names() == [os.path.join("c", "c")]
+		assert storage.backups() == [backup]
+
+	def test_packed_reopen(self):
+		storage = PackedStorage(".")
+		storage.write("a", b"abc\n")
+		storage.copy("a", os.path.join(".backup", "a"))
+		storage.flush()
+		storage.write("b", b"unflushed\n")
+
+		storage = PackedStorage(".")
+		assert storage.read("a") == b"abc\n"
+		assert not storage.exists("b")
+
+		size = os.path.getsize(PackedStorage.FILENAME)
+		storage.write("a", b"xyz\n")
+		storage.flush()
+		storage.compact()
+		assert os.path.getsize(PackedStorage.FILENAME) < size
+		assert PackedStorage(".").read("a") == b"xyz\n"
+
+	def test_packed_bounded(self, monkeypatch):
+		monkeypatch.setattr(PackedStorage, "SLACK", 4096)
+		storage = PackedStorage(".")
+		for i in range(50):
+			storage.write(f"account{i}", b"x" * 100)
+		storage.flush()
+		sizes = []
+		for i in range(500):
+			storage.write("account0", b"y" * 100)
+			storage.copy_many([("account0", f".backup{i % 10}")])
+			storage.flush()
+			sizes.append(os.path.getsize(PackedStorage.FILENAME))
+			assert storage.size == sizes[-1]
+		# compacted along the way, never more than about twice its live size
+		assert min(sizes[-100:]) < max(sizes[-100:])
+		assert max(sizes) <= 2 * storage.live + 4096 + 2 * 1000
+		reopened = PackedStorage(".")
+		assert reopened.read("account0") == b"y" * 100
+		assert reopened.read(".backup9") == b"y" * 100
+		assert len(reopened.names()) == 50
+		assert reopened.live == storage.live
+
+	def test_packed_shared(self):
+		# e.g. an agent and a one-shot command, each with the vault open
+		first  = PackedStorage(".")
+		first.write("a", b"abc\n")
+		first.write("b", b"def\n")
+		first.flush()
+		second = PackedStorage(".")
+		first.write("c", b"ghi\n")
+		first.copy("a", ".backup1")
+		second.write("d", b"jkl\n")
+		second.remove("b")
+		second.flush()
+		second.compact() # moves every record first knows of
+		first.flush()
+		assert first.read("d") == b"jkl\n"
+		assert not first.exists("b")
+		reopened = PackedStorage(".")
+		assert sorted(reopened.names()) == ["a", "c", "d"]
+		assert reopened.read("a") == b"abc\n"
+		assert reopened.read(".backup1") == b"abc\n"
+		assert reopened.read("c") == b"ghi\n"
+		# reads notice the vault was replaced
+		first.compact()
+		assert second.read("a") == b"abc\n"
+		assert second.read("c") == b"ghi\n"
+
+	def test_migrate(self):
+		db = Database(".", "password")
+		db.add_block("a", ["abc", "def"])
+		db.add_block(os.path.join("b", "b"), ["xyz"])
+		backups = sorted(db.storage.backups())
+
+		db.migrate("packed")
+		assert isinstance(db.storage, PackedStorage)
+		assert not os.path.exists("a")
+		assert not os.path.exists(".backup")
+		assert isinstance(open_storage("."), PackedStorage)
+
+		db = Database(".", "password")
+		assert db.content("a") == ["abc", "def"]
+		assert db.accounts() == ["a", os.path.join("b", "b")]
+		assert sorted(db.storage.backups()) == backups
+
+		db.migrate("dir")
+		assert isinstance(db.storage, DirectoryStorage)
+		assert not os.path.exists(PackedStorage.FILENAME)
+		assert db.content(os.path.join("b", "b")) == ["xyz"]
+		assert os.path.isfile(backups[0])
+
+	def test_name_index(self, monkeypatch):
+		db = Database(".", "password")
+		db.add_block("a", ["abc"])
+		db.add_block(os.path.join("b", "b"), ["def"])
+		db.mv("a", os.path.join("c", "c"))
+		db.rm(os.path.join("b", "b"))
+		names = set(db.index)
+		assert os.path.isfile(NameIndex.FILENAME)
+		assert b"abc" not in open(NameIndex.FILENAME, "rb").read()
+
+		# a fresh index is trusted without walking the tree
+		scan = DirectoryStorage._scan
+		monkeypatch.setattr(DirectoryStorage, "_scan", lambda self: pytest.fail("Rescanned"))
+		db = Database(".", "password")
+		assert set(db.index) == names
+
+		# backups are only listed on demand; saving and reading history doesn't need them
+		db.add_block(os.path.join("c", "c"), ["def"])
+		versions = db.backups.versions(os.path.join("c", "c"))
+		assert len(versions) == 2
+		assert not db.storage.backup_index.loaded
+		db = Database(".", "password")
+		assert db.backups.versions(os.path.join("c", "c")) == versions
+		assert len(db.storage.backups()) > 0
+		assert db.storage.backup_index.loaded
+
+		# a change made behind pypass's back forces a rescan
+		monkeypatch.setattr(DirectoryStorage, "_scan", scan)
+		with open(os.path.join("c", "d"), "w") as f:
+			f.write(db.key.encrypt("xyz") + "\n")
+		db = Database(".", "password")
+		assert set(db.index) == names | {os.path.join("c", "d")}
+
+	def test_journal_recover(self, monkeypatch):
+		storage = DirectoryStorage(".")
+		storage.write("a", b"abc\n")
+		storage.flush()
+
+		# a crash before the commit line is written loses the whole group
+		pid = dead_pid()
+		with monkeypatch.context() as m:
+			m.setattr(os, "getpid", lambda: pid)
+			storage.write("a", b"lost\n")
+			storage.write("b", b"lost\n")
+		storage.journal.ops = []
+		storage = DirectoryStorage(".")
+		assert storage.read("a") == b"abc\n"
+		assert not storage.exists("b")
+		assert os.listdir(Journal.DIRNAME) == [Journal.LOCKNAME]
+
+		# a crash after it is finished on the next open
+		applied = []
+		def crash(op, name, arg):
+			if applied:
+				raise KeyboardInterrupt()
+			applied.append(name)
+			DirectoryStorage._apply(storage, op, name, arg)
+		storage.write(os.path.join("b", "b"), b"def\n")
+		storage.write("d", b"xyz\n")
+		storage.rename("a", "c")
+		monkeypatch.setattr(storage, "_apply", crash)
+		with pytest.raises(KeyboardInterrupt):
+			storage.flush()
+		assert not os.path.exists("d")
+
+		storage = DirectoryStorage(".")
+		assert storage.read(os.path.join("b", "b")) == b"def\n"
+		assert storage.read("d") == b"xyz\n"
+		assert storage.read("c") == b"abc\n"
+		assert not storage.exists("a")
+		assert os.listdir(Journal.DIRNAME) == [Journal.LOCKNAME]
+
+	def test_journal_shared(self):
+		# e.g. an agent and a one-shot command, each with changes staged
+		first  = DirectoryStorage(".")
+		first.write("a", b"abc\n")
+		second = DirectoryStorage(".")
+		second.write("b", b"def\n")
+		second.flush()
+		third = DirectoryStorage(".") # recovers, and must leave the first group alone
+		first.flush()
+		assert third.read("a") == b"abc\n"
+		assert third.read("b") == b"def\n"
+		assert os.listdir(Journal.DIRNAME) == [Journal.LOCKNAME]
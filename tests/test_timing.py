@@ -0,0 +1,74 @@
+import json
+import time
+import pytest
+
+from pypass import timing
+
+
+@pytest.fixture(autouse = True)
+def off():
+	timing.disable()
+	yield
+	timing.disable()
+
+@pytest.mark.usefixtures("cleandir")
+class TestTiming:
+
+	def test_disabled(self):
+		assert not timing.enabled()
+		assert timing.span("a") is timing.span("b", x = 1)
+		with timing.span("a"):
+			pass
+		assert timing.report("nothing") == []
+		timing.write_trace("trace.json")
+		assert not timing.enabled()
+
+	def test_report(self):
+		timing.enable()
+		with timing.span("outer"):
+			time.sleep(0.01)
+			for i in range(3):
+				with timing.span("inner"):
+					time.sleep(0.01)
+		lines = timing.report("'test'")
+		assert lines[0].startswith("Profile of 'test': ")
+		rows = {line.split()[-1]: line.split()[:-1] for line in lines[2:]}
+		assert list(rows) == ["outer", "inner"]
+		total, own, calls = rows["outer"]
+		assert int(calls) == 1
+		assert float(own) < float(total) * 0.5
+		total, own, calls = rows["inner"]
+		assert int(calls) == 3
+		assert float(own) == float(total)
+
+		# only what was recorded since
+		with timing.span("later"):
+			pass
+		assert [line.split()[-1] for line in timing.report("again")[2:]] == ["later"]
+
+	def test_trace(self):
+		timing.enable()
+		with timing.span("outer", accounts = 2):
+			with timing.span("inner"):
+				pass
+		timing.write_trace("trace.json")
+		with open("trace.json") as f:
+			events = json.load(f)["traceEvents"]
+		assert [e["name"] for e in events] == ["inner", "outer"]
+		inner, outer = events
+		assert all(e["ph"] == "X" for e in events)
+		assert outer["ts"] <= inner["ts"] and inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+		assert outer["args"] == {"accounts": "2"}
+
+	def test_requested(self, monkeypatch):
+		monkeypatch.delenv("PYPASS_PROFILE", raising = False)
+		monkeypatch.delenv("PYPASS_TRACE", raising = False)
+		assert timing.requested(["ls"]) == (False, None)
+		assert timing.requested(["--profile", "ls"]) == (True, None)
+		assert timing.requested(["--trace", "t.json", "ls"]) == (True, "t.json")
+		assert timing.requested(["--trace=t.json", "ls"]) == (True, "t.json")
+		monkeypatch.setenv("PYPASS_PROFILE", "1")
+		assert timing.requested(["ls"]) == (True, None)
+		monkeypatch.setenv("PYPASS_PROFILE", "0")
+		monkeypatch.setenv("PYPASS_TRACE", "t.json")
+		assert timing.requested(["ls"]) == (True, "t.json")